@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Download pipeline benchmarks for the model downloader
+Runs download scenarios end to end, from a POST to /api/download-model
+through the queue and download_file() to the finished file, against the
+stand-in file server in file_server.py, and writes the results as JSON so
+runs of different commits can be compared.
+
+Every scenario runs in a fresh worker process, so CPU time and peak RSS
+belong to that scenario alone and no state carries over between them. The
+file server runs in its own process and doesn't count towards either.
+
+    python src/benchmarks/download_benchmark.py --output before.json
+    python src/benchmarks/download_benchmark.py --output after.json --compare before.json
+
+The downloader settings (COMFY_DOWNLOAD_CONNECTIONS etc.) are read from the
+environment as usual.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCHMARK_DIR))
+DOWNLOADER_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'custom_nodes', 'model_downloader')
+
+MB = 1024 * 1024
+
+# Scenarios as (description, number of files, file size in MB, server options, request fields, downloader settings)
+SCENARIOS = {
+    'single_large': ('One large file, segmented download', 1, 512, {}, {}, {}),
+    'single_stream': ('One large file from a server without range support', 1, 256, {'ranges': 0}, {}, {}),
+    'many_small': ('Many small files through the queue', 64, 4, {}, {}, {}),
+    'concurrent': ('Several large files at once', 6, 96, {}, {}, {}),
+    'limited_bandwidth': ('Bandwidth limited server with 50 ms latency', 2, 32, {'rate': 16, 'latency': 0.05}, {}, {}),
+    'flaky': ('Connections dropped mid-file and resumed', 1, 128, {'fail_after': 2 * MB, 'fails': 2}, {}, {}),
+    'stalled': ('Connections stalling mid-file and reconnected', 1, 128, {'stall_after': 2 * MB, 'fails': 2},
+                {}, {'COMFY_DOWNLOAD_STALL_TIMEOUT': '2'}),
+}
+
+# Interval of the event loop lag probe in seconds
+LAG_INTERVAL = 0.01
+
+# Interval at which the worker checks whether the downloads finished
+POLL_INTERVAL = 0.02
+
+# Result fields compared by --compare and whether higher values are better
+COMPARED_FIELDS = [
+    ('throughput_mb_s', True),
+    ('cpu_seconds_per_gb', False),
+    ('peak_rss_mb', False),
+    ('loop_lag_p99_ms', False),
+    ('loop_lag_max_ms', False),
+]
+
+logger = logging.getLogger('benchmark')
+
+def install_comfy_stand_ins(models_dir):
+    """
+    Register minimal stand-ins for ComfyUI's server and folder_paths modules.
+    The downloader only needs a model folder to write to and a PromptServer
+    to broadcast progress to, importing ComfyUI itself would load torch and
+    every node.
+    """
+    folder_paths = types.ModuleType('folder_paths')
+    folder_paths.models_dir = models_dir
+    folder_paths.folder_names_and_paths = {
+        folder: ([os.path.join(models_dir, folder)], set())
+        for folder in ('checkpoints', 'loras', 'vae', 'upscale_models')
+    }
+
+    def get_folder_paths(folder_name):
+        return folder_paths.folder_names_and_paths[folder_name][0][:]
+
+    def get_full_path(folder_name, filename):
+        for path in folder_paths.folder_names_and_paths.get(folder_name, ([], set()))[0]:
+            full_path = os.path.join(path, filename)
+            if os.path.isfile(full_path):
+                return full_path
+        return None
+
+    folder_paths.get_folder_paths = get_folder_paths
+    folder_paths.get_full_path = get_full_path
+    for paths, _ in folder_paths.folder_names_and_paths.values():
+        os.makedirs(paths[0], exist_ok=True)
+
+    class BenchmarkPromptServer:
+        def __init__(self):
+            self.app = None
+            self.loop = None
+            self.sockets = {}
+            self.prompt_queue = None
+            self.messages = 0
+
+        def send_sync(self, event, data, sid=None):
+            self.messages += 1
+
+    server = types.ModuleType('server')
+    server.PromptServer = type('PromptServer', (), {'instance': BenchmarkPromptServer()})
+
+    sys.modules['folder_paths'] = folder_paths
+    sys.modules['server'] = server
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping for LAG_INTERVAL"""
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        if not self.samples:
+            return {'loop_lag_mean_ms': 0.0, 'loop_lag_p99_ms': 0.0, 'loop_lag_max_ms': 0.0}
+        samples = sorted(self.samples)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        return {
+            'loop_lag_mean_ms': round(statistics.fmean(samples) * 1000, 3),
+            'loop_lag_p99_ms': round(p99 * 1000, 3),
+            'loop_lag_max_ms': round(samples[-1] * 1000, 3)
+        }
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+def scenario_files(name, server, scale):
+    """The (url, filename, size) of every file a scenario downloads"""
+    _, count, size_mb, server_options, _, _ = SCENARIOS[name]
+    size = max(1, int(size_mb * MB * scale))
+    # The run parameter gives every worker its own URLs, so injected faults aren't used up by earlier runs
+    query = '&'.join(f"{key}={value}" for key, value in dict(server_options, run=os.getpid()).items())
+    files = []
+    for index in range(count):
+        filename = f"{name}_{index}.bin"
+        url = f"{server}/files/{size}/{filename}?{query}"
+        files.append((url, filename, size))
+    return files
+
+async def run_scenario(downloader, name, server, scale, timeout):
+    """Download every file of a scenario through /api/download-model and measure it"""
+    from aiohttp import web, ClientSession
+
+    _, _, _, _, request_fields, _ = SCENARIOS[name]
+    files = scenario_files(name, server, scale)
+
+    # Serve the download endpoint the way ComfyUI does, so requests go through the real handler
+    app = web.Application()
+    app.router.add_post('/api/download-model', downloader.download_model)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    api_url = f"http://127.0.0.1:{runner.addresses[0][1]}/api/download-model"
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+
+    async with ClientSession() as client:
+        async def request_download(url, filename):
+            body = dict(request_fields, url=url, folder='checkpoints', filename=filename)
+            async with client.post(api_url, json=body) as response:
+                result = await response.json()
+            if not result.get('success'):
+                raise Exception(f"Download request for {filename} failed: {result.get('error')}")
+            return result['download_id']
+
+        download_ids = await asyncio.gather(*[request_download(url, filename) for url, filename, _ in files])
+
+    # Wait until every download reached a final status
+    deadline = started + timeout
+    while True:
+        records = [downloader.download_store.get(download_id) or {} for download_id in download_ids]
+        if all(record.get('status') in downloader.FINISHED_STATUSES for record in records):
+            break
+        if time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+
+    elapsed = time.perf_counter() - started
+    cpu_used = cpu_seconds() - cpu_before
+    await monitor.stop()
+    await runner.cleanup()
+    await downloader.close_download_session()
+
+    completed = 0
+    downloaded = 0
+    errors = []
+    for record, (_, filename, size) in zip(records, files):
+        path = record.get('path')
+        if record.get('status') == 'completed' and path and os.path.getsize(path) == size:
+            completed += 1
+            downloaded += size
+        else:
+            errors.append(f"{filename}: {record.get('status')} {record.get('error') or ''}".strip())
+
+    gigabytes = downloaded / (1024 * MB)
+    result = {
+        'scenario': name,
+        'files': len(files),
+        'completed': completed,
+        'bytes': downloaded,
+        'seconds': round(elapsed, 3),
+        'throughput_mb_s': round(downloaded / MB / elapsed, 2) if elapsed else 0.0,
+        'cpu_seconds': round(cpu_used, 3),
+        'cpu_seconds_per_gb': round(cpu_used / gigabytes, 3) if gigabytes else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'retries': int(sum(downloader.download_metrics.RETRIES.values.values())),
+        'errors': errors
+    }
+    result.update(monitor.summary())
+    return result
+
+def run_worker(name, server, scale, timeout, verbose):
+    """Run one scenario in this process and print its result as JSON"""
+    work_dir = tempfile.mkdtemp(prefix='model_downloader_benchmark_')
+    try:
+        # Keep the history database and the downloaded files out of the real user directory
+        os.environ['COMFY_USER_DIR'] = work_dir
+        os.environ['COMFY_DOWNLOAD_HISTORY'] = os.path.join(work_dir, 'download_history.db')
+        os.environ.pop('COMFY_DOWNLOAD_PEERS', None)
+        os.environ.update(SCENARIOS[name][5])
+        install_comfy_stand_ins(os.path.join(work_dir, 'models'))
+        sys.path.insert(0, DOWNLOADER_DIR)
+        import model_downloader_patch as downloader
+        logging.getLogger('model_downloader').setLevel(logging.INFO if verbose else logging.WARNING)
+
+        result = asyncio.run(run_scenario(downloader, name, server, scale, timeout))
+        downloader.download_store.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(result))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_file_server():
+    """Start file_server.py in its own process, returns the process and its base URL"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARK_DIR, 'file_server.py'), '--port', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The benchmark file server did not start")
+
+def run_in_worker(name, server, args):
+    command = [
+        sys.executable, os.path.realpath(__file__), '--worker', name, '--server', server,
+        '--scale', str(args.scale), '--timeout', str(args.timeout)
+    ]
+    if args.verbose:
+        command.append('--verbose')
+    completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {'scenario': name, 'errors': [f"Worker exited with status {completed.returncode}"]}
+    return json.loads(lines[-1])
+
+def summarize(runs):
+    """Median of every numeric field over the runs of a scenario"""
+    summary = {'scenario': runs[0]['scenario'], 'runs': len(runs)}
+    for key, value in runs[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values = [run[key] for run in runs if isinstance(run.get(key), (int, float))]
+            summary[key] = round(statistics.median(values), 3) if values else None
+    summary['errors'] = [error for run in runs for error in run.get('errors', [])]
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def print_comparison(results, baseline):
+    """Print the change of every compared field relative to a previous result file"""
+    baseline_results = {summary['scenario']: summary for summary in baseline.get('scenarios', [])}
+    print(f"Compared to {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for summary in results['scenarios']:
+        previous = baseline_results.get(summary['scenario'])
+        if previous is None:
+            continue
+        changes = []
+        for field, higher_is_better in COMPARED_FIELDS:
+            old, new = previous.get(field), summary.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            changes.append(f"{field} {old} -> {new} ({change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})")
+        print(f"  {summary['scenario']}: " + ', '.join(changes), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the model downloader against a local file server')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, can be repeated (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario, results are the median (default: 1)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Factor applied to all file sizes (default: 1.0)')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds after which a scenario is abandoned (default: 600)')
+    parser.add_argument('--output', help='Write the results to this JSON file instead of stdout')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    parser.add_argument('--list', action='store_true', help='List the scenarios and exit')
+    parser.add_argument('--verbose', action='store_true', help='Show the downloader log')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.worker:
+        run_worker(args.worker, args.server, args.scale, args.timeout, args.verbose)
+        return
+
+    if args.list:
+        for name, (description, count, size_mb, _, _, _) in SCENARIOS.items():
+            print(f"{name}: {description} ({count} x {size_mb * args.scale:g} MB)")
+        return
+
+    names = args.scenario or list(SCENARIOS)
+    server_process, server = start_file_server()
+    scenarios = []
+    try:
+        for name in names:
+            runs = []
+            for run in range(args.repeat):
+                logger.info(f"Running {name} ({run + 1}/{args.repeat})")
+                runs.append(run_in_worker(name, server, args))
+            summary = summarize(runs)
+            summary['description'] = SCENARIOS[name][0]
+            if args.repeat > 1:
+                summary['all_runs'] = runs
+            logger.info(f"{name}: {summary.get('throughput_mb_s')} MB/s, {summary.get('cpu_seconds_per_gb')} CPU s/GB, "
+                        f"peak RSS {summary.get('peak_rss_mb')} MB, loop lag p99 {summary.get('loop_lag_p99_ms')} ms")
+            for error in summary['errors']:
+                logger.warning(f"{name}: {error}")
+            scenarios.append(summary)
+    finally:
+        server_process.terminate()
+        server_process.wait()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'settings': {key: value for key, value in os.environ.items() if key.startswith('COMFY_DOWNLOAD_')},
+        'scenarios': scenarios
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Stand-in model file server for the download benchmarks
+Serves generated files of any size with configurable bandwidth, latency,
+range support and injected faults, so download scenarios behave the same on
+every run and every machine.
+
+Files are addressed as /files/<size in bytes>/<name>, the query string
+shapes how they are served:
+    rate        per connection bandwidth in MB/s (default unlimited)
+    latency     seconds before the response headers are sent
+    ranges      0 to ignore Range headers and not advertise them
+    fail_after  bytes sent before the connection is dropped
+    stall_after bytes sent before the response stops sending
+    stall       seconds the response stalls for (default 30)
+    fails       how many responses of this URL are dropped or stalled
+                (default 1), other query parameters make a different URL
+                with its own faults
+
+The content is a seeded pseudo-random block repeated to the file size, so
+a file's bytes only depend on its size.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import re
+
+from aiohttp import web
+
+logger = logging.getLogger('benchmark_server')
+
+# Size of the repeated content block and of each write to the socket
+BLOCK_SIZE = 1024 * 1024
+WRITE_SIZE = 256 * 1024
+
+BLOCK = random.Random(0).randbytes(BLOCK_SIZE)
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+def file_content(start, end):
+    """Bytes start..end (inclusive) of a served file"""
+    offset = start % BLOCK_SIZE
+    length = end - start + 1
+    if offset + length <= BLOCK_SIZE:
+        return BLOCK[offset:offset + length]
+    repeats = (offset + length) // BLOCK_SIZE + 1
+    return (BLOCK * repeats)[offset:offset + length]
+
+def float_param(query, name, default=None):
+    value = query.get(name)
+    return float(value) if value not in (None, '') else default
+
+class FileServer:
+    """Serves the benchmark files, remembers the faults each URL already had"""
+    def __init__(self):
+        self.fault_counts = {}
+        self.requests = 0
+
+    def take_fault(self, request):
+        """True if this response of the URL should still fail"""
+        key = str(request.rel_url)
+        fails = int(request.query.get('fails', '1'))
+        count = self.fault_counts.get(key, 0)
+        if count >= fails:
+            return False
+        self.fault_counts[key] = count + 1
+        return True
+
+    async def handle_file(self, request):
+        self.requests += 1
+        size = int(request.match_info['size'])
+        query = request.query
+        rate = float_param(query, 'rate')
+        latency = float_param(query, 'latency', 0)
+        ranges = query.get('ranges', '1') != '0'
+        fail_after = float_param(query, 'fail_after')
+        stall_after = float_param(query, 'stall_after')
+
+        if latency:
+            await asyncio.sleep(latency)
+
+        headers = {
+            'ETag': f'"{size}"',
+            'Last-Modified': 'Thu, 01 Jan 2026 00:00:00 GMT',
+            'Content-Type': 'application/octet-stream'
+        }
+        if ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        start, end, status = 0, size - 1, 200
+        match = RANGE_PATTERN.match(request.headers.get('Range', ''))
+        if ranges and match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size or start > end:
+                headers['Content-Range'] = f'bytes */{size}'
+                return web.Response(status=416, headers=headers)
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(size)
+            return web.Response(status=200, headers=headers)
+
+        headers['Content-Length'] = str(end - start + 1)
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+
+        # Only responses long enough to reach the fault use up one of the faults
+        fail_at = stall_at = None
+        fault_at = fail_after if fail_after is not None else stall_after
+        if fault_at is not None and end - start + 1 > fault_at and self.take_fault(request):
+            fail_at, stall_at = fail_after, stall_after
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        sent = 0
+        position = start
+        while position <= end:
+            if fail_at is not None and sent >= fail_at:
+                logger.info(f"Dropping {request.rel_url} after {sent} bytes")
+                request.transport.close()
+                return response
+            if stall_at is not None and sent >= stall_at:
+                stall_at = None
+                await asyncio.sleep(float_param(query, 'stall', 30))
+            piece = file_content(position, min(position + WRITE_SIZE, end + 1) - 1)
+            await response.write(piece)
+            sent += len(piece)
+            position += len(piece)
+            if rate:
+                # Sleep until the bytes sent so far match the configured rate
+                delay = began + sent / (rate * 1024 * 1024) - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        await response.write_eof()
+        return response
+
+    async def handle_stats(self, request):
+        return web.json_response({'requests': self.requests, 'faults': sum(self.fault_counts.values())})
+
+def create_app():
+    server = FileServer()
+    app = web.Application()
+    app.router.add_route('GET', '/files/{size:\\d+}/{name}', server.handle_file)
+    app.router.add_route('HEAD', '/files/{size:\\d+}/{name}', server.handle_file)
+    app.router.add_get('/stats', server.handle_stats)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve generated model files for the download benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=None, shutdown_timeout=1)
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import sys
 import time
 import logging
 import importlib.util
+import re
 import traceback
 
 # Setup logging
@@ -39,6 +40,18 @@ try:
     download_model = model_downloader_patch.download_model
     get_download_progress = model_downloader_patch.get_download_progress
     list_downloads = model_downloader_patch.list_downloads
+    list_interrupted_downloads = model_downloader_patch.list_interrupted_downloads
+    resume_downloads = model_downloader_patch.resume_downloads
+    control_download = model_downloader_patch.control_download
+    get_download_queue = model_downloader_patch.get_download_queue
+    subscribe_progress = model_downloader_patch.subscribe_progress
+    get_download_bandwidth = model_downloader_patch.get_download_bandwidth
+    set_download_bandwidth = model_downloader_patch.set_download_bandwidth
+    resolve_workflow_models = model_downloader_patch.resolve_workflow_models
+    stream_download_progress = model_downloader_patch.stream_download_progress
+    serve_peer_model = model_downloader_patch.serve_peer_model
+    get_metrics = model_downloader_patch.get_metrics
+    close_download_session = model_downloader_patch.close_download_session
     
     logger.info("Successfully imported model downloader module")
 except Exception as e:
@@ -48,15 +61,25 @@ except Exception as e:
     # Define dummy functions to avoid errors
     from aiohttp import web
     
-    async def download_model(request):
-        logger.error("Model downloader not properly imported, using fallback handler")
-        return web.json_response({"success": False, "error": "Model downloader not available"})
-    async def get_download_progress(request):
-        logger.error("Model downloader not properly imported, using fallback handler")
-        return web.json_response({"success": False, "error": "Model downloader not available"})
-    async def list_downloads(request):
+    async def unavailable_handler(request):
         logger.error("Model downloader not properly imported, using fallback handler")
         return web.json_response({"success": False, "error": "Model downloader not available"})
+    
+    download_model = unavailable_handler
+    get_download_progress = unavailable_handler
+    list_downloads = unavailable_handler
+    list_interrupted_downloads = unavailable_handler
+    resume_downloads = unavailable_handler
+    control_download = unavailable_handler
+    get_download_queue = unavailable_handler
+    subscribe_progress = unavailable_handler
+    get_download_bandwidth = unavailable_handler
+    set_download_bandwidth = unavailable_handler
+    resolve_workflow_models = unavailable_handler
+    stream_download_progress = unavailable_handler
+    serve_peer_model = unavailable_handler
+    get_metrics = unavailable_handler
+    close_download_session = None
 
 # Define API handler for ComfyUI extension system
 def setup_js_api(app, *args, **kwargs):
@@ -68,34 +91,48 @@ def setup_js_api(app, *args, **kwargs):
 
     logger.info("Registering model downloader API endpoints")
     
-    # Define route patterns to check for
-    route_patterns = [
-        '/api/download-model',
-        '/api/download-progress/',
-        '/api/downloads'
+    # Endpoints as (method, route, handler)
+    endpoints = [
+        ('POST', '/api/download-model', download_model),
+        ('GET', '/api/download-progress/{download_id}', get_download_progress),
+        ('GET', '/api/downloads', list_downloads),
+        ('GET', '/api/downloads/interrupted', list_interrupted_downloads),
+        ('GET', '/api/downloads/events', stream_download_progress),
+        ('POST', '/api/downloads/resume', resume_downloads),
+        ('POST', '/api/downloads/{download_id}/{action}', control_download),
+        ('GET', '/api/download-queue', get_download_queue),
+        ('POST', '/api/download-progress/subscribe', subscribe_progress),
+        ('GET', '/api/download-bandwidth', get_download_bandwidth),
+        ('POST', '/api/download-bandwidth', set_download_bandwidth),
+        ('POST', '/api/download-workflow-models', resolve_workflow_models),
+        ('GET', '/api/peer/models/{folder}/{filename:.+}', serve_peer_model),
+        ('HEAD', '/api/peer/models/{folder}/{filename:.+}', serve_peer_model),
+        ('GET', '/metrics', get_metrics),
     ]
     
     # Check if any of our routes already exist
     existing_routes = set()
     for route in app.router.routes():
-        route_str = str(route)
-        for pattern in route_patterns:
-            if pattern in route_str:
-                existing_routes.add(pattern)
-                logger.info(f"Found existing route matching {pattern}")
+        resource = route.resource
+        if resource is not None:
+            existing_routes.add((route.method, resource.canonical))
     
     # Register each endpoint if it doesn't already exist
-    if '/api/download-model' not in existing_routes:
-        app.router.add_post('/api/download-model', download_model)
-        logger.info("Registered /api/download-model endpoint")
-    
-    if '/api/download-progress/' not in existing_routes:
-        app.router.add_get('/api/download-progress/{download_id}', get_download_progress)
-        logger.info("Registered /api/download-progress endpoint")
+    for method, path, handler in endpoints:
+        # aiohttp reports routes without the regular expressions of their variables
+        canonical = re.sub(r'\{(\w+):[^}]+\}', r'{\1}', path)
+        if (method, canonical) in existing_routes:
+            logger.info(f"Found existing route for {method} {path}")
+            continue
+        app.router.add_route(method, path, handler)
+        logger.info(f"Registered {path} endpoint")
     
-    if '/api/downloads' not in existing_routes:
-        app.router.add_get('/api/downloads', list_downloads)
-        logger.info("Registered /api/downloads endpoint")
+    # Close the shared download session when the server shuts down
+    if close_download_session is not None and close_download_session not in app.on_cleanup:
+        try:
+            app.on_cleanup.append(close_download_session)
+        except RuntimeError as e:
+            logger.warning(f"Could not register download session cleanup: {e}")
     
     logger.info("Model downloader API endpoints registered successfully")
     return app
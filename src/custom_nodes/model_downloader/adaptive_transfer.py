@@ -0,0 +1,117 @@
+"""
+Adaptive reading for the model downloader
+Sizes the chunks read from a connection by its measured throughput and
+detects connections whose throughput fell below a floor, so they can be
+reconnected instead of waiting for the socket timeout.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger('model_downloader')
+
+# Chunk sizes are powers of two between these bounds
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 2 * 1024 * 1024
+
+# Aim for chunks that take this long to arrive, a few progress updates per second
+CHUNK_TARGET_SECONDS = 0.25
+
+# Weight of the newest chunk in the throughput estimate
+THROUGHPUT_SMOOTHING = 0.3
+
+class StalledConnectionError(Exception):
+    """Raised when a connection delivers less than the throughput floor"""
+    pass
+
+class AdaptiveChunkSize:
+    """
+    Chunk size of one connection, following its throughput.
+    Fast connections read large chunks so the per chunk work (progress,
+    metrics, handing the data to the writer) happens less often, slow ones
+    read small chunks so progress keeps moving.
+    """
+    def __init__(self, initial):
+        self.size = initial
+        self.throughput = None
+
+    def update(self, nbytes, seconds):
+        """Account for a chunk of nbytes that took seconds to arrive and be handled"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput += THROUGHPUT_SMOOTHING * (rate - self.throughput)
+        target = self.throughput * CHUNK_TARGET_SECONDS
+        # Step to the power of two closest to the target, within the bounds
+        size = MIN_CHUNK_SIZE
+        while size < MAX_CHUNK_SIZE and size * 1.5 < target:
+            size *= 2
+        self.size = size
+
+class StallDetector:
+    """
+    Throughput floor of one connection.
+    Time spent waiting for the network is cut into windows of window seconds,
+    a window that received no data, or less than min_speed bytes per second,
+    is a stall. Time spent writing or waiting on the speed limit doesn't count.
+    """
+    def __init__(self, min_speed, window):
+        self.min_speed = min_speed
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.elapsed = 0.0
+        self.received = 0
+
+    def remaining(self):
+        """Seconds of waiting left in the current window"""
+        return max(0.0, self.window - self.elapsed)
+
+    def add(self, nbytes, seconds):
+        """Count a read, returns False if it closed a window below the floor"""
+        self.elapsed += seconds
+        self.received += nbytes
+        if self.elapsed < self.window:
+            return True
+        healthy = self.received > 0 and self.received >= self.min_speed * self.window
+        self.reset()
+        return healthy
+
+async def read_chunk(content, size, stall=None):
+    """
+    Read size bytes from a response body, fewer only at its end.
+    Returns the pieces as they arrived rather than joining them into one more
+    copy, an empty list at the end of the body.
+    Raises StalledConnectionError when stall detects a stall while waiting.
+    """
+    loop = asyncio.get_running_loop()
+    pieces = []
+    received = 0
+    while received < size:
+        started = loop.time()
+        if stall is None:
+            piece = await content.read(size - received)
+        else:
+            deadline = asyncio.timeout(stall.remaining())
+            try:
+                async with deadline:
+                    piece = await content.read(size - received)
+            except TimeoutError:
+                # Socket timeouts are TimeoutErrors too, only the window ending is a stall
+                if not deadline.expired():
+                    raise
+                piece = None
+            if not stall.add(len(piece or b''), loop.time() - started):
+                raise StalledConnectionError(
+                    f"Less than {stall.min_speed / 1024:.0f} KB/s received in {stall.window:.0f}s")
+            if piece is None:
+                continue
+        if not piece:
+            break
+        pieces.append(piece)
+        received += len(piece)
+    return pieces
@@ -0,0 +1,342 @@
+"""
+Archive extraction for the model downloader
+Extracts model packs published as archives into a model folder. Tar archives
+are extracted from the download stream while it arrives, so the archive is
+never stored. Zip archives keep their table of contents at the end and are
+extracted from the downloaded file once it is complete.
+"""
+
+import asyncio
+import collections
+import hashlib
+import io
+import logging
+import os
+import stat
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('model_downloader')
+
+# Archive suffixes and their formats, checked in this order
+ARCHIVE_SUFFIXES = [
+    ('.tar.gz', 'tar.gz'),
+    ('.tgz', 'tar.gz'),
+    ('.tar.bz2', 'tar.bz2'),
+    ('.tar.xz', 'tar.xz'),
+    ('.tar.zst', 'tar.zst'),
+    ('.tzst', 'tar.zst'),
+    ('.tar', 'tar'),
+    ('.zip', 'zip'),
+]
+
+# tarfile stream modes of the tar formats, zstd is decompressed before tarfile sees it
+TAR_STREAM_MODES = {
+    'tar': 'r|',
+    'tar.gz': 'r|gz',
+    'tar.bz2': 'r|bz2',
+    'tar.xz': 'r|xz',
+    'tar.zst': 'r|',
+}
+
+# Chunks received but not yet extracted, the download waits when the extractor is this far behind
+MAX_PENDING_CHUNKS = 8
+
+# Buffer used to copy an entry to its file
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Entries are written to <path>.part and renamed once complete
+PART_SUFFIX = '.part'
+
+class ExtractionAborted(Exception):
+    """Raised in the extractor thread when the extraction was stopped"""
+    pass
+
+def archive_format(filename):
+    """Archive format of a filename by its suffix, None if it isn't a supported archive"""
+    name = filename.lower()
+    for suffix, archive in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return archive
+    return None
+
+def archive_supported(archive):
+    """Whether the optional modules an archive format needs are installed"""
+    return archive != 'tar.zst' or zstandard is not None
+
+def safe_entry_path(destination, name):
+    """
+    Path of an archive entry inside destination. Returns None for names that
+    are absolute, have a drive, or escape destination, also through symlinks
+    already present in it.
+    """
+    name = name.replace('\\', '/')
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if not parts or name.startswith('/') or '..' in parts or ':' in parts[0] or '\0' in name:
+        return None
+    path = os.path.join(destination, *parts)
+    real_destination = os.path.realpath(destination)
+    if os.path.commonpath([real_destination, os.path.realpath(path)]) != real_destination:
+        return None
+    return path
+
+class ArchiveExtractor:
+    """
+    Writes archive entries below destination, used from a worker thread.
+    Unsafe names and anything but regular files and directories (links,
+    devices) are skipped. Existing files are kept and the entry gets a
+    timestamped name, like a download of an existing file.
+    on_entry(name, nbytes) is called from the worker thread for every extracted file.
+    """
+    def __init__(self, destination, on_entry=None):
+        self.destination = destination
+        self.on_entry = on_entry
+        self.files = []
+        self.skipped = []
+        self.created_dirs = []
+        self.extracted_bytes = 0
+        self.aborted = False
+
+    def skip(self, name, reason):
+        logger.warning(f"Skipping archive entry {name}: {reason}")
+        self.skipped.append(name)
+
+    def make_dirs(self, path):
+        """Create path and its missing parents, remembering them so they can be removed again"""
+        missing = []
+        while not os.path.isdir(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for directory in reversed(missing):
+            os.mkdir(directory)
+            self.created_dirs.append(directory)
+
+    def extract_dir(self, name):
+        path = safe_entry_path(self.destination, name)
+        if path is None:
+            self.skip(name, "unsafe path")
+            return
+        self.make_dirs(path)
+
+    def extract_file(self, name, source, size):
+        """Copy one entry from the file object source to its path below destination"""
+        path = safe_entry_path(self.destination, name)
+        if path is None:
+            self.skip(name, "unsafe path")
+            return
+        self.make_dirs(os.path.dirname(path))
+        if os.path.exists(path):
+            root, extension = os.path.splitext(path)
+            path = f"{root}_{int(time.time())}{extension}"
+            logger.warning(f"{name} already exists, extracting it as {os.path.basename(path)}")
+
+        partial = path + PART_SUFFIX
+        try:
+            with open(partial, 'wb') as f:
+                while True:
+                    if self.aborted:
+                        raise ExtractionAborted()
+                    data = source.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+            os.replace(partial, path)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+
+        relative = os.path.relpath(path, self.destination)
+        self.files.append(relative)
+        self.extracted_bytes += size
+        if self.on_entry is not None:
+            self.on_entry(relative, size)
+
+    def remove_extracted(self):
+        """Remove everything this extraction created"""
+        for relative in self.files:
+            try:
+                os.remove(os.path.join(self.destination, relative))
+            except OSError:
+                pass
+        for directory in reversed(self.created_dirs):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        self.files = []
+        self.created_dirs = []
+
+class ZipExtractor(ArchiveExtractor):
+    """Extracts a complete zip file, call extract() from a worker thread"""
+    def extract(self, path):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                for entry in archive.infolist():
+                    if self.aborted:
+                        raise ExtractionAborted()
+                    mode = entry.external_attr >> 16
+                    if entry.is_dir():
+                        self.extract_dir(entry.filename)
+                    elif stat.S_ISLNK(mode):
+                        self.skip(entry.filename, "symbolic link")
+                    else:
+                        with archive.open(entry) as source:
+                            self.extract_file(entry.filename, source, entry.file_size)
+        except BaseException:
+            self.remove_extracted()
+            raise
+
+class StreamPipe(io.RawIOBase):
+    """
+    Byte stream from the event loop to the extractor thread.
+    feed() queues chunks and waits while MAX_PENDING_CHUNKS are queued, so a
+    slow disk slows down the download instead of growing memory. Every chunk
+    is hashed as the thread takes it.
+    """
+    def __init__(self, max_pending=MAX_PENDING_CHUNKS):
+        super().__init__()
+        self.loop = asyncio.get_running_loop()
+        self.max_pending = max_pending
+        self.slots = asyncio.Semaphore(max_pending)
+        self.condition = threading.Condition()
+        self.chunks = collections.deque()
+        self.current = memoryview(b'')
+        self.ended = False
+        self.aborted = False
+        self.reader_done = False
+        self.hasher = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    async def feed(self, data):
+        await self.slots.acquire()
+        if self.reader_done:
+            # The extractor stopped, it won't take any more data
+            self.slots.release()
+            return False
+        with self.condition:
+            self.chunks.append(data)
+            self.condition.notify()
+        return True
+
+    def end(self):
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+
+    def abort(self):
+        with self.condition:
+            self.aborted = True
+            self.condition.notify()
+
+    def stop_reading(self):
+        """Called by the thread when it is done, unblocks feed() calls waiting for a slot"""
+        def release():
+            self.reader_done = True
+            for _ in range(self.max_pending):
+                self.slots.release()
+        self.loop.call_soon_threadsafe(release)
+
+    def next_chunk(self):
+        """Wait for the next chunk in the thread, None at the end of the stream"""
+        with self.condition:
+            while not self.chunks and not self.ended and not self.aborted:
+                self.condition.wait()
+            if self.aborted:
+                raise ExtractionAborted()
+            if not self.chunks:
+                return None
+            chunk = self.chunks.popleft()
+        self.loop.call_soon_threadsafe(self.slots.release)
+        self.hasher.update(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        if not self.current:
+            chunk = self.next_chunk()
+            if chunk is None:
+                return 0
+            self.current = memoryview(chunk)
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+    def drain(self):
+        """Read the rest of the stream, so the hash covers all of it"""
+        self.current = memoryview(b'')
+        while self.next_chunk() is not None:
+            pass
+
+class TarStreamExtractor(ArchiveExtractor):
+    """
+    Extracts a tar archive while it downloads.
+    start() runs the extraction in its own thread, feed() passes it the
+    downloaded bytes in order and finish() waits for it to complete.
+    """
+    def __init__(self, destination, archive, on_entry=None):
+        super().__init__(destination, on_entry)
+        self.archive = archive
+        self.pipe = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model_downloader_extract')
+        self.future = None
+
+    def start(self):
+        self.pipe = StreamPipe()
+        self.future = asyncio.get_running_loop().run_in_executor(self.executor, self._run)
+
+    def _run(self):
+        try:
+            source = self.pipe
+            if self.archive == 'tar.zst':
+                source = zstandard.ZstdDecompressor().stream_reader(self.pipe, closefd=False)
+            with tarfile.open(fileobj=source, mode=TAR_STREAM_MODES[self.archive]) as archive:
+                for entry in archive:
+                    if entry.isdir():
+                        self.extract_dir(entry.name)
+                    elif entry.isfile():
+                        self.extract_file(entry.name, archive.extractfile(entry), entry.size)
+                    else:
+                        self.skip(entry.name, "not a regular file or directory")
+            # Padding after the end of the archive is still part of the download
+            self.pipe.drain()
+        finally:
+            self.pipe.stop_reading()
+
+    async def feed(self, data):
+        """Pass the next downloaded bytes, raises the extraction error if the extractor failed"""
+        if not await self.pipe.feed(data):
+            await self.future
+            raise Exception("Archive ended before the download")
+
+    async def finish(self):
+        """Signal the end of the download and wait until every entry is extracted"""
+        self.pipe.end()
+        try:
+            await self.future
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def hexdigest(self):
+        return self.pipe.hasher.hexdigest()
+
+    async def abort(self):
+        """Stop the extraction and remove what it extracted so far"""
+        self.aborted = True
+        if self.future is not None:
+            self.pipe.abort()
+            await asyncio.gather(self.future, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, self.remove_extracted)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,142 @@
+"""
+Bandwidth limiting for the model downloader
+Token buckets that slow down the network read loop so downloads leave room
+for model loading and other traffic of the ComfyUI server.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('model_downloader')
+
+# Seconds of unused bandwidth a bucket may save up and spend at once
+BURST_SECONDS = 1.0
+
+# Longest single wait, so rate changes take effect quickly
+MAX_WAIT = 0.25
+
+BYTES_PER_MB = 1024 * 1024
+
+class TokenBucket:
+    """
+    Token bucket allowing rate bytes per second, a rate of 0 means unlimited.
+
+    consume() takes the tokens for data already received and then waits until
+    the bucket is no longer in debt, so a chunk larger than the bucket still
+    goes through and the average rate stays at the limit.
+    """
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate * BURST_SECONDS)
+        else:
+            self.tokens = 0.0
+        self.updated = now
+
+    def set_rate(self, rate):
+        """Change the rate, applies to data still waiting too"""
+        if rate == self.rate:
+            return
+        self._refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, rate * BURST_SECONDS)
+
+    async def consume(self, nbytes):
+        self._refill()
+        if self.rate <= 0:
+            return
+        self.tokens -= nbytes
+        while self.tokens < 0 and self.rate > 0:
+            await asyncio.sleep(min(MAX_WAIT, -self.tokens / self.rate))
+            self._refill()
+
+class BandwidthLimiter:
+    """
+    Global and per-download download rate limits, in bytes per second.
+
+    Every received chunk passes the bucket of its download and then the global
+    bucket. While is_busy() returns True (a prompt is executing) the global
+    bucket uses inference_limit instead of limit, if it is set.
+    """
+    def __init__(self, limit=0, inference_limit=None, is_busy=None):
+        self.limit = limit
+        self.inference_limit = inference_limit
+        self.is_busy = is_busy
+        self.global_bucket = TokenBucket(limit)
+        self.download_limits = {}
+        self.download_buckets = {}
+
+    def throttled(self):
+        """Whether the inference limit currently applies"""
+        if self.inference_limit is None or self.is_busy is None:
+            return False
+        try:
+            return bool(self.is_busy())
+        except Exception as e:
+            logger.debug(f"Could not check whether a prompt is running: {e}")
+            return False
+
+    def global_rate(self):
+        """Global limit in effect right now"""
+        if self.throttled():
+            # Use whichever limit is stricter, 0 means unlimited for both
+            if not self.limit:
+                return self.inference_limit
+            return min(self.limit, self.inference_limit) if self.inference_limit else self.limit
+        return self.limit
+
+    def set_limits(self, limit=None, inference_limit=None, clear_inference_limit=False):
+        """Change the global limits, None keeps the current value"""
+        if limit is not None:
+            self.limit = max(0, limit)
+        if clear_inference_limit:
+            self.inference_limit = None
+        elif inference_limit is not None:
+            self.inference_limit = max(0, inference_limit)
+
+    def set_download_limit(self, download_id, limit):
+        """Limit a single download, 0 or None removes its limit"""
+        if limit:
+            self.download_limits[download_id] = limit
+            self.download_buckets.setdefault(download_id, TokenBucket()).set_rate(limit)
+        else:
+            self.download_limits.pop(download_id, None)
+            self.download_buckets.pop(download_id, None)
+
+    def forget(self, download_id):
+        """Drop the limit of a finished download"""
+        self.set_download_limit(download_id, None)
+
+    async def consume(self, download_id, nbytes):
+        """Account for nbytes received by a download, waits while over a limit"""
+        bucket = self.download_buckets.get(download_id)
+        if bucket is not None:
+            await bucket.consume(nbytes)
+        self.global_bucket.set_rate(self.global_rate())
+        await self.global_bucket.consume(nbytes)
+
+    def snapshot(self):
+        """Describe the limits for the API, in MB/s"""
+        return {
+            'max_speed': to_mbps(self.limit),
+            'inference_max_speed': None if self.inference_limit is None else to_mbps(self.inference_limit),
+            'throttled': self.throttled(),
+            'current_max_speed': to_mbps(self.global_rate()),
+            'downloads': {download_id: to_mbps(limit) for download_id, limit in self.download_limits.items()}
+        }
+
+def to_mbps(rate):
+    return round(rate / BYTES_PER_MB, 3)
+
+def from_mbps(value):
+    """Parse a limit given in MB/s into bytes per second, raises ValueError"""
+    value = float(value)
+    if value < 0:
+        raise ValueError(f"Invalid speed limit: {value}")
+    return int(value * BYTES_PER_MB)
@@ -0,0 +1,66 @@
+"""
+Page cache warmup for the model downloader
+Reads a finished download back once, so it is already in the page cache when
+a workflow first loads it. Warmups stay within a memory budget and only use
+memory the system reports as free, so models cached earlier are not evicted.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('model_downloader')
+
+# Size of the reads of the warmup pass
+READ_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Free memory a warmup always leaves alone
+MEMORY_RESERVE = 512 * 1024 * 1024
+
+# One warmup at a time, so warmups don't compete with each other for the disk
+warmup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model_downloader_warmup')
+
+def free_memory():
+    """Bytes of memory not in use at all, not even by the page cache, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemFree:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def warmup_size(size, budget):
+    """Bytes of a file of size to warm, at most budget and no more than the free memory"""
+    length = min(size, budget)
+    free = free_memory()
+    if free is not None:
+        length = min(length, max(0, free - MEMORY_RESERVE))
+    return length
+
+def warm_file(path, budget):
+    """
+    Bring the start of a file into the page cache, up to warmup_size() bytes.
+    Asks the kernel to read ahead where posix_fadvise is available, then reads
+    the range once so it is resident when this returns. Runs in a worker thread.
+    Returns (bytes warmed, size of the file).
+    """
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        length = warmup_size(size, budget)
+        if length <= 0:
+            return 0, size
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+        view = memoryview(bytearray(READ_BUFFER_SIZE))
+        warmed = 0
+        while warmed < length:
+            read = f.readinto(view[:min(READ_BUFFER_SIZE, length - warmed)])
+            if not read:
+                break
+            warmed += read
+    return warmed, size
@@ -0,0 +1,137 @@
+"""
+Prometheus metrics for the model downloader
+Counters and histograms updated from the download loop, rendered in the
+Prometheus text exposition format by the /metrics endpoint. Kept free of
+dependencies so it works in any ComfyUI environment.
+"""
+
+import threading
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    escaped = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally split by labels. Updated from the event loop"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name) or '' for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, format_labels(self.labels, key), value
+
+class Gauge:
+    """Value read at scrape time from function(), which returns a number or {label values: number}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labels = tuple(labels)
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield self.name, format_labels(self.labels, key), value
+
+class Histogram:
+    """
+    Histogram with fixed buckets, optionally split by labels.
+    observe() may be called from worker threads, e.g. the disk writer.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name) or '' for name in self.labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per bucket counts, then the sum and count of all observations
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in values.items():
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += counts[index]
+                yield f'{self.name}_bucket', format_labels(self.labels + ('le',), key + (format_value(bound),)), cumulative
+            yield f'{self.name}_sum', format_labels(self.labels, key), counts[-2]
+            yield f'{self.name}_count', format_labels(self.labels, key), counts[-1]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+DOWNLOADED_BYTES = registry.register(Counter(
+    'model_downloader_downloaded_bytes_total', 'Bytes received from the network, by host', ['host']))
+DOWNLOADS = registry.register(Counter(
+    'model_downloader_downloads_total', 'Finished downloads, by final status', ['status']))
+RETRIES = registry.register(Counter(
+    'model_downloader_retries_total', 'Retried transfers, by the error that caused them', ['cause']))
+ERRORS = registry.register(Counter(
+    'model_downloader_errors_total', 'Failed downloads, by the error that failed them', ['cause']))
+MIRROR_SWITCHES = registry.register(Counter(
+    'model_downloader_mirror_switches_total', 'Downloads moved away from a failing mirror, by its host', ['host']))
+TIME_TO_FIRST_BYTE = registry.register(Histogram(
+    'model_downloader_time_to_first_byte_seconds', 'Time until response headers arrived, by host',
+    [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10], ['host']))
+THROUGHPUT = registry.register(Histogram(
+    'model_downloader_throughput_bytes_per_second', 'Average throughput of completed downloads',
+    [mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000)]))
+DISK_WRITE_SECONDS = registry.register(Histogram(
+    'model_downloader_disk_write_seconds', 'Time taken by each buffered disk write',
+    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]))
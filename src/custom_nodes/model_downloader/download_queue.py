@@ -0,0 +1,180 @@
+"""
+Download scheduler for the model downloader
+Limits how many downloads run at once, globally and per host, and starts
+queued downloads by priority and then in the order they were requested.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger('model_downloader')
+
+class DownloadScheduler:
+    """
+    Bounded download queue.
+
+    Each download is submitted with a factory returning the coroutine that
+    performs it. The scheduler only starts a download when fewer than
+    max_active downloads are running and fewer than max_per_host downloads
+    are running against the same host. Higher priorities start first,
+    downloads with the same priority start in submission order.
+
+    State changes are reported through on_state_change(download_id, state)
+    with one of: queued, downloading, paused, cancelled, finished.
+    """
+    def __init__(self, max_active=3, max_per_host=2, on_state_change=None):
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.on_state_change = on_state_change
+        self._entries = {}
+        self._sequence = itertools.count()
+
+    def _notify(self, download_id, state):
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(download_id, state)
+            except Exception as e:
+                logger.error(f"Error reporting download state for {download_id}: {e}")
+
+    def _running(self):
+        return [entry for entry in self._entries.values() if entry['state'] == 'downloading']
+
+    def _queued(self):
+        queued = [entry for entry in self._entries.values() if entry['state'] == 'queued']
+        queued.sort(key=lambda entry: (-entry['priority'], entry['sequence']))
+        return queued
+
+    def submit(self, download_id, url, factory, priority=0):
+        """Queue a download, factory() must return the coroutine that downloads it"""
+        self._entries[download_id] = {
+            'download_id': download_id,
+            'host': urlparse(url).hostname or '',
+            'factory': factory,
+            'priority': priority,
+            'sequence': next(self._sequence),
+            'state': 'queued',
+            'task': None,
+            'queued_time': time.time()
+        }
+        self._notify(download_id, 'queued')
+        self._pump()
+
+    def _pump(self):
+        """Start as many queued downloads as the limits allow"""
+        running = self._running()
+        per_host = {}
+        for entry in running:
+            per_host[entry['host']] = per_host.get(entry['host'], 0) + 1
+
+        for entry in self._queued():
+            if len(running) >= self.max_active:
+                break
+            if per_host.get(entry['host'], 0) >= self.max_per_host:
+                continue
+
+            entry['state'] = 'downloading'
+            entry['task'] = asyncio.ensure_future(self._run(entry))
+            running.append(entry)
+            per_host[entry['host']] = per_host.get(entry['host'], 0) + 1
+            self._notify(entry['download_id'], 'downloading')
+
+    async def _run(self, entry):
+        download_id = entry['download_id']
+        try:
+            await entry['factory']()
+        except asyncio.CancelledError:
+            # Paused and cancelled downloads are stopped by cancelling their task
+            pass
+        except Exception as e:
+            logger.error(f"Error in scheduled download {download_id}: {e}")
+        finally:
+            entry['task'] = None
+            if entry['state'] == 'downloading':
+                entry['state'] = 'finished'
+            # Only forget this entry, never a newer one submitted under the same ID
+            if entry['state'] in ('finished', 'cancelled') and self._entries.get(download_id) is entry:
+                self._entries.pop(download_id, None)
+            if entry['state'] == 'finished':
+                self._notify(download_id, 'finished')
+            self._pump()
+
+    def _stop(self, download_id, state):
+        entry = self._entries.get(download_id)
+        if entry is None or entry['state'] not in ('queued', 'downloading', 'paused'):
+            return False
+
+        entry['state'] = state
+        task = entry['task']
+        if task is not None:
+            # _run drops the entry and refills the free slot once the task ends
+            task.cancel()
+        else:
+            if state == 'cancelled':
+                self._entries.pop(download_id, None)
+            self._pump()
+        self._notify(download_id, state)
+        return True
+
+    def cancel(self, download_id):
+        """Cancel a queued, running or paused download"""
+        return self._stop(download_id, 'cancelled')
+
+    def pause(self, download_id):
+        """Stop a queued or running download without forgetting it"""
+        entry = self._entries.get(download_id)
+        if entry is None or entry['state'] == 'paused':
+            return False
+        return self._stop(download_id, 'paused')
+
+    def resume(self, download_id):
+        """Put a paused download back in the queue, keeping its original position"""
+        entry = self._entries.get(download_id)
+        if entry is None or entry['state'] != 'paused' or entry['task'] is not None:
+            return False
+        entry['state'] = 'queued'
+        self._notify(download_id, 'queued')
+        self._pump()
+        return True
+
+    def reprioritize(self, download_id, priority):
+        """Change the priority of a queued or paused download"""
+        entry = self._entries.get(download_id)
+        if entry is None or entry['state'] not in ('queued', 'paused'):
+            return False
+        entry['priority'] = priority
+        self._pump()
+        return True
+
+    def set_limits(self, max_active=None, max_per_host=None):
+        """Change the concurrency limits, queued downloads start if there is room"""
+        if max_active is not None:
+            self.max_active = max(1, max_active)
+        if max_per_host is not None:
+            self.max_per_host = max(1, max_per_host)
+        self._pump()
+
+    def snapshot(self):
+        """Describe the current queue for the API"""
+        queued = self._queued()
+        return {
+            'max_active': self.max_active,
+            'max_per_host': self.max_per_host,
+            'running': [entry['download_id'] for entry in self._running()],
+            'queued': [{
+                'download_id': entry['download_id'],
+                'priority': entry['priority'],
+                'host': entry['host'],
+                'position': position
+            } for position, entry in enumerate(queued)],
+            'paused': [entry['download_id'] for entry in self._entries.values() if entry['state'] == 'paused']
+        }
+
+    def position(self, download_id):
+        """Position of a queued download in the queue, or None"""
+        for position, entry in enumerate(self._queued()):
+            if entry['download_id'] == download_id:
+                return position
+        return None
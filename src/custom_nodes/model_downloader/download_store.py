@@ -0,0 +1,291 @@
+"""
+Download history store for the model downloader
+Keeps the records of running downloads in memory and every download, running
+or finished, in a small SQLite database so history survives restarts and can
+be queried with filters and pagination.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+logger = logging.getLogger('model_downloader')
+
+# Finished downloads kept in memory so clients polling right after completion don't hit the database
+RECENT_LIMIT = 100
+
+# Statuses after which a download record no longer changes
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+# Status given to downloads that were still pending when the server stopped
+INTERRUPTED_STATUS = 'interrupted'
+
+# Columns that can be filtered on, the full record is kept as JSON next to them
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    download_id TEXT PRIMARY KEY,
+    url TEXT,
+    host TEXT,
+    folder TEXT,
+    filename TEXT,
+    path TEXT,
+    status TEXT,
+    total_size INTEGER,
+    downloaded INTEGER,
+    transferred INTEGER,
+    queued_time REAL,
+    start_time REAL,
+    end_time REAL,
+    duration REAL,
+    throughput REAL,
+    error TEXT,
+    sha256 TEXT,
+    expected_sha256 TEXT,
+    verified INTEGER,
+    record TEXT
+);
+CREATE INDEX IF NOT EXISTS downloads_queued_time ON downloads (queued_time);
+CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status, queued_time);
+CREATE INDEX IF NOT EXISTS downloads_folder ON downloads (folder, queued_time);
+CREATE INDEX IF NOT EXISTS downloads_host ON downloads (host, queued_time);
+CREATE INDEX IF NOT EXISTS downloads_path ON downloads (path, end_time);
+"""
+
+COLUMNS = ('download_id', 'url', 'host', 'folder', 'filename', 'path', 'status', 'total_size', 'downloaded',
+           'transferred', 'queued_time', 'start_time', 'end_time', 'duration', 'throughput', 'error',
+           'sha256', 'expected_sha256', 'verified', 'record')
+
+class DownloadStore:
+    """
+    Download records backed by SQLite.
+
+    Records of queued, running and paused downloads live in the active dict and
+    are updated in place by the downloader at chunk rate. They are written to
+    the database when their status changes, not on every progress update.
+    finish() writes the final record, with its duration and throughput, and
+    moves it to a small in-memory list of recently finished downloads.
+
+    All database access happens on one worker thread that owns the connection,
+    so the event loop never waits for SQLite. If the database can't be opened
+    the store keeps working in memory only.
+    """
+    def __init__(self, path, recent_limit=RECENT_LIMIT):
+        self.path = path
+        self.recent_limit = recent_limit
+        self.active = {}
+        self.recent = OrderedDict()
+        self.connection = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model_downloader_store')
+        self.executor.submit(self._open)
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            # Downloads pending in an earlier run stopped with it, their .part files can be resumed
+            marked = connection.execute(
+                "UPDATE downloads SET status = ? WHERE status IN ('queued', 'downloading', 'paused')",
+                (INTERRUPTED_STATUS,)
+            ).rowcount
+            connection.commit()
+            self.connection = connection
+            if marked:
+                logger.info(f"Marked {marked} downloads from an earlier run as interrupted")
+        except Exception as e:
+            logger.error(f"Could not open download history at {self.path}, keeping history in memory only: {e}")
+
+    def get(self, download_id):
+        """Return the in-memory record of a pending or recently finished download, or None"""
+        record = self.active.get(download_id)
+        if record is None:
+            record = self.recent.get(download_id)
+        return record
+
+    def add(self, record):
+        """Register a new download record"""
+        self.active[record['download_id']] = record
+        self._persist(record)
+
+    def save(self, download_id):
+        """Write the current state of a pending or recently finished download"""
+        record = self.get(download_id)
+        if record is not None:
+            self._persist(record)
+
+    def finish(self, download_id):
+        """Write the final record of a download and stop tracking it as pending"""
+        record = self.active.pop(download_id, None)
+        if record is None:
+            return
+
+        end_time = record.get('end_time') or time.time()
+        record['end_time'] = end_time
+        duration = max(0.0, end_time - record.get('start_time', end_time))
+        record['duration'] = round(duration, 3)
+        # Throughput counts the bytes received in the last run, not bytes kept from an earlier one
+        transferred = record.get('transferred', 0)
+        record['throughput'] = round(transferred / duration) if duration > 0 else 0
+
+        self.recent[download_id] = record
+        while len(self.recent) > self.recent_limit:
+            self.recent.popitem(last=False)
+        self._persist(record)
+
+    def _persist(self, record):
+        row = to_row(record)
+        future = self.executor.submit(self._write, row)
+        future.add_done_callback(log_failure)
+
+    def _write(self, row):
+        if self.connection is None:
+            return
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        self.connection.execute(f"INSERT OR REPLACE INTO downloads ({', '.join(COLUMNS)}) VALUES ({placeholders})", row)
+        self.connection.commit()
+
+    async def lookup(self, download_id):
+        """Return the record of any download, from memory or from the history"""
+        record = self.get(download_id)
+        if record is not None:
+            return record
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._select_one, download_id)
+
+    def _select_one(self, download_id):
+        if self.connection is None:
+            return None
+        row = self.connection.execute("SELECT record FROM downloads WHERE download_id = ?", (download_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def find_completed(self, path):
+        """Return the record of the last completed download of path, or None"""
+        if self.connection is None:
+            for record in reversed(self.recent.values()):
+                if record.get('path') == path and record.get('status') == 'completed':
+                    return record
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._select_completed, path)
+
+    def _select_completed(self, path):
+        row = self.connection.execute(
+            "SELECT record FROM downloads WHERE path = ? AND status = 'completed' ORDER BY end_time DESC LIMIT 1",
+            (path,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def query(self, statuses=None, folder=None, host=None, search=None, since=None, until=None, limit=50, offset=0, ascending=False):
+        """
+        Return (total, records) of the downloads matching the filters, newest first
+        unless ascending. Pending downloads are reported with their live progress.
+        """
+        if self.connection is None:
+            # Without a database only the downloads in memory are known
+            return self._select_memory(statuses, folder, host, search, since, until, limit, offset, ascending)
+
+        loop = asyncio.get_running_loop()
+        total, records = await loop.run_in_executor(
+            self.executor, self._select, statuses, folder, host, search, since, until, limit, offset, ascending
+        )
+        # The database only has the state of the last status change
+        records = [self.get(record['download_id']) or record for record in records]
+        return total, records
+
+    def _select(self, statuses, folder, host, search, since, until, limit, offset, ascending):
+        conditions = []
+        params = []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        if folder:
+            conditions.append("folder = ?")
+            params.append(folder)
+        if host:
+            conditions.append("host = ?")
+            params.append(host)
+        if search:
+            conditions.append("(filename LIKE ? OR url LIKE ?)")
+            params.extend([f"%{search}%"] * 2)
+        if since is not None:
+            conditions.append("queued_time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("queued_time < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = 'ASC' if ascending else 'DESC'
+
+        total = self.connection.execute(f"SELECT COUNT(*) FROM downloads {where}", params).fetchone()[0]
+        rows = self.connection.execute(
+            f"SELECT record FROM downloads {where} ORDER BY queued_time {order} LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return total, [json.loads(row[0]) for row in rows]
+
+    def _select_memory(self, statuses, folder, host, search, since, until, limit, offset, ascending):
+        records = [dict(record) for record in list(self.active.values()) + list(self.recent.values())]
+        matches = []
+        for record in records:
+            if statuses and record.get('status') not in statuses:
+                continue
+            if folder and record.get('folder') != folder:
+                continue
+            if host and urlparse(record.get('url') or '').hostname != host:
+                continue
+            if search and search not in (record.get('filename') or '') and search not in (record.get('url') or ''):
+                continue
+            queued_time = record.get('queued_time') or 0
+            if (since is not None and queued_time < since) or (until is not None and queued_time >= until):
+                continue
+            matches.append(record)
+        matches.sort(key=lambda record: record.get('queued_time') or 0, reverse=not ascending)
+        return len(matches), matches[offset:offset + limit]
+
+    def close(self):
+        """Finish pending writes and close the database"""
+        def close_connection():
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+        self.executor.submit(close_connection)
+        self.executor.shutdown(wait=True)
+
+def to_row(record):
+    """Flatten a download record into the values of the downloads table"""
+    verified = record.get('verified')
+    return (
+        record['download_id'],
+        record.get('url'),
+        urlparse(record.get('url') or '').hostname,
+        record.get('folder'),
+        record.get('filename'),
+        record.get('path'),
+        record.get('status'),
+        record.get('total_size'),
+        record.get('downloaded'),
+        record.get('transferred'),
+        record.get('queued_time'),
+        record.get('start_time'),
+        record.get('end_time'),
+        record.get('duration'),
+        record.get('throughput'),
+        record.get('error'),
+        record.get('sha256'),
+        record.get('expected_sha256'),
+        None if verified is None else int(verified),
+        json.dumps(record, default=str)
+    )
+
+def log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Error writing download history: {error}")
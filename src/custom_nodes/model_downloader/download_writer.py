@@ -0,0 +1,235 @@
+"""
+Threaded file writer for the model downloader
+Keeps blocking disk IO (writes, fsync, preallocation) off the asyncio event loop
+that also serves ComfyUI's websocket and prompt API.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from download_metrics import DISK_WRITE_SECONDS
+
+logger = logging.getLogger('model_downloader')
+
+# Data is collected per segment and written in buffers of this size
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Buffer flushes end on multiples of this many bytes from the start of the file
+WRITE_ALIGNMENT = 1024 * 1024
+
+# Writes in flight per file before the network reader has to wait for the disk
+MAX_PENDING_WRITES = 4
+
+# Size of the reads used to hash data that was written out of order
+HASH_READ_SIZE = 8 * 1024 * 1024
+
+# Threads shared by all downloads for small disk IO such as state records
+disk_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='model_downloader_io')
+
+class SegmentBuffer:
+    """Contiguous bytes received for one segment that have not been written yet"""
+    def __init__(self, offset):
+        self.offset = offset
+        self.data = bytearray()
+
+class StreamHasher:
+    """
+    Computes the SHA-256 of a file in file order while its segments arrive in parallel.
+
+    Data written at the current hash offset is hashed straight from the write
+    buffer. Data written further ahead is remembered as a range and read back
+    (usually from the page cache) once everything before it has been hashed.
+    Only used from the writer thread of the file.
+    """
+    def __init__(self, committed_ranges=()):
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        self.starts = {}
+        self.ends = {}
+        # Data already on disk from an earlier run is read back when its turn comes
+        for start, end in committed_ranges:
+            if end > start:
+                self._add(start, end)
+
+    def _add(self, start, end):
+        # Merge with the ranges directly before and after this one
+        previous = self.ends.pop(start, None)
+        if previous is not None:
+            del self.starts[previous]
+            start = previous
+        following = self.starts.pop(end, None)
+        if following is not None:
+            del self.ends[following]
+            end = following
+        self.starts[start] = end
+        self.ends[end] = start
+
+    def _catch_up(self, fd):
+        while self.offset in self.starts:
+            end = self.starts.pop(self.offset)
+            del self.ends[end]
+            while self.offset < end:
+                data = os.pread(fd, min(HASH_READ_SIZE, end - self.offset), self.offset)
+                if not data:
+                    raise IOError(f"Unexpected end of file at byte {self.offset} while hashing")
+                self.hash.update(data)
+                self.offset += len(data)
+
+    def written(self, fd, offset, data):
+        """Account for data written at offset"""
+        if offset == self.offset:
+            self.hash.update(data)
+            self.offset += len(data)
+        elif offset > self.offset:
+            self._add(offset, offset + len(data))
+        self._catch_up(fd)
+
+    def finish(self, fd, size):
+        """Hash anything still pending and check the whole file was covered"""
+        self._catch_up(fd)
+        if self.starts or (size and self.offset != size):
+            raise IOError(f"Could not hash the whole file, stopped at byte {self.offset}")
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+class ThreadedFileWriter:
+    """
+    Writes downloaded data to a file from a worker thread.
+
+    Data is buffered per segment and written with os.pwrite in large buffers
+    whose end offsets are aligned to WRITE_ALIGNMENT. At most MAX_PENDING_WRITES
+    writes are in flight, write() waits when that limit is reached so a slow
+    disk slows down the network reader instead of growing memory.
+
+    Every file gets its own writer thread, so writes finish in the order they
+    were submitted and on_written(key, nbytes) is called on the event loop in
+    that order. The resume state counts these bytes as committed, so there is
+    never a gap before the committed offset of a segment.
+
+    If a StreamHasher is given, every write is also fed to it on the writer thread.
+    """
+    def __init__(self, path, on_written=None, hasher=None, buffer_size=WRITE_BUFFER_SIZE, max_pending=MAX_PENDING_WRITES):
+        self.path = path
+        self.on_written = on_written
+        self.hasher = hasher
+        self.buffer_size = buffer_size
+        # Opened for reading too, the hasher reads back data written out of order
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model_downloader_writer')
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(max_pending)
+        self.pending = set()
+        self.buffers = {}
+        self.error = None
+
+    async def preallocate(self, size):
+        """Reserve size bytes on disk so the file doesn't fragment while segments fill it"""
+        if size <= 0:
+            return
+        await self.loop.run_in_executor(self.executor, preallocate_file, self.fd, size)
+
+    async def write(self, key, offset, data):
+        """Queue data received for segment key at offset"""
+        if self.error is not None:
+            raise self.error
+
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.offset + len(buffer.data) != offset:
+            # Not contiguous with what we buffered so far, write that out first
+            if buffer is not None and buffer.data:
+                await self._submit(key, buffer.offset, bytes(buffer.data))
+            buffer = self.buffers[key] = SegmentBuffer(offset)
+        buffer.data += data
+
+        if len(buffer.data) >= self.buffer_size:
+            # Write up to the last aligned offset and keep the rest buffered
+            end = buffer.offset + len(buffer.data)
+            aligned_end = end - end % WRITE_ALIGNMENT
+            if aligned_end <= buffer.offset:
+                aligned_end = end
+            length = aligned_end - buffer.offset
+            await self._submit(key, buffer.offset, bytes(buffer.data[:length]))
+            del buffer.data[:length]
+            buffer.offset = aligned_end
+
+    async def _submit(self, key, offset, data):
+        # Wait for a free slot, this is the backpressure on the network reader
+        await self.slots.acquire()
+        future = self.loop.run_in_executor(self.executor, write_all, self.fd, data, offset, self.hasher)
+        self.pending.add(future)
+
+        def done(future):
+            self.pending.discard(future)
+            self.slots.release()
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                self.error = error
+                logger.error(f"Error writing to {self.path}: {error}")
+            elif self.on_written is not None:
+                self.on_written(key, len(data))
+
+        future.add_done_callback(done)
+
+    async def flush(self):
+        """Write out every buffered segment and wait until all writes finished"""
+        for key, buffer in list(self.buffers.items()):
+            if buffer.data:
+                offset = buffer.offset
+                data = bytes(buffer.data)
+                buffer.offset += len(data)
+                buffer.data = bytearray()
+                await self._submit(key, offset, data)
+        if self.pending:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
+        if self.error is not None:
+            raise self.error
+
+    async def sync(self):
+        """Flush and make sure everything written so far is on disk"""
+        await self.flush()
+        await self.loop.run_in_executor(self.executor, os.fsync, self.fd)
+
+    async def finish_hash(self, size):
+        """Complete the hash once all data is written, see StreamHasher.finish"""
+        await self.flush()
+        if self.hasher is not None:
+            await self.loop.run_in_executor(self.executor, self.hasher.finish, self.fd, size)
+
+    async def close(self):
+        """Flush remaining data and close the file"""
+        try:
+            await self.flush()
+        finally:
+            # Close after any writes still running, without blocking the event loop
+            self.executor.submit(os.close, self.fd)
+            self.executor.shutdown(wait=False)
+
+def write_all(fd, data, offset, hasher=None):
+    """pwrite the whole buffer, pwrite may write less than asked"""
+    start = offset
+    started = time.monotonic()
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+    DISK_WRITE_SECONDS.observe(time.monotonic() - started)
+    if hasher is not None:
+        hasher.written(fd, start, data)
+
+def preallocate_file(fd, size):
+    """Allocate size bytes for the file, falling back to a sparse file if unsupported"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            logger.debug(f"posix_fallocate not supported here ({e}), using a sparse file")
+    os.ftruncate(fd, size)
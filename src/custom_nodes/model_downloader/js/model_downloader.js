@@ -4,6 +4,49 @@ if (window.location.hostname === 'localhost' || window.location.hostname === '12
     console.log("[MODEL_DOWNLOADER] Loading model downloader extension...");
 }
 
+// Last known state of every download, progress messages only carry changed fields
+const downloadStates = {};
+
+// Handle a batched progress message: {seq, downloads: {download_id: changed fields}}
+function handleBatchMessage(event) {
+    let batch = event && event.detail !== undefined ? event.detail : event;
+    if (batch && batch.type === 'model_download_progress_batch' && batch.data) {
+        batch = batch.data;
+    }
+    if (!batch || !batch.downloads) {
+        return;
+    }
+    
+    for (const [downloadId, delta] of Object.entries(batch.downloads)) {
+        const isNew = !downloadStates[downloadId];
+        const state = Object.assign(downloadStates[downloadId] || { download_id: downloadId }, delta);
+        downloadStates[downloadId] = state;
+        
+        // A tab opened mid-download only sees deltas, fetch the full record once
+        if (isNew && state.total_size === undefined) {
+            fetch(`/api/download-progress/${encodeURIComponent(downloadId)}`)
+                .then(response => response.json())
+                .then(result => {
+                    if (result.success && result.download) {
+                        // Fields received through deltas meanwhile are newer than the fetched record
+                        Object.assign(state, result.download, Object.assign({}, state));
+                    }
+                })
+                .catch(() => {});
+        }
+        
+        // Forward the merged state to our event handler function if available
+        if (window.modelDownloader && typeof window.modelDownloader.handleMessageEvent === 'function') {
+            window.modelDownloader.handleMessageEvent(Object.assign({}, state));
+        }
+        
+        // Forget finished downloads
+        if (state.status === 'completed' || state.status === 'error' || state.status === 'cancelled') {
+            delete downloadStates[downloadId];
+        }
+    }
+}
+
 // Register message handler as early as possible
 function registerMessageHandler() {
     try {
@@ -16,6 +59,7 @@ function registerMessageHandler() {
                 window.api.reportedUnknownMessageTypes = new Set();
             }
             window.api.reportedUnknownMessageTypes.add('model_download_progress');
+            window.api.reportedUnknownMessageTypes.add('model_download_progress_batch');
         }
         
         // Method 2: Using API extension system (newer ComfyUI versions)
@@ -29,6 +73,7 @@ function registerMessageHandler() {
                             window.modelDownloader.handleMessageEvent(data);
                         }
                     });
+                    window.api.addEventListener("model_download_progress_batch", handleBatchMessage);
                 }
             });
         }
@@ -40,6 +85,7 @@ function registerMessageHandler() {
                     window.modelDownloader.handleMessageEvent(event);
                 }
             });
+            window.app.registerMessageHandler('model_download_progress_batch', handleBatchMessage);
         }
         
         // Method 4: Direct WebSocket patching (fallback for older ComfyUI versions)
@@ -73,6 +119,8 @@ function registerMessageHandler() {
                             if (window.modelDownloader && typeof window.modelDownloader.handleMessageEvent === 'function') {
                                 window.modelDownloader.handleMessageEvent(message);
                             }
+                        } else if (message.type === 'model_download_progress_batch') {
+                            handleBatchMessage(message);
                         }
                     } catch (e) {
                         // Ignore JSON parse errors
@@ -0,0 +1,127 @@
+"""
+Mirror selection for the model downloader
+Ranks the mirrors of a model by a short probe and picks the mirror to
+continue from when the current one fails or stalls.
+"""
+
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger('model_downloader')
+
+class Mirror:
+    """One URL serving the model, with what its probe found out"""
+    def __init__(self, url):
+        self.url = url
+        self.probed = False
+        self.ttfb = None
+        self.throughput = None
+        self.total_size = 0
+        self.accept_ranges = False
+        self.etag = None
+        self.last_modified = None
+        self.error = None
+        self.failures = 0
+
+    def update(self, info):
+        """Take size, range support and validators from get_remote_info()"""
+        self.total_size = info['total_size']
+        self.accept_ranges = info['accept_ranges']
+        self.etag = info['etag']
+        self.last_modified = info['last_modified']
+
+    def usable(self):
+        return self.probed and self.error is None
+
+    def estimated_time(self):
+        """Seconds the probe suggests the whole file would take, lower is better"""
+        if not self.usable() or not self.throughput:
+            return math.inf
+        return self.ttfb + self.total_size / self.throughput
+
+    def describe(self):
+        """Describe the mirror for the download record"""
+        return {
+            'url': self.url,
+            'ttfb': None if self.ttfb is None else round(self.ttfb, 3),
+            'speed': None if self.throughput is None else round(self.throughput / (1024 * 1024), 2),
+            'failures': self.failures,
+            'error': self.error
+        }
+
+class MirrorSet:
+    """
+    Ordered mirrors of one download.
+
+    rank() probes every mirror at once and orders them by estimated download
+    time, the first usable mirror becomes current. switch() moves to the best
+    other mirror that can continue a partial file, i.e. one serving the same
+    size and honoring byte ranges, probing it first if needed.
+
+    probe(mirror) is a coroutine function filling in ttfb, throughput and
+    remote info of a mirror, or its error.
+    """
+    def __init__(self, urls, probe):
+        self.mirrors = [Mirror(url) for url in urls]
+        self.probe = probe
+        self.current = self.mirrors[0]
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def find(self, url):
+        for mirror in self.mirrors:
+            if mirror.url == url:
+                return mirror
+        return None
+
+    def use(self, url):
+        """Make the mirror with url current"""
+        mirror = self.find(url)
+        if mirror is not None:
+            self.current = mirror
+        return mirror
+
+    async def _probe(self, mirror):
+        try:
+            await self.probe(mirror)
+        except Exception as e:
+            mirror.error = str(e) or e.__class__.__name__
+        mirror.probed = True
+
+    async def rank(self):
+        """Probe all mirrors concurrently and order them fastest first, returns the current mirror"""
+        await asyncio.gather(*[self._probe(mirror) for mirror in self.mirrors])
+        # sorted() is stable, so equally fast mirrors keep the order they were given in
+        self.mirrors = sorted(self.mirrors, key=lambda mirror: mirror.estimated_time())
+        for mirror in self.mirrors:
+            if mirror.usable():
+                self.current = mirror
+                return mirror
+        errors = '; '.join(f"{mirror.url}: {mirror.error}" for mirror in self.mirrors)
+        raise Exception(f"No mirror could be reached ({errors})")
+
+    async def switch(self, total_size):
+        """
+        Move to another mirror that can continue a partial download of total_size
+        bytes. Mirrors that failed least often are tried first, then by rank.
+        Returns the new current mirror, or None if no other mirror can take over.
+        """
+        self.current.failures += 1
+        candidates = [mirror for mirror in self.mirrors if mirror is not self.current and mirror.error is None]
+        candidates.sort(key=lambda mirror: mirror.failures)
+        for mirror in candidates:
+            if not mirror.probed:
+                await self._probe(mirror)
+            if not mirror.usable():
+                continue
+            if not mirror.accept_ranges or (total_size and mirror.total_size != total_size):
+                logger.info(f"Mirror {mirror.url} can't continue this download, skipping it")
+                continue
+            self.current = mirror
+            return mirror
+        return None
+
+    def describe(self):
+        return [mirror.describe() for mirror in self.mirrors]
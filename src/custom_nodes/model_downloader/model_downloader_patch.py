@@ -6,8 +6,26 @@ import requests
 import json
 import logging
 import traceback
+import copy
+import re
+import uuid
+import threading
+from urllib.parse import urlparse
 import folder_paths
-from aiohttp import web, ClientSession, ClientTimeout
+from download_queue import DownloadScheduler
+from download_writer import ThreadedFileWriter, StreamHasher, disk_executor
+from progress_broadcast import ProgressBroadcaster
+from download_store import DownloadStore, FINISHED_STATUSES
+from bandwidth import BandwidthLimiter, from_mbps, to_mbps
+from mirrors import MirrorSet
+from workflow_models import find_workflow_models, safe_model_name
+from peer_cache import find_peer_copies, matching_copy, PEER_SHA256_HEADER
+from adaptive_transfer import AdaptiveChunkSize, StallDetector, StalledConnectionError, read_chunk
+from archive_extract import ZipExtractor, TarStreamExtractor, archive_format, archive_supported
+from cache_warmup import warm_file, warmup_executor
+import download_metrics
+from download_metrics import DOWNLOADED_BYTES, DOWNLOADS, RETRIES, ERRORS, MIRROR_SWITCHES, TIME_TO_FIRST_BYTE, THROUGHPUT
+from aiohttp import web, ClientSession, ClientTimeout, ClientError, TCPConnector
 from server import PromptServer
 
 # Setup logging
@@ -21,8 +39,170 @@ except Exception as e:
     logger.error(f"Error importing PromptServer: {e}")
     traceback.print_exc()
     
-# Store active downloads with their progress information
-active_downloads = {}
+# Persistent user directory set up by the persistence patch
+PERSISTENT_DIR = os.environ.get('COMFY_USER_DIR', os.path.join(os.path.expanduser('~'), '.config', 'comfy-ui'))
+
+# Download history database, kept in the persistent user directory
+DOWNLOAD_HISTORY_PATH = os.environ.get('COMFY_DOWNLOAD_HISTORY', os.path.join(PERSISTENT_DIR, 'download_history.db'))
+
+# Records of every download, finished ones are kept in the history database
+download_store = DownloadStore(DOWNLOAD_HISTORY_PATH)
+
+# Queued, running and paused downloads with their progress information
+active_downloads = download_store.active
+
+# Page size limits of the download history API
+DOWNLOADS_PAGE_SIZE = 50
+DOWNLOADS_MAX_PAGE_SIZE = 500
+
+# Number of parallel connections used for segmented (HTTP Range) downloads
+DOWNLOAD_CONNECTIONS = int(os.environ.get('COMFY_DOWNLOAD_CONNECTIONS', '4'))
+
+# Most connections a single download may ask for, every connection takes a slot of the shared connector
+MAX_DOWNLOAD_CONNECTIONS = max(DOWNLOAD_CONNECTIONS, int(os.environ.get('COMFY_DOWNLOAD_MAX_CONNECTIONS', '16')))
+
+# Files smaller than this are always fetched over a single stream
+SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+
+# Size of the first chunks read from a connection, later chunks follow its throughput
+CHUNK_SIZE = 1024 * 1024
+
+# Read buffer of each connection, larger than aiohttp's 64 KB so fast links pause less often
+READ_BUFFER_SIZE = 256 * 1024
+
+# Downloads are written to <path>.part and renamed once complete
+PART_SUFFIX = '.part'
+
+# Version of the .part.json resume state format
+STATE_VERSION = 1
+
+# Seconds between resume state checkpoints while downloading
+STATE_SAVE_INTERVAL = 5.0
+
+# A SHA-256 digest as sent by clients and in Hugging Face LFS ETags
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Number of times a dropped connection is retried before the download fails
+DOWNLOAD_RETRIES = int(os.environ.get('COMFY_DOWNLOAD_RETRIES', '3'))
+
+# Longest wait between two retries in seconds
+MAX_RETRY_DELAY = 30.0
+
+# A connection receiving less than DOWNLOAD_MIN_SPEED (KB/s) for DOWNLOAD_STALL_TIMEOUT
+# seconds is stalled and reconnected from its current offset, 0 disables the check
+DOWNLOAD_MIN_SPEED = float(os.environ.get('COMFY_DOWNLOAD_MIN_SPEED', '8')) * 1024
+DOWNLOAD_STALL_TIMEOUT = float(os.environ.get('COMFY_DOWNLOAD_STALL_TIMEOUT', '15'))
+
+# Reconnects of a stalled connection before it counts as a failed attempt
+STALL_RECONNECTS = 5
+
+# Wait before the first reconnect of a stalled connection, doubled for every further one
+STALL_RECONNECT_DELAY = 1.0
+
+# Most bytes of a finished download read back into the page cache in MB, 0 disables the warmup
+WARMUP_BUDGET = int(float(os.environ.get('COMFY_DOWNLOAD_WARMUP_BUDGET', '0')) * 1024 * 1024)
+
+# Maximum number of downloads running at once, in total and against a single host
+MAX_ACTIVE_DOWNLOADS = int(os.environ.get('COMFY_DOWNLOAD_MAX_ACTIVE', '3'))
+MAX_DOWNLOADS_PER_HOST = int(os.environ.get('COMFY_DOWNLOAD_MAX_PER_HOST', '2'))
+
+# Websocket message carrying batched progress deltas of all changed downloads
+PROGRESS_MESSAGE = 'model_download_progress_batch'
+
+# Seconds between progress messages
+PROGRESS_INTERVAL = 1.0
+
+# Whether clients get progress messages unless they opt out
+PROGRESS_DEFAULT_SUBSCRIBED = os.environ.get('COMFY_DOWNLOAD_PROGRESS_DEFAULT', '1') != '0'
+
+# Per client opt in/out of progress messages, keyed by websocket client ID
+progress_subscriptions = {}
+
+# Seconds between keepalive messages on idle progress streams
+STREAM_KEEPALIVE_INTERVAL = 15.0
+
+# Session shared by all downloads, see get_session()
+download_session = None
+
+# Download speed limits in MB/s, 0 means unlimited. The inference limit applies
+# to all downloads together while a prompt is executing, unset disables it
+MAX_DOWNLOAD_SPEED = float(os.environ.get('COMFY_DOWNLOAD_MAX_SPEED', '0'))
+INFERENCE_MAX_DOWNLOAD_SPEED = os.environ.get('COMFY_DOWNLOAD_INFERENCE_MAX_SPEED') or None
+
+# Bytes read from every mirror to measure its throughput before choosing one
+PROBE_SAMPLE_SIZE = 1024 * 1024
+
+# Seconds a mirror probe may take before the mirror counts as unreachable
+PROBE_TIMEOUT = 15.0
+
+# Seconds without data after which a download with mirrors moves to another mirror
+MIRROR_STALL_TIMEOUT = float(os.environ.get('COMFY_DOWNLOAD_MIRROR_STALL_TIMEOUT', '10'))
+MIRROR_TIMEOUT = ClientTimeout(total=None, connect=MIRROR_STALL_TIMEOUT, sock_connect=MIRROR_STALL_TIMEOUT, sock_read=MIRROR_STALL_TIMEOUT)
+
+# Base URLs of other ComfyUI hosts asked for a model before downloading it upstream
+DOWNLOAD_PEERS = [peer.strip() for peer in os.environ.get('COMFY_DOWNLOAD_PEERS', '').split(',') if peer.strip()]
+
+# Whether this host serves its model folders to peers
+PEER_SERVE = os.environ.get('COMFY_PEER_SERVE', '0') == '1'
+
+# Folders served to peers. Only model weights, never folders like custom_nodes or configs
+PEER_SERVE_FOLDERS = (
+    'checkpoints', 'loras', 'vae', 'vae_approx', 'text_encoders', 'clip', 'clip_vision',
+    'diffusion_models', 'unet', 'diffusers', 'controlnet', 'embeddings', 'hypernetworks', 'classifiers',
+    'upscale_models', 'style_models', 'gligen', 'photomaker', 'model_patches', 'audio_encoders'
+)
+
+# Statuses of downloads that still own their target file
+PENDING_STATUSES = ('queued', 'downloading', 'paused')
+
+def on_scheduler_state_change(download_id, state):
+    """Mirror scheduler state changes into active_downloads and notify clients"""
+    if download_id not in active_downloads or state == 'finished':
+        return
+    
+    download = active_downloads[download_id]
+    download['status'] = state
+    if state == 'downloading':
+        # Measure the download from when it actually starts, not from when it was queued
+        download['start_time'] = time.time()
+        download['transferred'] = 0
+    elif state in ('paused', 'cancelled'):
+        download['speed'] = 0
+        download['eta'] = 0
+        if state == 'cancelled':
+            download['end_time'] = time.time()
+    asyncio.ensure_future(send_download_update(download_id))
+
+# Queue that decides when each download may start
+download_scheduler = DownloadScheduler(MAX_ACTIVE_DOWNLOADS, MAX_DOWNLOADS_PER_HOST, on_scheduler_state_change)
+
+def get_model_full_path(folder, name):
+    """
+    Path of a model in its model folder. Unlike folder_paths.get_full_path,
+    never the copy in the fast cache tier of the persistence patch, and
+    looking a model up doesn't promote it there.
+    """
+    get_full_path = getattr(folder_paths, 'get_untiered_full_path', folder_paths.get_full_path)
+    return get_full_path(folder, name)
+
+def prompt_is_running():
+    """Whether ComfyUI is executing a prompt right now"""
+    prompt_queue = getattr(PromptServer.instance, 'prompt_queue', None)
+    return bool(prompt_queue is not None and prompt_queue.currently_running)
+
+# Rate limits applied to the network read loop of every download
+bandwidth_limiter = BandwidthLimiter(
+    from_mbps(MAX_DOWNLOAD_SPEED),
+    None if INFERENCE_MAX_DOWNLOAD_SPEED is None else from_mbps(INFERENCE_MAX_DOWNLOAD_SPEED),
+    prompt_is_running
+)
+
+def find_pending_download(path):
+    """Return the ID of a queued, running or paused download writing to path, or None"""
+    for download_id, download in active_downloads.items():
+        if download.get('path') == path and download.get('status') in PENDING_STATUSES:
+            return download_id
+    return None
 
 # Define the download model endpoint
 async def download_model(request):
@@ -79,6 +259,66 @@ async def download_model(request):
         folder = data.get('folder')
         filename = data.get('filename')
         
+        # Optional ordered list of mirrors serving the same file, url is the first mirror
+        urls = data.get('urls')
+        if urls is not None:
+            if not isinstance(urls, list) or not all(isinstance(mirror, str) and mirror for mirror in urls):
+                return web.json_response({"success": False, "error": "Invalid urls value, expected a list of URLs"})
+            if url:
+                urls = [url] + urls
+            # Drop duplicates, keeping the order
+            urls = list(dict.fromkeys(urls))
+            url = urls[0] if urls else None
+            if len(urls) < 2:
+                urls = None
+        
+        # Optional queue priority, higher priorities start first
+        priority = data.get('priority', 0)
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            return web.json_response({"success": False, "error": f"Invalid priority value: {priority}"})
+        
+        # Optional SHA-256 the downloaded file must match
+        sha256 = data.get('sha256')
+        if sha256:
+            sha256 = str(sha256).strip().lower()
+            if not SHA256_PATTERN.match(sha256):
+                return web.json_response({"success": False, "error": f"Invalid sha256 value: {sha256}"})
+        else:
+            sha256 = None
+        
+        # Optional number of parallel connections for segmented downloads
+        connections = data.get('connections')
+        if connections is not None:
+            try:
+                connections = max(1, int(connections))
+            except (TypeError, ValueError):
+                return web.json_response({"success": False, "error": f"Invalid connections value: {connections}"})
+            if connections > MAX_DOWNLOAD_CONNECTIONS:
+                return web.json_response({"success": False, "error": f"At most {MAX_DOWNLOAD_CONNECTIONS} connections are allowed per download"})
+        
+        # Optional speed limit of this download in MB/s
+        max_speed = data.get('max_speed')
+        if max_speed is not None:
+            try:
+                max_speed = from_mbps(max_speed)
+            except (TypeError, ValueError):
+                return web.json_response({"success": False, "error": f"Invalid max_speed value: {max_speed}"})
+        
+        # Optionally extract an archive into the folder instead of saving it
+        extract = data.get('extract', False)
+        if isinstance(extract, str):
+            extract = extract.lower() in ('1', 'true', 'yes')
+        if extract:
+            extract = archive_format(filename or '')
+            if not extract:
+                return web.json_response({"success": False, "error": f"Can't extract {filename}, supported archives are .zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz and .tar.zst"})
+            if not archive_supported(extract):
+                return web.json_response({"success": False, "error": f"Extracting {extract} archives needs the zstandard package"})
+        else:
+            extract = None
+        
         logger.info(f"Received download request for {filename} in folder {folder}")
         
         if not url or not folder or not filename:
@@ -97,41 +337,19 @@ async def download_model(request):
         
         logger.info(f"Will download model to {full_path}")
         
-        # Generate a unique download ID
-        download_id = f"{folder}_{filename}_{int(time.time())}"
-        
-        # Create a download entry
-        active_downloads[download_id] = {
-            'url': url,
-            'folder': folder,
-            'filename': filename,
-            'path': full_path,
-            'total_size': 0,
-            'downloaded': 0,
-            'percent': 0,
-            'status': 'downloading',
-            'error': None,
-            'start_time': time.time(),
-            'download_id': download_id
-        }
-        
-        # Create a separate async task for the download
-        # This allows us to return to the client immediately
-        async def start_download():
-            try:
-                # Start the actual download
-                await download_file(download_id, url, full_path)
-                
-            except Exception as e:
-                logger.error(f"Error in start_download: {e}")
-                if download_id in active_downloads:
-                    active_downloads[download_id]['status'] = 'error'
-                    active_downloads[download_id]['error'] = str(e)
-                    await send_download_update(download_id)
+        # Don't start a second download writing to the same file
+        pending_id = find_pending_download(full_path)
+        if pending_id:
+            logger.info(f"Download {pending_id} already writes to {full_path}")
+            return web.json_response({
+                "success": True,
+                "download_id": pending_id,
+                "status": active_downloads[pending_id]['status'],
+                "message": "Download is already in progress"
+            })
         
-        # Start the download as a separate task
-        # We don't await this!
-        PromptServer.instance.loop.create_task(start_download())
+        # Create the download entry and add it to the download queue
+        download_id = start_download_task(url, folder, filename, full_path, connections, priority, sha256, max_speed, urls, extract=extract)
         
         # Immediately return a response to the client
         logger.info(f"Download {download_id} queued, returning immediately to client")
@@ -147,14 +365,99 @@ async def download_model(request):
         logger.error(f"Error starting model download: {str(e)}")
         return web.json_response({"success": False, "error": str(e)})
 
-async def download_file(download_id, url, full_path):
+def start_download_task(url, folder, filename, full_path, connections=None, priority=0, sha256=None, max_speed=None, mirrors=None, replace=False, extract=None):
+    """
+    Register a download in active_downloads and submit it to the download queue.
+    With replace an existing file at full_path is overwritten once the download
+    completes, otherwise the download gets a timestamped filename.
+    extract is the format of an archive to extract into the folder of full_path
+    instead of saving it, see archive_format().
+    Returns the download ID.
+    """
+    # Generate a unique download ID, a timestamp would repeat for a file requested twice in one second
+    download_id = uuid.uuid4().hex
+    
+    # Create a download entry
+    download_store.add({
+        'url': url,
+        'folder': folder,
+        'filename': filename,
+        'path': full_path,
+        'total_size': 0,
+        'downloaded': 0,
+        'percent': 0,
+        'status': 'queued',
+        'error': None,
+        'priority': priority,
+        'expected_sha256': sha256,
+        'max_speed': to_mbps(max_speed) if max_speed else None,
+        'extract': extract,
+        'retries': 0,
+        'reconnects': 0,
+        'backoff': 0,
+        'queued_time': time.time(),
+        'start_time': time.time(),
+        'download_id': download_id
+    })
+    
+    bandwidth_limiter.set_download_limit(download_id, max_speed)
+    
+    # Run the download once the scheduler has a free slot
+    # This allows us to return to the client immediately
+    async def start_download():
+        try:
+            # Use the current path, a paused download may have been renamed on its first run
+            path = active_downloads.get(download_id, {}).get('path', full_path)
+            if extract and extract != 'zip':
+                # Tar archives are extracted as they arrive
+                await download_archive_stream(download_id, url, os.path.dirname(path), extract, sha256)
+            else:
+                await download_file(download_id, url, path, connections, sha256, mirrors, replace, extract)
+            
+        except Exception as e:
+            logger.error(f"Error in start_download: {e}")
+            if download_id in active_downloads:
+                active_downloads[download_id]['status'] = 'error'
+                active_downloads[download_id]['error'] = str(e)
+                await send_download_update(download_id)
+    
+    # Queue the download, the scheduler starts it as a separate task
+    # We don't await this!
+    download_scheduler.submit(download_id, url, start_download, priority)
+    
+    return download_id
+
+async def download_file(download_id, url, full_path, connections=None, sha256=None, mirrors=None, replace=False, extract=None):
     """
     Background task to download a file and update progress.
     Uses aiohttp for non-blocking downloads that won't starve the event loop.
+    Large files on servers that accept byte ranges are split into segments
+    fetched over `connections` parallel connections (default DOWNLOAD_CONNECTIONS).
+    
+    Data is written to `<full_path>.part` next to a `.part.json` state record and
+    only renamed to full_path once complete. Dropped connections are retried and
+    an interrupted download of the same file continues from the committed bytes.
+    
+    The SHA-256 of the file is computed while it downloads and checked against
+    sha256 or the Hugging Face LFS ETag, a mismatch fails the download.
+    
+    mirrors is an ordered list of URLs serving the same file, url being one of
+    them. They are probed and the fastest is used, when it fails or stalls the
+    download continues from another mirror with Range requests.
+    
+    If peers are configured, a peer that has the same file is used first and
+    the upstream mirrors are only a fallback.
+    
+    With extract set to 'zip', the finished archive is extracted into the
+    folder of full_path straight from the .part file, which is then deleted.
     """
     try:
         logger.info(f"Starting download task for {download_id} from {url} to {full_path}")
         
+        # Peers are asked for the model under its requested name
+        model_folder = active_downloads.get(download_id, {}).get('folder')
+        model_name = active_downloads.get(download_id, {}).get('filename')
+        
         # First verify the destination directory exists and is writable
         try:
             target_directory = os.path.dirname(full_path)
@@ -163,7 +466,7 @@ async def download_file(download_id, url, full_path):
                 logger.info(f"Created directory: {target_directory}")
             
             # Check if the file already exists - if so, add timestamp to avoid conflicts
-            if os.path.exists(full_path):
+            if os.path.exists(full_path) and not replace and not extract:
                 logger.warning(f"File already exists at {full_path}. Adding timestamp to avoid conflicts.")
                 filename_parts = os.path.splitext(os.path.basename(full_path))
                 timestamped_filename = f"{filename_parts[0]}_{int(time.time())}{filename_parts[1]}"
@@ -182,109 +485,187 @@ async def download_file(download_id, url, full_path):
                 await send_download_update(download_id)
             return
         
-        # Create ClientTimeout with reasonable values
-        timeout = ClientTimeout(total=None, connect=30, sock_connect=30, sock_read=30)
+        part_path = full_path + PART_SUFFIX
+        
+        # All downloads share one pooled session so connections, DNS lookups and
+        # TLS sessions are reused across files from the same host
+        session = get_session()
+        
+        if connections is None:
+            connections = DOWNLOAD_CONNECTIONS
         
-        # Use aiohttp for fully non-blocking IO
-        async with ClientSession(timeout=timeout) as session:
-            # First do a HEAD request to get the content length and verify URL
+        # All mirrors of the file, requests go to the current one. An interrupted
+        # download may have been using a mirror that wasn't requested this time, like a peer
+        urls = mirrors or [url]
+        state = load_download_state(part_path)
+        if state and state.get('url') not in urls and state.get('url') in (state.get('mirrors') or []):
+            urls = urls + [state['url']]
+        mirror_set = MirrorSet(urls, lambda mirror: probe_mirror(session, mirror))
+        # With other mirrors to fall back to, give up on a stalled one sooner
+        timeout = MIRROR_TIMEOUT if len(mirror_set) > 1 else None
+        
+        # Continue an interrupted download of the same remote file if possible.
+        # Only this case needs a HEAD request, to check the remote file is unchanged
+        if state and os.path.exists(part_path):
+            # Continue from the mirror the download was using when it stopped
+            mirror = mirror_set.use(state.get('url')) or mirror_set.current
+            url = mirror.url
+            info = None
             try:
                 async with session.head(url, allow_redirects=True) as head_response:
                     if head_response.status == 200:
-                        content_length = head_response.headers.get('content-length')
-                        if content_length:
-                            total_size = int(content_length)
-                            content_type = head_response.headers.get('content-type', '')
-                            
-                            logger.info(f"File size from HEAD: {total_size} bytes ({total_size / (1024 * 1024):.2f} MB)")
-                            
-                            # Update the download entry with the total size
-                            if download_id in active_downloads:
-                                active_downloads[download_id]['total_size'] = total_size
-                                active_downloads[download_id]['content_type'] = content_type
+                        info = get_remote_info(head_response)
                     else:
                         logger.warning(f"HEAD request returned status {head_response.status}")
             except Exception as e:
                 logger.warning(f"HEAD request failed: {e}")
             
-            # Start the actual download
-            async with session.get(url, allow_redirects=True) as response:
-                if response.status != 200:
-                    raise Exception(f"HTTP error {response.status}: {response.reason}")
-                
-                # Get file size if not already determined
-                total_size = 0
+            if info and can_resume(state, url, info['total_size'], info['etag'], info['last_modified'], info['accept_ranges']):
+                mirror.update(info)
+                mirror.probed = True
+                record_remote_info(download_id, info)
+                state['expected_sha256'] = sha256 or state.get('expected_sha256') or info['sha256']
+                committed = sum(segment[2] for segment in state['segments'])
+                logger.info(f"[{download_id}] Resuming download from {committed / (1024 * 1024):.2f} MB of {info['total_size'] / (1024 * 1024):.2f} MB")
+            else:
+                state = None
+        
+        first_response = None
+        if state is None:
+            # A copy on a LAN peer is preferred over every upstream mirror
+            peer_url = None
+            if DOWNLOAD_PEERS and model_folder and model_name:
+                peer_url = await find_peer_copy(download_id, session, model_folder, model_name, urls, sha256)
+            if peer_url:
+                urls = [peer_url] + urls
+                mirror_set = MirrorSet(urls, lambda mirror: probe_mirror(session, mirror))
+                timeout = MIRROR_TIMEOUT
+                url = peer_url
+                record_mirrors(download_id, mirror_set)
                 if download_id in active_downloads:
-                    total_size = active_downloads[download_id].get('total_size', 0)
-                
-                if total_size == 0:
-                    content_length = response.headers.get('content-length')
-                    if content_length:
-                        total_size = int(content_length)
-                        # Update the download entry with the total size
-                        if download_id in active_downloads:
-                            active_downloads[download_id]['total_size'] = total_size
-                            active_downloads[download_id]['content_type'] = response.headers.get('content-type', '')
-                
-                logger.info(f"Starting download of {total_size / (1024 * 1024):.2f} MB file")
-                
-                # Use a large chunk size (1MB) to reduce overhead
-                downloaded = 0
-                update_interval = 1.0  # Only send updates every 1 second
-                last_update_time = 0
-                percent_logged = -1  # Track last logged percentage
-                # Extract filename from full_path
-                extracted_filename = os.path.basename(full_path)
-                logger.info(f"[{download_id}] Beginning data transfer for {extracted_filename}")
-                
-                # Track start time for speed calculations
-                start_time = time.time()
-                
-                with open(full_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(1024 * 1024):
-                        if not chunk:
-                            break
-                            
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Update progress in memory
-                        if download_id in active_downloads:
-                            active_downloads[download_id]['downloaded'] = downloaded
-                            current_percent = 0
-                            if total_size > 0:
-                                current_percent = int((downloaded / total_size) * 100)
-                                active_downloads[download_id]['percent'] = current_percent
-                            
-                            # Calculate download speed and ETA
-                            current_time = time.time()
-                            time_elapsed = current_time - start_time
-                            
-                            # Calculate speed (only if we've downloaded something and time has passed)
-                            if downloaded > 0 and time_elapsed > 0:
-                                # Calculate speed in MB/s
-                                speed_mbps = downloaded / (1024 * 1024) / time_elapsed
-                                active_downloads[download_id]['speed'] = round(speed_mbps, 2)
-                                
-                                # Calculate ETA (if we know the total size and have a reasonable speed)
-                                if total_size > 0 and speed_mbps > 0:
-                                    bytes_remaining = total_size - downloaded
-                                    seconds_remaining = bytes_remaining / (speed_mbps * 1024 * 1024)
-                                    active_downloads[download_id]['eta'] = int(seconds_remaining)
-                            
-                            # Log progress at 10% increments
-                            if current_percent > 0 and current_percent % 10 == 0 and current_percent != percent_logged:
-                                percent_logged = current_percent
-                                speed = active_downloads[download_id].get('speed', 0)
-                                eta = active_downloads[download_id].get('eta', 0)
-                                eta_str = f", ETA: {eta//60}m {eta%60}s" if eta else ""
-                                logger.info(f"[{download_id}] Download progress: {current_percent}% ({downloaded/(1024*1024):.2f} MB of {total_size/(1024*1024):.2f} MB, {speed} MB/s{eta_str})")
-                            
-                            # Only send throttled updates
-                            current_time = time.time()
-                            if current_time - last_update_time >= update_interval:
-                                last_update_time = current_time
-                                await send_download_update(download_id)
+                    active_downloads[download_id]['peer'] = peer_url
+            elif len(mirror_set) > 1:
+                # Race the mirrors and download from the fastest one
+                url = (await mirror_set.rank()).url
+                for mirror in mirror_set.mirrors:
+                    if mirror.error:
+                        logger.info(f"[{download_id}] Mirror {mirror.url} unavailable: {mirror.error}")
+                    else:
+                        logger.info(f"[{download_id}] Mirror {mirror.url}: first byte after {mirror.ttfb:.3f}s, {mirror.throughput / (1024 * 1024):.2f} MB/s")
+                logger.info(f"[{download_id}] Downloading from fastest mirror {url}")
+                record_mirrors(download_id, mirror_set)
+            
+            # Start the transfer right away and learn the size, range support and
+            # validators from the GET response itself instead of a separate HEAD.
+            # An open ended range lets a single request tell us whether ranges work
+            headers = {'Range': 'bytes=0-'} if connections > 1 or len(mirror_set) > 1 else {}
+            requested = time.monotonic()
+            first_response = await session.get(url, headers=headers, allow_redirects=True, timeout=timeout or session.timeout)
+            TIME_TO_FIRST_BYTE.observe(time.monotonic() - requested, host=urlparse(url).hostname)
+            if first_response.status not in (200, 206):
+                first_response.release()
+                raise Exception(f"HTTP error {first_response.status}: {first_response.reason}")
+            
+            info = get_remote_info(first_response)
+            mirror_set.current.update(info)
+            mirror_set.current.probed = True
+            record_remote_info(download_id, info)
+            total_size = info['total_size']
+            if total_size:
+                logger.info(f"File size: {total_size} bytes ({total_size / (1024 * 1024):.2f} MB)")
+            
+            # Split large files into byte ranges fetched over parallel connections
+            # when the server honored the range, otherwise use a single stream
+            if not (info['accept_ranges'] and total_size >= SEGMENTED_MIN_SIZE):
+                connections = 1
+            state = new_download_state(url, full_path, total_size, info['etag'], info['last_modified'], connections)
+            state['expected_sha256'] = sha256 or info['sha256']
+            if len(mirror_set) > 1:
+                state['mirrors'] = urls
+            if download_id in active_downloads:
+                state['folder'] = active_downloads[download_id].get('folder')
+                state['filename'] = os.path.basename(full_path)
+            if extract:
+                state['extract'] = extract
+            prepare_part_file(part_path)
+        
+        save_download_state(part_path, state)
+        
+        # Hash the file as it arrives, bytes kept from an earlier run are read back
+        hasher = StreamHasher((segment[0], segment[0] + segment[2]) for segment in state['segments'])
+        
+        # Retry dropped connections, each attempt continues from the committed bytes.
+        # Every other mirror gets a chance on top of the usual retries
+        retries = DOWNLOAD_RETRIES + len(mirror_set) - 1
+        attempt = 0
+        while True:
+            try:
+                # Stalled connections are reconnected in place, unless another mirror can take over
+                stall_reconnects = STALL_RECONNECTS if len(mirror_set) == 1 else 0
+                downloaded = await transfer_segments(download_id, session, state['url'], part_path, state, first_response, hasher, timeout, stall_reconnects)
+                break
+            except RangeNotSupportedError as e:
+                record_retry(download_id, e)
+                # Another mirror may let us continue where we stopped
+                if await switch_mirror(download_id, mirror_set, state, e):
+                    save_download_state(part_path, state)
+                    continue
+                # The server will not let us continue where we stopped, start over
+                logger.warning(f"[{download_id}] {e}, restarting over a single stream")
+                expected_sha256 = state.get('expected_sha256')
+                state = new_download_state(state['url'], full_path, state['total_size'], None, None, 1)
+                state['expected_sha256'] = expected_sha256
+                if len(mirror_set) > 1:
+                    state['mirrors'] = urls
+                prepare_part_file(part_path)
+                save_download_state(part_path, state)
+                hasher = StreamHasher()
+            except RETRYABLE_ERRORS as e:
+                save_download_state(part_path, state)
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                # Continue right away from another mirror if there is one
+                if await switch_mirror(download_id, mirror_set, state, e):
+                    record_retry(download_id, e)
+                    save_download_state(part_path, state)
+                    continue
+                delay = min(2 ** attempt, MAX_RETRY_DELAY)
+                record_retry(download_id, e, delay)
+                logger.warning(f"[{download_id}] Connection lost ({e!r}), retrying in {delay}s (attempt {attempt}/{retries})")
+                await asyncio.sleep(delay)
+            finally:
+                # The probing response is only used by the first attempt
+                if first_response is not None:
+                    first_response.release()
+                    first_response = None
+        
+        total_size = 0
+        if download_id in active_downloads:
+            total_size = active_downloads[download_id].get('total_size', 0)
+        
+        # Verify the file before it is moved into the model folder
+        digest = hasher.hexdigest()
+        expected_sha256 = state.get('expected_sha256')
+        if download_id in active_downloads:
+            active_downloads[download_id]['sha256'] = digest
+            active_downloads[download_id]['expected_sha256'] = expected_sha256
+            active_downloads[download_id]['verified'] = digest == expected_sha256 if expected_sha256 else None
+        if expected_sha256 and digest != expected_sha256:
+            # The data is wrong, resuming would only reproduce the same file
+            discard_partial_download(part_path)
+            raise ChecksumMismatchError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest}")
+        if expected_sha256:
+            logger.info(f"[{download_id}] SHA-256 verified: {digest}")
+        
+        if extract:
+            # The archive never enters the model folder, only its contents do
+            await extract_downloaded_archive(download_id, part_path, os.path.dirname(full_path))
+            discard_partial_download(part_path)
+        else:
+            # Move the finished file into place and drop the resume state
+            os.replace(part_path, full_path)
+            remove_download_state(part_path)
         
         # Download completed successfully
         elapsed_time = time.time() - active_downloads[download_id]['start_time'] if download_id in active_downloads else 0
@@ -294,22 +675,38 @@ async def download_file(download_id, url, full_path):
         
         # Update status to completed
         if download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'completed'
-            active_downloads[download_id]['end_time'] = time.time()
-            active_downloads[download_id]['downloaded'] = downloaded
-            active_downloads[download_id]['percent'] = 100 if total_size > 0 else 0
+            record = active_downloads[download_id]
+            record['status'] = 'completed'
+            record['end_time'] = time.time()
+            record['downloaded'] = downloaded
+            record['percent'] = 100 if total_size > 0 else 0
+            warm_up = WARMUP_BUDGET > 0 and not extract
+            if warm_up:
+                record['warmed'] = 'pending'
             await send_download_update(download_id)
+            
+            # The hash is known now, the model index and store don't need to read the file for it.
+            # It is the hash of the archive for extracted downloads, which leave no file at full_path.
+            if record.get('sha256') and not extract:
+                register_downloaded_model(full_path, record['sha256'])
+            
+            # The queue slot is free again, warming the page cache happens in the background
+            if warm_up:
+                task = asyncio.ensure_future(warm_up_download(record, full_path))
+                warmup_tasks.add(task)
+                task.add_done_callback(warmup_tasks.discard)
         
         logger.info(f"[{download_id}] Model downloaded successfully to {full_path}")
-        
-        # Keep the download info for 60 seconds so the frontend can see it completed
-        await asyncio.sleep(60)
-        if download_id in active_downloads:
-            del active_downloads[download_id]
             
+    except asyncio.CancelledError:
+        # Paused downloads keep their .part file so they can continue later
+        if (download_store.get(download_id) or {}).get('status') == 'cancelled':
+            discard_partial_download(full_path + PART_SUFFIX)
+        raise
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"Error downloading file: {e}")
+        ERRORS.inc(cause=type(e).__name__)
         
         # Update status to error
         if download_id in active_downloads:
@@ -317,37 +714,844 @@ async def download_file(download_id, url, full_path):
             active_downloads[download_id]['error'] = str(e)
             active_downloads[download_id]['end_time'] = time.time()
             
+            # Let the client know that retrying will continue from the .part file
+            part_path = full_path + PART_SUFFIX
+            active_downloads[download_id]['resumable'] = os.path.exists(part_path) and load_download_state(part_path) is not None
+            
             # Send update
             await send_download_update(download_id)
 
+def register_downloaded_model(path, sha256):
+    """
+    Hand a downloaded model to the persistence patch, if it is installed: link
+    it into the model store, which replaces it by the stored copy if the same
+    model is there already, and record its hash in the model index
+    """
+    model_store = getattr(folder_paths, 'model_store', None)
+    model_index = getattr(folder_paths, 'model_index', None)
+    if model_store is None and model_index is None:
+        return
+    
+    def register():
+        if model_store is not None:
+            model_store.link_download(path, sha256)
+        if model_index is not None:
+            model_index.record_hash(path, sha256)
+    
+    def log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Could not add {path} to the model index and store: {future.exception()}")
+    
+    future = asyncio.get_running_loop().run_in_executor(None, register)
+    future.add_done_callback(log_failure)
+
+# Running page cache warmups, referenced so they aren't garbage collected
+warmup_tasks = set()
+
+async def warm_up_download(record, path):
+    """
+    Read a completed download back into the page cache off the event loop,
+    within WARMUP_BUDGET and the free memory, and record the outcome in the
+    download record: warmed is warm, partial (only the start of the file
+    fit), skipped (no free memory) or error, with warmed_bytes and warmup_time.
+    """
+    download_id = record['download_id']
+    record['warmed'] = 'warming'
+    progress_broadcaster.mark(download_id)
+    started = time.monotonic()
+    warmed = 0
+    try:
+        warmed, size = await asyncio.get_running_loop().run_in_executor(warmup_executor, warm_file, path, WARMUP_BUDGET)
+        record['warmed'] = 'warm' if warmed >= size else 'partial' if warmed else 'skipped'
+    except Exception as e:
+        logger.warning(f"[{download_id}] Could not warm {path} into the page cache: {e}")
+        record['warmed'] = 'error'
+    record['warmed_bytes'] = warmed
+    record['warmup_time'] = round(time.monotonic() - started, 3)
+    logger.info(f"[{download_id}] Page cache warmup {record['warmed']}: {warmed / (1024 * 1024):.2f} MB in {record['warmup_time']}s")
+    download_store.save(download_id)
+    progress_broadcaster.mark(download_id)
+
+async def download_archive_stream(download_id, url, destination, archive, sha256=None):
+    """
+    Download a tar archive and extract it into destination while it arrives,
+    the archive itself is never written to disk. A dropped or stalled
+    connection continues from the last byte received with a Range request.
+    Everything extracted is removed again if the download fails, is paused
+    or is cancelled, so a resumed download starts over.
+    """
+    extractor = None
+    try:
+        logger.info(f"Starting archive download {download_id} from {url} into {destination}")
+        os.makedirs(destination, exist_ok=True)
+        session = get_session()
+        extractor = TarStreamExtractor(destination, archive, extraction_progress(download_id))
+        extractor.start()
+        
+        progress = DownloadProgress(download_id)
+        host = urlparse(url).hostname
+        info = None
+        received = 0
+        attempt = 0
+        while True:
+            try:
+                headers = {}
+                if received:
+                    headers['Range'] = f"bytes={received}-"
+                    etag = info['etag']
+                    validator = etag if etag and not etag.startswith('W/') else info['last_modified']
+                    if validator:
+                        headers['If-Range'] = validator
+                requested = time.monotonic()
+                async with session.get(url, headers=headers, allow_redirects=True) as response:
+                    TIME_TO_FIRST_BYTE.observe(time.monotonic() - requested, host=host)
+                    if received and response.status != 206:
+                        raise RangeNotSupportedError(f"Server can't continue the archive from byte {received}")
+                    if response.status not in (200, 206):
+                        raise Exception(f"HTTP error {response.status}: {response.reason}")
+                    if info is None:
+                        info = get_remote_info(response)
+                        record_remote_info(download_id, info)
+                        progress.total_size = info['total_size']
+                    
+                    chunk_size = AdaptiveChunkSize(CHUNK_SIZE)
+                    stall = StallDetector(DOWNLOAD_MIN_SPEED, DOWNLOAD_STALL_TIMEOUT) if DOWNLOAD_STALL_TIMEOUT > 0 else None
+                    chunk_started = time.monotonic()
+                    while True:
+                        try:
+                            pieces = await read_chunk(response.content, chunk_size.size, stall)
+                        except StalledConnectionError:
+                            response.close()
+                            raise
+                        if not pieces:
+                            break
+                        nbytes = 0
+                        for piece in pieces:
+                            # Waits here when extraction can't keep up with the network
+                            await extractor.feed(piece)
+                            nbytes += len(piece)
+                        received += nbytes
+                        DOWNLOADED_BYTES.inc(nbytes, host=host)
+                        await progress.add(nbytes)
+                        await bandwidth_limiter.consume(download_id, nbytes)
+                        now = time.monotonic()
+                        chunk_size.update(nbytes, now - chunk_started)
+                        chunk_started = now
+                
+                if info['total_size'] and received < info['total_size']:
+                    raise IncompleteSegmentError(f"Archive ended early at byte {received}")
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt >= DOWNLOAD_RETRIES:
+                    raise
+                attempt += 1
+                delay = min(2 ** attempt, MAX_RETRY_DELAY)
+                record_retry(download_id, e, delay)
+                logger.warning(f"[{download_id}] Connection lost ({e!r}), continuing from byte {received} in {delay}s (attempt {attempt}/{DOWNLOAD_RETRIES})")
+                await asyncio.sleep(delay)
+        
+        # Wait for the last entries to be written
+        await extractor.finish()
+        
+        digest = extractor.hexdigest()
+        expected_sha256 = sha256 or info['sha256']
+        if download_id in active_downloads:
+            active_downloads[download_id]['sha256'] = digest
+            active_downloads[download_id]['expected_sha256'] = expected_sha256
+            active_downloads[download_id]['verified'] = digest == expected_sha256 if expected_sha256 else None
+        if expected_sha256 and digest != expected_sha256:
+            raise ChecksumMismatchError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest}")
+        
+        record_extraction(download_id, extractor)
+        logger.info(f"[{download_id}] Extracted {len(extractor.files)} files ({extractor.extracted_bytes / (1024 * 1024):.2f} MB) into {destination}")
+        
+        if download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'completed'
+            active_downloads[download_id]['end_time'] = time.time()
+            active_downloads[download_id]['downloaded'] = received
+            active_downloads[download_id]['percent'] = 100 if info['total_size'] else 0
+            await send_download_update(download_id)
+    
+    except asyncio.CancelledError:
+        if extractor is not None:
+            await extractor.abort()
+        raise
+    except Exception as e:
+        logger.error(f"Error downloading archive: {e}")
+        ERRORS.inc(cause=type(e).__name__)
+        if extractor is not None:
+            await extractor.abort()
+        if download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = str(e)
+            active_downloads[download_id]['end_time'] = time.time()
+            active_downloads[download_id]['resumable'] = False
+            await send_download_update(download_id)
+
+async def extract_downloaded_archive(download_id, archive_path, destination):
+    """Extract a downloaded zip archive into destination from a worker thread"""
+    extractor = ZipExtractor(destination, extraction_progress(download_id))
+    logger.info(f"[{download_id}] Extracting archive into {destination}")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, extractor.extract, archive_path)
+    except asyncio.CancelledError:
+        # The thread stops at the next entry and removes what it extracted
+        extractor.aborted = True
+        raise
+    record_extraction(download_id, extractor)
+    logger.info(f"[{download_id}] Extracted {len(extractor.files)} files ({extractor.extracted_bytes / (1024 * 1024):.2f} MB) into {destination}")
+
+def extraction_progress(download_id):
+    """Callback for an extractor thread, recording each extracted entry in the download record"""
+    loop = asyncio.get_running_loop()
+    def on_entry(name, nbytes):
+        loop.call_soon_threadsafe(record_extracted_entry, download_id, name, nbytes)
+    return on_entry
+
+def record_extracted_entry(download_id, name, nbytes):
+    record = active_downloads.get(download_id)
+    if record is None:
+        return
+    record['extracted_entries'] = record.get('extracted_entries', 0) + 1
+    record['extracted_bytes'] = record.get('extracted_bytes', 0) + nbytes
+    record['current_entry'] = name
+    progress_broadcaster.mark(download_id)
+
+def record_extraction(download_id, extractor):
+    """Record the files an extraction created and the entries it skipped"""
+    record = active_downloads.get(download_id)
+    if record is None:
+        return
+    record['extracted_files'] = extractor.files
+    record['extracted_entries'] = len(extractor.files)
+    record['extracted_bytes'] = extractor.extracted_bytes
+    record['skipped_entries'] = extractor.skipped
+    record.pop('current_entry', None)
+
+class RangeNotSupportedError(Exception):
+    """Raised when a server ignores a byte range request"""
+    pass
+
+class ChecksumMismatchError(Exception):
+    """Raised when a downloaded file does not match its expected SHA-256"""
+    pass
+
+class IncompleteSegmentError(Exception):
+    """Raised when a connection ends before all bytes of a segment arrived"""
+    pass
+
+# Errors after which a download is retried from the committed bytes
+RETRYABLE_ERRORS = (ClientError, asyncio.TimeoutError, ConnectionError, IncompleteSegmentError, StalledConnectionError)
+
+def get_session():
+    """
+    Return the session shared by all downloads, creating it on first use.
+    The connector keeps connections alive between downloads and caches DNS lookups.
+    """
+    global download_session
+    if download_session is None or download_session.closed:
+        connector = TCPConnector(
+            limit=MAX_ACTIVE_DOWNLOADS * DOWNLOAD_CONNECTIONS,
+            limit_per_host=MAX_DOWNLOADS_PER_HOST * DOWNLOAD_CONNECTIONS,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        # Create ClientTimeout with reasonable values
+        timeout = ClientTimeout(total=None, connect=30, sock_connect=30, sock_read=30)
+        download_session = ClientSession(connector=connector, timeout=timeout, read_bufsize=READ_BUFFER_SIZE)
+    return download_session
+
+async def close_download_session(app=None):
+    """Close the shared download session, registered as an aiohttp cleanup handler"""
+    global download_session
+    if download_session is not None and not download_session.closed:
+        await download_session.close()
+        logger.info("Closed model downloader HTTP session")
+    download_session = None
+
+def get_remote_info(response):
+    """
+    Extract size, range support and validators from a HEAD or GET response.
+    A 206 response to an open ended range carries the full size in Content-Range.
+    """
+    total_size = 0
+    accept_ranges = False
+    if response.status == 206:
+        accept_ranges = True
+        content_range = response.headers.get('content-range', '')
+        if '/' in content_range and not content_range.endswith('/*'):
+            total_size = int(content_range.rsplit('/', 1)[1])
+    else:
+        # Only trust the header when we didn't already ask for a range that was ignored
+        if response.method == 'HEAD' or 'Range' not in response.request_info.headers:
+            accept_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+        content_length = response.headers.get('content-length')
+        if content_length:
+            total_size = int(content_length)
+    
+    # Hugging Face sends the SHA-256 of LFS files as X-Linked-Etag on the
+    # resolve response, before redirecting to the CDN
+    sha256 = None
+    for hop in list(response.history) + [response]:
+        linked_etag = hop.headers.get('x-linked-etag', '').strip('"').lower()
+        if SHA256_PATTERN.match(linked_etag):
+            sha256 = linked_etag
+    
+    return {
+        'total_size': total_size,
+        'accept_ranges': accept_ranges,
+        'sha256': sha256,
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'content_type': response.headers.get('content-type', '')
+    }
+
+async def probe_mirror(session, mirror):
+    """
+    Measure the time to first byte and the throughput of a mirror by reading
+    the first PROBE_SAMPLE_SIZE bytes of the file, and record its remote info
+    """
+    async def probe():
+        started = time.monotonic()
+        headers = {'Range': f"bytes=0-{PROBE_SAMPLE_SIZE - 1}"}
+        async with session.get(mirror.url, headers=headers, allow_redirects=True, timeout=MIRROR_TIMEOUT) as response:
+            if response.status not in (200, 206):
+                raise Exception(f"HTTP error {response.status}: {response.reason}")
+            mirror.ttfb = time.monotonic() - started
+            TIME_TO_FIRST_BYTE.observe(mirror.ttfb, host=urlparse(mirror.url).hostname)
+            info = get_remote_info(response)
+            # A 206 only tells us the size of the range, not of the file
+            if response.status == 206 and not info['total_size']:
+                raise Exception("Unknown file size")
+            mirror.update(info)
+            
+            received = 0
+            async for chunk in response.content.iter_any():
+                received += len(chunk)
+                if received >= PROBE_SAMPLE_SIZE:
+                    break
+            elapsed = max(time.monotonic() - started - mirror.ttfb, 0.001)
+            mirror.throughput = received / elapsed
+    
+    await asyncio.wait_for(probe(), PROBE_TIMEOUT)
+
+async def find_peer_copy(download_id, session, folder, name, urls, sha256=None):
+    """
+    Ask the configured peers for a model and return the URL of a copy that is
+    the same file as upstream, or None. Copies are matched by SHA-256 when the
+    peer and we both know it, otherwise by the size of the upstream file.
+    """
+    copies = await find_peer_copies(session, DOWNLOAD_PEERS, folder, name)
+    if not copies:
+        logger.info(f"[{download_id}] No peer has {folder}/{name}")
+        return None
+    
+    size = None
+    if not sha256 or any(copy['sha256'] is None for copy in copies):
+        # Upstream tells us the size, and the SHA-256 of Hugging Face LFS files
+        for upstream in urls:
+            try:
+                async with session.head(upstream, allow_redirects=True) as response:
+                    if response.status == 200:
+                        info = get_remote_info(response)
+                        size = info['total_size'] or None
+                        sha256 = sha256 or info['sha256']
+                        break
+            except Exception as e:
+                logger.warning(f"HEAD request for {upstream} failed: {e}")
+    
+    copy = matching_copy(copies, size, sha256)
+    if copy is None:
+        logger.info(f"[{download_id}] Peers have {folder}/{name} but it doesn't match the upstream file")
+        return None
+    logger.info(f"[{download_id}] Copying {folder}/{name} from peer {copy['url']}")
+    return copy['url']
+
+async def switch_mirror(download_id, mirror_set, state, error):
+    """
+    Move a download to another mirror after the current one failed with error.
+    The resume state follows the mirror so a later resume validates against it.
+    Returns the new mirror, or None if there is no mirror to move to.
+    """
+    if len(mirror_set) < 2:
+        return None
+    previous = mirror_set.current.url
+    mirror = await mirror_set.switch(state['total_size'])
+    if mirror is not None:
+        logger.warning(f"[{download_id}] Mirror {previous} failed ({error!r}), continuing from {mirror.url}")
+        MIRROR_SWITCHES.inc(host=urlparse(previous).hostname)
+        state['url'] = mirror.url
+        state['etag'] = mirror.etag
+        state['last_modified'] = mirror.last_modified
+        if download_id in active_downloads:
+            active_downloads[download_id]['url'] = mirror.url
+            active_downloads[download_id]['mirror_switches'] = active_downloads[download_id].get('mirror_switches', 0) + 1
+    record_mirrors(download_id, mirror_set)
+    return mirror
+
+def record_mirrors(download_id, mirror_set):
+    """Update the download entry with the mirror in use and what is known about each mirror"""
+    if download_id in active_downloads:
+        active_downloads[download_id]['url'] = mirror_set.current.url
+        active_downloads[download_id]['mirrors'] = mirror_set.describe()
+
+def record_retry(download_id, error, delay=0, reconnect=False):
+    """Count a retry of a download in its record and the metrics, delay being the backoff before it"""
+    RETRIES.inc(cause=type(error).__name__)
+    record = active_downloads.get(download_id)
+    if record is None:
+        return
+    record['retries'] = record.get('retries', 0) + 1
+    if reconnect:
+        record['reconnects'] = record.get('reconnects', 0) + 1
+    record['backoff'] = round(record.get('backoff', 0) + delay, 3)
+    record['last_retry_error'] = str(error) or type(error).__name__
+    progress_broadcaster.mark(download_id)
+
+def record_remote_info(download_id, info):
+    """Update the download entry with the total size and content type"""
+    if download_id in active_downloads and info['total_size']:
+        active_downloads[download_id]['total_size'] = info['total_size']
+        active_downloads[download_id]['content_type'] = info['content_type']
+
+def get_state_path(part_path):
+    """Path of the sidecar state record for a .part file"""
+    return part_path + '.json'
+
+def load_download_state(part_path):
+    """Load the resume state for a .part file, or None if there is no usable state"""
+    try:
+        with open(get_state_path(part_path), 'r') as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION or not state.get('segments'):
+            return None
+        return state
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable download state for {part_path}: {e}")
+        return None
+
+def save_download_state(part_path, state):
+    """Atomically write the resume state for a .part file"""
+    state['updated'] = time.time()
+    state_path = get_state_path(part_path)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def remove_download_state(part_path):
+    """Delete the resume state for a .part file"""
+    try:
+        os.remove(get_state_path(part_path))
+    except FileNotFoundError:
+        pass
+
+def discard_partial_download(part_path):
+    """Delete a .part file and its resume state"""
+    remove_download_state(part_path)
+    try:
+        os.remove(part_path)
+        logger.info(f"Removed partial download {part_path}")
+    except FileNotFoundError:
+        pass
+
+def new_download_state(url, full_path, total_size, etag, last_modified, connections):
+    """
+    Create the resume state for a fresh download.
+    Each segment is [start, end, committed] where end is None if the size is unknown.
+    """
+    if total_size > 0:
+        # Never use segments smaller than a single chunk
+        connections = max(1, min(connections, MAX_DOWNLOAD_CONNECTIONS, total_size // CHUNK_SIZE))
+        segment_size = total_size // connections
+        segments = []
+        for i in range(connections):
+            start = i * segment_size
+            end = total_size - 1 if i == connections - 1 else start + segment_size - 1
+            segments.append([start, end, 0])
+    else:
+        segments = [[0, None, 0]]
+    
+    return {
+        'version': STATE_VERSION,
+        'url': url,
+        'path': full_path,
+        'total_size': total_size,
+        'etag': etag,
+        'last_modified': last_modified,
+        'segments': segments,
+        'created': time.time()
+    }
+
+def can_resume(state, url, total_size, etag, last_modified, accept_ranges):
+    """Check that a saved state refers to the same, unchanged remote file"""
+    if state.get('url') != url or not accept_ranges:
+        return False
+    if total_size <= 0 or state.get('total_size') != total_size:
+        return False
+    # Without a validator we cannot tell whether the remote file changed
+    if not (etag or last_modified):
+        return False
+    if state.get('etag') != etag or state.get('last_modified') != last_modified:
+        return False
+    return True
+
+def prepare_part_file(part_path):
+    """Create an empty .part file, it is preallocated by the writer once the transfer starts"""
+    with open(part_path, 'wb'):
+        pass
+
+class DownloadProgress:
+    """
+    Tracks the combined progress of a download and mirrors it into active_downloads.
+    Shared between all connections of a segmented download so that total_size,
+    percent, speed and eta always describe the whole file.
+    """
+    def __init__(self, download_id, total_size=0, downloaded=0):
+        self.download_id = download_id
+        self.total_size = total_size
+        self.downloaded = downloaded
+        self.initial = downloaded  # Bytes already present when a download resumes
+        self.percent_logged = -1  # Track last logged percentage
+        self.start_time = time.time()  # Track start time for speed calculations
+    
+    async def add(self, nbytes):
+        """Record nbytes of newly received data and flag the download for the next progress tick"""
+        self.downloaded += nbytes
+        download_id = self.download_id
+        downloaded = self.downloaded
+        total_size = self.total_size
+        
+        # Update progress in memory
+        if download_id not in active_downloads:
+            return
+        
+        active_downloads[download_id]['downloaded'] = downloaded
+        active_downloads[download_id]['transferred'] = active_downloads[download_id].get('transferred', 0) + nbytes
+        current_percent = 0
+        if total_size > 0:
+            current_percent = int((downloaded / total_size) * 100)
+            active_downloads[download_id]['percent'] = current_percent
+        
+        # Calculate download speed and ETA
+        current_time = time.time()
+        time_elapsed = current_time - self.start_time
+        transferred = downloaded - self.initial
+        
+        # Calculate speed (only if we've downloaded something and time has passed)
+        if transferred > 0 and time_elapsed > 0:
+            # Calculate speed in MB/s
+            speed_mbps = transferred / (1024 * 1024) / time_elapsed
+            active_downloads[download_id]['speed'] = round(speed_mbps, 2)
+            
+            # Calculate ETA (if we know the total size and have a reasonable speed)
+            if total_size > 0 and speed_mbps > 0:
+                bytes_remaining = total_size - downloaded
+                seconds_remaining = bytes_remaining / (speed_mbps * 1024 * 1024)
+                active_downloads[download_id]['eta'] = int(seconds_remaining)
+        
+        # Log progress at 10% increments
+        if current_percent > 0 and current_percent % 10 == 0 and current_percent != self.percent_logged:
+            self.percent_logged = current_percent
+            speed = active_downloads[download_id].get('speed', 0)
+            eta = active_downloads[download_id].get('eta', 0)
+            eta_str = f", ETA: {eta//60}m {eta%60}s" if eta else ""
+            logger.info(f"[{download_id}] Download progress: {current_percent}% ({downloaded/(1024*1024):.2f} MB of {total_size/(1024*1024):.2f} MB, {speed} MB/s{eta_str})")
+        
+        # The broadcaster coalesces these into one message per second
+        progress_broadcaster.mark(download_id)
+
+async def transfer_segments(download_id, session, url, part_path, state, first_response=None, hasher=None, timeout=None, stall_reconnects=0):
+    """
+    Fetch every unfinished segment of a download into the .part file.
+    Segments are fetched in parallel, each one writing at its own offset and
+    recording its committed bytes in the state, which is saved periodically.
+    first_response is an already open response for the start of the file,
+    it is read by the first segment instead of sending a new request.
+    hasher is a StreamHasher that is fed every write and completed on success.
+    timeout replaces the session timeout of the segment requests.
+    A segment whose connection stalls is reconnected from its current offset
+    up to stall_reconnects times, after that StalledConnectionError is raised.
+    Returns the number of bytes in the file.
+    Raises RangeNotSupportedError if the server does not honor the Range header.
+    """
+    segments = state['segments']
+    total_size = state['total_size']
+    committed = sum(segment[2] for segment in segments)
+    pending = [index for index, segment in enumerate(segments) if segment[1] is None or segment[0] + segment[2] <= segment[1]]
+    
+    if len(segments) > 1:
+        logger.info(f"[{download_id}] Starting segmented download of {total_size / (1024 * 1024):.2f} MB file over {len(pending)} connections")
+    else:
+        logger.info(f"Starting download of {total_size / (1024 * 1024):.2f} MB file")
+    logger.info(f"[{download_id}] Beginning data transfer for {os.path.basename(state['path'])}")
+    
+    progress = DownloadProgress(download_id, total_size, committed)
+    last_saved = time.time()
+    
+    # Bytes only count as committed once the writer thread wrote them
+    def on_written(index, nbytes):
+        segments[index][2] += nbytes
+    
+    # Disk writes happen in a writer thread so slow storage doesn't stall the event loop
+    writer = ThreadedFileWriter(part_path, on_written, hasher)
+    try:
+        if total_size > 0 and not state.get('preallocated'):
+            await writer.preallocate(total_size)
+            state['preallocated'] = True
+        
+        async def commit_state():
+            # Make sure the bytes we claim are committed are actually on disk
+            try:
+                await writer.sync()
+            finally:
+                snapshot = copy.deepcopy(state)
+                await asyncio.get_running_loop().run_in_executor(disk_executor, save_download_state, part_path, snapshot)
+        
+        # Host the bytes are counted against in the metrics
+        host = urlparse(url).hostname
+        
+        async def fetch_segment(index, segment):
+            reconnects = 0
+            while True:
+                try:
+                    return await fetch_segment_once(index, segment)
+                except StalledConnectionError as e:
+                    if reconnects >= stall_reconnects:
+                        raise
+                    reconnects += 1
+                    delay = min(STALL_RECONNECT_DELAY * 2 ** (reconnects - 1), MAX_RETRY_DELAY)
+                    logger.warning(f"[{download_id}] Segment {segment[0]}-{segment[1]} stalled ({e}), reconnecting in {delay:.0f}s ({reconnects}/{stall_reconnects})")
+                    record_retry(download_id, e, delay, reconnect=True)
+                    # Commit what the writer still buffers, the reconnect continues after it
+                    await writer.flush()
+                    await asyncio.sleep(delay)
+        
+        async def fetch_segment_once(index, segment):
+            nonlocal last_saved, first_response
+            start, end, _ = segment
+            offset = start + segment[2]
+            headers = {}
+            use_range = len(segments) > 1 or offset > 0
+            if use_range:
+                headers['Range'] = f"bytes={offset}-{'' if end is None else end}"
+                # Only continue if the remote file is still the one we started with
+                # (If-Range needs a strong validator, so weak ETags are skipped)
+                etag = state.get('etag')
+                validator = etag if etag and not etag.startswith('W/') else state.get('last_modified')
+                if validator:
+                    headers['If-Range'] = validator
+            
+            if index == 0 and offset == 0 and first_response is not None:
+                # The probing request already returned the start of the file
+                response = first_response
+                first_response = None
+            else:
+                requested = time.monotonic()
+                response = await session.get(url, headers=headers, allow_redirects=True, timeout=timeout or session.timeout)
+                TIME_TO_FIRST_BYTE.observe(time.monotonic() - requested, host=host)
+                if use_range and response.status == 200:
+                    response.release()
+                    raise RangeNotSupportedError(f"Server ignored Range request for bytes {offset}-{end}")
+                if response.status != (206 if use_range else 200):
+                    response.release()
+                    raise Exception(f"HTTP error {response.status}: {response.reason}")
+            
+            chunk_size = AdaptiveChunkSize(CHUNK_SIZE)
+            stall = StallDetector(DOWNLOAD_MIN_SPEED, DOWNLOAD_STALL_TIMEOUT) if DOWNLOAD_STALL_TIMEOUT > 0 else None
+            async with response:
+                chunk_started = time.monotonic()
+                while True:
+                    size = chunk_size.size
+                    if end is not None:
+                        # Never read past the end of this segment
+                        size = min(size, end + 1 - offset)
+                    try:
+                        pieces = await read_chunk(response.content, size, stall)
+                    except StalledConnectionError:
+                        # Drop the connection instead of returning it to the pool
+                        response.close()
+                        raise
+                    if not pieces:
+                        break
+                    nbytes = 0
+                    for piece in pieces:
+                        # Waits here when the disk can't keep up with the network
+                        await writer.write(index, offset, piece)
+                        offset += len(piece)
+                        nbytes += len(piece)
+                    DOWNLOADED_BYTES.inc(nbytes, host=host)
+                    await progress.add(nbytes)
+                    
+                    # Wait here while the download is over its speed limit
+                    await bandwidth_limiter.consume(download_id, nbytes)
+                    
+                    # Periodically record how far we got so a restart can resume
+                    if time.time() - last_saved >= STATE_SAVE_INTERVAL:
+                        last_saved = time.time()
+                        await commit_state()
+                    
+                    # Size the next chunk by how fast this one arrived and was handled
+                    now = time.monotonic()
+                    chunk_size.update(nbytes, now - chunk_started)
+                    chunk_started = now
+                    
+                    if end is not None and offset > end:
+                        break
+                
+                if end is not None and offset != end + 1:
+                    raise IncompleteSegmentError(f"Segment {start}-{end} ended early at byte {offset}")
+        
+        tasks = [asyncio.ensure_future(fetch_segment(index, segments[index])) for index in pending]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One segment failed, stop the others before reporting the error
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await commit_state()
+        
+        # Hash whatever arrived ahead of the first segment
+        await writer.finish_hash(total_size)
+    finally:
+        await writer.close()
+    
+    return progress.downloaded
+
+def find_interrupted_downloads():
+    """
+    Find .part files with a resume state in all known model folders.
+    Returns a list of state records with the current size of the .part file.
+    """
+    interrupted = []
+    seen = set()
+    for folder in list(getattr(folder_paths, 'folder_names_and_paths', {}).keys()):
+        try:
+            paths = folder_paths.get_folder_paths(folder)
+        except Exception:
+            continue
+        for folder_path in paths:
+            real_path = os.path.realpath(folder_path)
+            if real_path in seen or not os.path.isdir(folder_path):
+                continue
+            seen.add(real_path)
+            for root, _, files in os.walk(folder_path):
+                for name in files:
+                    if not name.endswith(PART_SUFFIX + '.json'):
+                        continue
+                    part_path = os.path.join(root, name[:-len('.json')])
+                    state = load_download_state(part_path)
+                    if not state or not os.path.exists(part_path):
+                        continue
+                    state['folder'] = state.get('folder') or folder
+                    state['part_path'] = part_path
+                    state['downloaded'] = sum(segment[2] for segment in state['segments'])
+                    interrupted.append(state)
+    return interrupted
+
+def report_interrupted_downloads():
+    """Log the downloads the last shutdown interrupted, they can be resumed through the API"""
+    try:
+        interrupted = find_interrupted_downloads()
+    except Exception as e:
+        logger.error(f"Error looking for interrupted downloads: {e}")
+        return
+    for state in interrupted:
+        total = state.get('total_size', 0)
+        progress = f"{state['downloaded'] / (1024 * 1024):.2f} MB of {total / (1024 * 1024):.2f} MB" if total else f"{state['downloaded'] / (1024 * 1024):.2f} MB"
+        logger.info(f"Found interrupted download {state.get('path', state['part_path'][:-len(PART_SUFFIX)])} ({progress})")
+    if interrupted:
+        logger.info(f"{len(interrupted)} interrupted download(s) can be resumed with POST /api/downloads/resume")
+
+# Walking the model folders shouldn't delay ComfyUI's startup
+threading.Thread(target=report_interrupted_downloads, name='model_downloader_interrupted', daemon=True).start()
+
+def broadcast_progress(message):
+    """
+    Send a batch of download deltas to every client subscribed to progress updates
+    """
+    sockets = getattr(PromptServer.instance, 'sockets', None) or {}
+    
+    # Drop preferences of clients that disconnected
+    for client_id in list(progress_subscriptions):
+        if client_id not in sockets:
+            del progress_subscriptions[client_id]
+    
+    recipients = [client_id for client_id in sockets if progress_subscriptions.get(client_id, PROGRESS_DEFAULT_SUBSCRIBED)]
+    
+    # The send_sync method is synchronous despite its name, so don't use await
+    if sockets and len(recipients) == len(sockets):
+        PromptServer.instance.send_sync(PROGRESS_MESSAGE, message)
+    else:
+        for client_id in recipients:
+            PromptServer.instance.send_sync(PROGRESS_MESSAGE, message, client_id)
+
+# Batches progress of all downloads into one websocket message per second
+progress_broadcaster = ProgressBroadcaster(download_store.get, broadcast_progress, PROGRESS_INTERVAL)
+
 async def send_download_update(download_id):
     """
-    Send a WebSocket update to all clients about the status of a download
+    Queue a WebSocket update about the status of a download.
+    Updates are coalesced and sent as deltas by the progress broadcaster,
+    status changes are sent right away and recorded in the download history.
     """
     if download_id in active_downloads:
         download = active_downloads[download_id]
+        status_changed = progress_broadcaster.status_changed(download_id, download['status'])
         
         # Log important status changes
-        if download['status'] == 'completed':
-            logger.info(f"Download complete: {download.get('filename', '')}")
-        elif download['status'] == 'error':
-            logger.info(f"Download error: {download.get('error', '')}")
+        if status_changed:
+            if download['status'] == 'completed':
+                logger.info(f"Download complete: {download.get('filename', '')}")
+            elif download['status'] == 'error':
+                logger.info(f"Download error: {download.get('error', '')}")
         
-        # Send WebSocket message with all info including speed and ETA
-        try:
-            # The send_sync method is synchronous despite its name, so don't use await
-            PromptServer.instance.send_sync("model_download_progress", {
-                "download_id": download_id,
-                "status": download['status'],
-                "percent": download.get('percent', 0),
-                "downloaded": download.get('downloaded', 0),
-                "total_size": download.get('total_size', 0),
-                "speed": download.get('speed', 0),
-                "eta": download.get('eta', 0), 
-                "error": download.get('error')
-            })
-        except Exception as e:
-            logger.error(f"WebSocket error: {e}")
+        if download['status'] in FINISHED_STATUSES:
+            download_store.finish(download_id)
+            bandwidth_limiter.forget(download_id)
+            DOWNLOADS.inc(status=download['status'])
+            if download['status'] == 'completed' and download.get('throughput'):
+                THROUGHPUT.observe(download['throughput'])
+        elif status_changed:
+            download_store.save(download_id)
+        
+        progress_broadcaster.mark(download_id, urgent=status_changed)
+
+async def subscribe_progress(request):
+    """
+    Opt a websocket client in or out of download progress messages.
+    Accepts a JSON body with the ComfyUI "client_id" and "enabled".
+    """
+    try:
+        data = await request.json()
+        client_id = data.get('client_id')
+        if not client_id:
+            return web.json_response({"success": False, "error": "Missing required parameters"})
+        
+        progress_subscriptions[client_id] = bool(data.get('enabled', True))
+        logger.info(f"Client {client_id} {'subscribed to' if progress_subscriptions[client_id] else 'unsubscribed from'} download progress")
+        return web.json_response({
+            "success": True,
+            "client_id": client_id,
+            "enabled": progress_subscriptions[client_id]
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+def describe_download(record):
+    """Return a copy of a download record, with its queue position while it is queued"""
+    download = dict(record)
+    if download.get('status') == 'queued':
+        download['queue_position'] = download_scheduler.position(download['download_id'])
+    return download
 
 async def get_download_progress(request):
     """
@@ -356,10 +1560,12 @@ async def get_download_progress(request):
     try:
         download_id = request.match_info.get('download_id')
         
-        if download_id in active_downloads:
+        # Finished downloads are looked up in the history
+        record = await download_store.lookup(download_id)
+        if record is not None:
             return web.json_response({
                 "success": True,
-                "download": active_downloads[download_id]
+                "download": describe_download(record)
             })
         else:
             return web.json_response({
@@ -374,12 +1580,472 @@ async def get_download_progress(request):
 
 async def list_downloads(request):
     """
-    List all active downloads
+    List downloads from the download history, newest first, as "downloads"
+    keyed by download ID like before the history existed.
+    Query parameters filter the list: status (comma separated), folder, host,
+    q (part of the filename or URL), since and until (Unix timestamps of when
+    the download was queued), order (asc or desc), limit and offset.
+    """
+    try:
+        query = request.query
+        try:
+            limit = min(max(int(query.get('limit', DOWNLOADS_PAGE_SIZE)), 1), DOWNLOADS_MAX_PAGE_SIZE)
+            offset = max(int(query.get('offset', 0)), 0)
+            since = float(query['since']) if query.get('since') else None
+            until = float(query['until']) if query.get('until') else None
+        except ValueError as e:
+            return web.json_response({"success": False, "error": f"Invalid query parameter: {e}"})
+        statuses = [status for status in query.get('status', '').split(',') if status]
+        
+        total, records = await download_store.query(
+            statuses=statuses,
+            folder=query.get('folder'),
+            host=query.get('host'),
+            search=query.get('q'),
+            since=since,
+            until=until,
+            limit=limit,
+            offset=offset,
+            ascending=query.get('order') == 'asc'
+        )
+        return web.json_response({
+            "success": True,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            # Keys keep the order of the page
+            "downloads": {record['download_id']: describe_download(record) for record in records}
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+def format_stream_event(event, data, ndjson):
+    """Encode one progress stream event as Server-Sent Events or as a line of NDJSON"""
+    if ndjson:
+        return (json.dumps(dict(data, event=event)) + '\n').encode()
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+async def stream_download_progress(request):
+    """
+    Stream download progress as Server-Sent Events, or as newline delimited
+    JSON with ?format=ndjson (or an Accept: application/x-ndjson header).
+    
+    The stream starts with a "snapshot" event holding the full records, then
+    sends "progress" events with the same batched deltas as the websocket
+    message. ?download_id= (comma separated) limits the stream to some
+    downloads, it then ends once all of them finished.
+    """
+    download_ids = {download_id for download_id in request.query.get('download_id', '').split(',') if download_id} or None
+    ndjson = request.query.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson' if ndjson else 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        # Keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    
+    # Subscribe before taking the snapshot so no change falls in between
+    stream = progress_broadcaster.open_stream(download_ids)
+    try:
+        finished = set()
+        
+        async def send_snapshot():
+            if download_ids is None:
+                records = list(active_downloads.values())
+            else:
+                records = []
+                for download_id in download_ids:
+                    record = await download_store.lookup(download_id)
+                    if record is None:
+                        # Unknown downloads will never finish, don't wait for them
+                        finished.add(download_id)
+                    else:
+                        records.append(record)
+            for record in records:
+                if record.get('status') not in PENDING_STATUSES:
+                    finished.add(record['download_id'])
+            await response.write(format_stream_event('snapshot', {
+                "downloads": {record['download_id']: describe_download(record) for record in records}
+            }, ndjson))
+        
+        await send_snapshot()
+        while download_ids is None or not download_ids <= finished:
+            try:
+                message = await asyncio.wait_for(stream.get(), STREAM_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b'{"event": "keepalive"}\n' if ndjson else b': keepalive\n\n')
+                continue
+            
+            if message is None:
+                # The client fell behind and missed deltas
+                await send_snapshot()
+                continue
+            
+            for download_id, delta in message['downloads'].items():
+                if delta.get('status') in FINISHED_STATUSES:
+                    finished.add(download_id)
+            await response.write(format_stream_event('progress', message, ndjson))
+    except (ConnectionResetError, ConnectionError):
+        # The client went away
+        pass
+    finally:
+        progress_broadcaster.close_stream(stream)
+    
+    return response
+
+async def list_interrupted_downloads(request):
+    """
+    List interrupted downloads that left a resumable .part file behind
+    """
+    try:
+        interrupted = find_interrupted_downloads()
+        
+        # Don't offer downloads that are currently running
+        running = {download['path'] for download in active_downloads.values() if download.get('status') in PENDING_STATUSES}
+        interrupted = [state for state in interrupted if state.get('path') not in running]
+        
+        return web.json_response({
+            "success": True,
+            "downloads": [{
+                "url": state.get('url'),
+                "folder": state.get('folder'),
+                "filename": state.get('filename') or os.path.basename(state.get('path', '')),
+                "path": state.get('path'),
+                "downloaded": state.get('downloaded', 0),
+                "total_size": state.get('total_size', 0),
+                "updated": state.get('updated')
+            } for state in interrupted]
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+async def resume_downloads(request):
+    """
+    Resume interrupted downloads.
+    Accepts a JSON body with either a "path" of the final file to resume or "all": true.
     """
     try:
+        data = {}
+        if request.can_read_body:
+            data = await request.json()
+        path = data.get('path')
+        resume_all = data.get('all', False)
+        
+        if not path and not resume_all:
+            return web.json_response({"success": False, "error": "Missing required parameters"})
+        
+        running = {download['path'] for download in active_downloads.values() if download.get('status') in PENDING_STATUSES}
+        resumed = []
+        for state in find_interrupted_downloads():
+            if state.get('path') in running:
+                continue
+            if resume_all or state.get('path') == path:
+                filename = state.get('filename') or os.path.basename(state['path'])
+                download_id = start_download_task(state['url'], state.get('folder'), filename, state['path'], mirrors=state.get('mirrors'), extract=state.get('extract'))
+                logger.info(f"Resuming interrupted download {download_id} to {state['path']}")
+                resumed.append(download_id)
+        
+        if path and not resumed:
+            return web.json_response({"success": False, "error": "Interrupted download not found"})
+        
+        return web.json_response({
+            "success": True,
+            "download_ids": resumed
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+async def control_download(request):
+    """
+    Cancel, pause or resume a download, or change its queue priority or speed limit.
+    The action comes from the URL, priority changes take a JSON body with "priority"
+    and limit changes one with "max_speed" in MB/s (0 or null removes the limit).
+    """
+    try:
+        download_id = request.match_info.get('download_id')
+        action = request.match_info.get('action')
+        
+        record = download_store.get(download_id)
+        if record is None:
+            return web.json_response({"success": False, "error": "Download not found"})
+        
+        if action == 'cancel':
+            stopped = record['status'] != 'downloading'
+            done = download_scheduler.cancel(download_id)
+            if done and stopped:
+                # No task is left to clean up after a paused or queued download
+                discard_partial_download(record['path'] + PART_SUFFIX)
+        elif action == 'pause':
+            done = download_scheduler.pause(download_id)
+        elif action == 'resume':
+            done = download_scheduler.resume(download_id)
+        elif action == 'priority':
+            data = await request.json()
+            try:
+                priority = int(data.get('priority'))
+            except (TypeError, ValueError):
+                return web.json_response({"success": False, "error": f"Invalid priority value: {data.get('priority')}"})
+            done = download_scheduler.reprioritize(download_id, priority)
+            if done:
+                record['priority'] = priority
+        elif action == 'limit':
+            data = await request.json()
+            try:
+                max_speed = from_mbps(data.get('max_speed') or 0)
+            except (TypeError, ValueError):
+                return web.json_response({"success": False, "error": f"Invalid max_speed value: {data.get('max_speed')}"})
+            done = record['status'] in PENDING_STATUSES
+            if done:
+                bandwidth_limiter.set_download_limit(download_id, max_speed)
+                record['max_speed'] = to_mbps(max_speed) if max_speed else None
+        else:
+            return web.json_response({"success": False, "error": f"Unknown action: {action}"})
+        
+        if not done:
+            status = record['status']
+            return web.json_response({"success": False, "error": f"Cannot {action} a download that is {status}"})
+        
+        logger.info(f"Download {download_id}: {action} requested")
+        return web.json_response({
+            "success": True,
+            "download": describe_download(record)
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+async def get_download_queue(request):
+    """
+    Describe the download queue: limits, running, queued and paused downloads
+    """
+    try:
+        return web.json_response({
+            "success": True,
+            "queue": download_scheduler.snapshot()
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+def get_model_folder_paths(folder):
+    """Paths of a model folder, or an empty list if ComfyUI doesn't know the folder"""
+    try:
+        return folder_paths.get_folder_paths(folder) or []
+    except KeyError:
+        return []
+
+async def get_remote_size(session, url):
+    """Size of a remote file from a HEAD request, or None if it can't be found out"""
+    try:
+        async with session.head(url, allow_redirects=True) as response:
+            if response.status == 200:
+                return get_remote_info(response)['total_size'] or None
+    except Exception as e:
+        logger.warning(f"HEAD request for {url} failed: {e}")
+    return None
+
+async def resolve_workflow_models(request):
+    """
+    Resolve the models referenced by a workflow and download the missing ones.
+    Accepts a JSON body with the "workflow" (frontend or API prompt format),
+    optional "download" (default true, false only reports) and "priority".
+    
+    Each model is reported with a status: present, size_mismatch (the local
+    file differs in size from the remote one), missing, unresolved (missing
+    and the workflow has no URL for it), invalid, or the status of a download
+    already writing it. Missing and mismatching models with a URL are queued.
+    """
+    try:
+        data = await request.json()
+        workflow = data.get('workflow')
+        if not isinstance(workflow, dict):
+            return web.json_response({"success": False, "error": "Missing required parameters"})
+        download = bool(data.get('download', True))
+        try:
+            priority = int(data.get('priority', 0))
+        except (TypeError, ValueError):
+            return web.json_response({"success": False, "error": f"Invalid priority value: {data.get('priority')}"})
+        
+        models = []
+        for reference in find_workflow_models(workflow):
+            model = dict(reference)
+            name = safe_model_name(model['name'])
+            url = model['url']
+            folder = model['folder']
+            if name is None or not folder or (url and not url.startswith(('http://', 'https://'))):
+                model['status'] = 'invalid'
+                models.append(model)
+                continue
+            model['name'] = name
+            
+            paths = get_model_folder_paths(folder)
+            if not paths:
+                model['status'] = 'invalid'
+                model['error'] = f"Invalid folder: {folder}"
+                models.append(model)
+                continue
+            
+            local_path = get_model_full_path(folder, name)
+            model['path'] = local_path or os.path.join(paths[0], name)
+            if local_path:
+                model['local_size'] = os.path.getsize(local_path)
+                model['status'] = 'present'
+            else:
+                model['status'] = 'missing' if url else 'unresolved'
+            
+            pending_id = find_pending_download(model['path'])
+            if pending_id:
+                model['status'] = active_downloads[pending_id]['status']
+                model['download_id'] = pending_id
+            models.append(model)
+        
+        # Compare present files that have a URL with the remote size, all at once
+        session = get_session()
+        to_check = [model for model in models if model['status'] == 'present' and model['url']]
+        sizes = await asyncio.gather(*[get_remote_size(session, model['url']) for model in to_check])
+        for model, remote_size in zip(to_check, sizes):
+            model['remote_size'] = remote_size
+            if remote_size is not None and remote_size != model['local_size']:
+                model['status'] = 'size_mismatch'
+        
+        queued = []
+        if download:
+            for model in models:
+                if model['status'] not in ('missing', 'size_mismatch'):
+                    continue
+                # Two references may resolve to the same file
+                pending_id = find_pending_download(model['path'])
+                if pending_id:
+                    model['download_id'] = pending_id
+                    continue
+                # A file with the wrong size is replaced by the download, not kept next to it
+                download_id = start_download_task(
+                    model['url'], model['folder'], model['name'], model['path'],
+                    priority=priority, sha256=model['sha256'], replace=model['status'] == 'size_mismatch'
+                )
+                model['download_id'] = download_id
+                queued.append(download_id)
+        
+        missing = [model for model in models if model['status'] in ('missing', 'size_mismatch', 'unresolved')]
+        logger.info(f"Workflow references {len(models)} models, {len(missing)} missing, {len(queued)} downloads queued")
+        return web.json_response({
+            "success": True,
+            "models": models,
+            "missing": len(missing),
+            "download_ids": queued
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+def is_persistent_model(path):
+    """Whether path, with symlinks resolved, is inside the persistent models directory"""
+    models_dir = os.path.realpath(os.path.join(PERSISTENT_DIR, 'models'))
+    return os.path.commonpath([os.path.realpath(path), models_dir]) == models_dir
+
+async def serve_peer_model(request):
+    """
+    Serve a model file to a peer, with Range support and zero-copy sendfile.
+    Only enabled with COMFY_PEER_SERVE=1, for the folders in PEER_SERVE_FOLDERS
+    and files inside the persistent models directory. Partial downloads are
+    never served. The SHA-256 is sent in a header when the file was downloaded
+    here and is unchanged since.
+    """
+    if not PEER_SERVE:
+        raise web.HTTPNotFound()
+    
+    folder = request.match_info.get('folder')
+    name = safe_model_name(request.match_info.get('filename'))
+    path = None
+    if name and folder in PEER_SERVE_FOLDERS and not name.endswith((PART_SUFFIX, PART_SUFFIX + '.json')) \
+            and get_model_folder_paths(folder):
+        path = get_model_full_path(folder, name)
+    if not path or not os.path.isfile(path) or not is_persistent_model(path) or find_pending_download(path):
+        raise web.HTTPNotFound()
+    
+    headers = {}
+    record = await download_store.find_completed(path)
+    if record and record.get('sha256') and record.get('total_size') == os.path.getsize(path):
+        headers[PEER_SHA256_HEADER] = record['sha256']
+    
+    logger.info(f"Serving {folder}/{name} to peer {request.remote}")
+    return web.FileResponse(path, headers=headers)
+
+def count_pending_downloads():
+    """Number of queued, running and paused downloads, for the metrics"""
+    counts = {(status,): 0 for status in PENDING_STATUSES}
+    for download in list(active_downloads.values()):
+        if download.get('status') in PENDING_STATUSES:
+            counts[(download['status'],)] += 1
+    return counts
+
+download_metrics.registry.register(download_metrics.Gauge(
+    'model_downloader_downloads', 'Downloads in the queue, by status', count_pending_downloads, ['status']))
+download_metrics.registry.register(download_metrics.Gauge(
+    'model_downloader_bandwidth_throttled', 'Whether the inference speed limit applies right now',
+    lambda: int(bandwidth_limiter.throttled())))
+
+async def get_metrics(request):
+    """
+    Download metrics in the Prometheus text format
+    """
+    return web.Response(body=download_metrics.registry.render().encode(), headers={'Content-Type': download_metrics.CONTENT_TYPE})
+
+async def get_download_bandwidth(request):
+    """
+    Describe the download speed limits in MB/s and whether the inference limit applies right now
+    """
+    try:
+        return web.json_response({
+            "success": True,
+            "bandwidth": bandwidth_limiter.snapshot()
+        })
+    except Exception as e:
+        return web.json_response({
+            "success": False,
+            "error": str(e)
+        })
+
+async def set_download_bandwidth(request):
+    """
+    Change the download speed limits.
+    Accepts a JSON body with "max_speed", the limit of all downloads together, and
+    "inference_max_speed", the limit while a prompt is executing (null disables it).
+    Both are in MB/s, 0 means unlimited and missing fields are left unchanged.
+    """
+    try:
+        data = await request.json()
+        try:
+            limit = from_mbps(data['max_speed']) if data.get('max_speed') is not None else None
+            inference_limit = from_mbps(data['inference_max_speed']) if data.get('inference_max_speed') is not None else None
+        except (TypeError, ValueError) as e:
+            return web.json_response({"success": False, "error": f"Invalid speed limit: {e}"})
+        
+        clear_inference_limit = 'inference_max_speed' in data and data['inference_max_speed'] is None
+        bandwidth_limiter.set_limits(limit, inference_limit, clear_inference_limit)
+        
+        bandwidth = bandwidth_limiter.snapshot()
+        logger.info(f"Download speed limits changed: {bandwidth['max_speed']} MB/s, {bandwidth['inference_max_speed']} MB/s while a prompt is executing")
         return web.json_response({
             "success": True,
-            "downloads": active_downloads
+            "bandwidth": bandwidth
         })
     except Exception as e:
         return web.json_response({
@@ -0,0 +1,60 @@
+"""
+LAN peer cache for the model downloader
+Asks other ComfyUI hosts on the network whether they already have a model,
+so it can be copied over the LAN instead of downloaded from the internet.
+"""
+
+import asyncio
+import logging
+from urllib.parse import quote
+
+from aiohttp import ClientTimeout
+
+logger = logging.getLogger('model_downloader')
+
+# Route under which a node serves its model folders to peers
+PEER_MODELS_ROUTE = '/api/peer/models'
+
+# Header carrying the SHA-256 of a served model, when the serving node knows it
+PEER_SHA256_HEADER = 'X-Model-Sha256'
+
+# Peers are on the LAN, one that doesn't answer quickly is skipped
+PEER_TIMEOUT = ClientTimeout(total=3)
+
+def peer_file_url(peer, folder, name):
+    """URL of a model file on a peer, peer being the base URL of its ComfyUI server"""
+    return f"{peer.rstrip('/')}{PEER_MODELS_ROUTE}/{quote(folder)}/{quote(name)}"
+
+async def query_peer(session, url):
+    """Return {"url", "size", "sha256"} if the peer has the file, otherwise None"""
+    try:
+        async with session.head(url, timeout=PEER_TIMEOUT) as response:
+            if response.status != 200:
+                return None
+            sha256 = response.headers.get(PEER_SHA256_HEADER)
+            return {
+                'url': url,
+                'size': int(response.headers.get('content-length') or 0),
+                'sha256': sha256.lower() if sha256 else None
+            }
+    except Exception as e:
+        logger.debug(f"Peer {url} did not answer: {e}")
+        return None
+
+async def find_peer_copies(session, peers, folder, name):
+    """Ask all peers at once, returns the copies found in the order the peers were given"""
+    copies = await asyncio.gather(*[query_peer(session, peer_file_url(peer, folder, name)) for peer in peers])
+    return [copy for copy in copies if copy is not None]
+
+def matching_copy(copies, size=None, sha256=None):
+    """
+    Pick the first copy that is the wanted file: same SHA-256 when both sides
+    know it, otherwise the same size. Returns None if no copy can be trusted.
+    """
+    for copy in copies:
+        if sha256 and copy['sha256']:
+            if copy['sha256'] == sha256:
+                return copy
+        elif size and copy['size'] == size:
+            return copy
+    return None
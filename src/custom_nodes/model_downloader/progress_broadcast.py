@@ -0,0 +1,141 @@
+"""
+Coalesced progress broadcasting for the model downloader
+Collects download changes and sends them to websocket clients and progress
+streams as one batched message per interval, carrying only the fields that
+changed since the last one.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('model_downloader')
+
+# Fields of a download record that clients are told about
+PROGRESS_FIELDS = ('status', 'percent', 'downloaded', 'total_size', 'speed', 'eta', 'error', 'folder', 'filename')
+
+# Delay used to coalesce status changes that should go out right away
+URGENT_DELAY = 0.05
+
+# Messages a progress stream may fall behind before it is resynchronized
+STREAM_MAX_PENDING = 64
+
+class ProgressStream:
+    """
+    Progress messages for one streaming HTTP client, optionally limited to
+    some downloads. A client that falls STREAM_MAX_PENDING messages behind
+    loses them and gets None instead, telling it to send a fresh snapshot.
+    """
+    def __init__(self, download_ids=None, max_pending=STREAM_MAX_PENDING):
+        self.download_ids = download_ids
+        self.queue = asyncio.Queue(max_pending)
+
+    def push(self, message):
+        deltas = message['downloads']
+        if self.download_ids is not None:
+            deltas = {download_id: delta for download_id, delta in deltas.items() if download_id in self.download_ids}
+            if not deltas:
+                return
+        try:
+            self.queue.put_nowait({"seq": message['seq'], "downloads": deltas})
+        except asyncio.QueueFull:
+            # Deltas only make sense in order, drop them all and resync instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """Next message, or None when the client has to be sent a new snapshot"""
+        return await self.queue.get()
+
+class ProgressBroadcaster:
+    """
+    Batches download updates into one message per tick.
+
+    mark(download_id) flags a download as changed. At most once per interval
+    the broadcaster builds a delta for every flagged download, holding only the
+    PROGRESS_FIELDS whose value differs from what was last sent, and passes all
+    deltas to send(deltas) at once. Status changes are marked urgent and go out
+    after URGENT_DELAY instead of waiting for the rest of the interval.
+
+    get_record(download_id) returns the current record, or None once it is gone.
+    Streams opened with open_stream() receive the same messages.
+    """
+    def __init__(self, get_record, send, interval=1.0):
+        self.get_record = get_record
+        self.send = send
+        self.interval = interval
+        self.dirty = set()
+        self.last_sent = {}
+        self.last_tick = 0
+        self.handle = None
+        self.sequence = 0
+        self.streams = set()
+
+    def mark(self, download_id, urgent=False):
+        """Flag a download as changed, it is included in the next tick"""
+        self.dirty.add(download_id)
+
+        loop = asyncio.get_running_loop()
+        if urgent:
+            delay = URGENT_DELAY
+        else:
+            delay = max(0.0, self.interval - (time.time() - self.last_tick))
+
+        # Keep an already scheduled tick unless this change needs an earlier one
+        if self.handle is not None:
+            if self.handle.when() <= loop.time() + delay:
+                return
+            self.handle.cancel()
+        self.handle = loop.call_later(delay, self.tick)
+
+    def open_stream(self, download_ids=None):
+        """Start a ProgressStream, for all downloads or a set of download IDs"""
+        stream = ProgressStream(download_ids)
+        self.streams.add(stream)
+        return stream
+
+    def close_stream(self, stream):
+        self.streams.discard(stream)
+
+    def status_changed(self, download_id, status):
+        """Whether status differs from the status clients were last told about"""
+        return self.last_sent.get(download_id, {}).get('status') != status
+
+    def tick(self):
+        """Send one batched message with the deltas of every changed download"""
+        self.handle = None
+        self.last_tick = time.time()
+
+        deltas = {}
+        for download_id in self.dirty:
+            record = self.get_record(download_id)
+            if record is None:
+                continue
+            snapshot = {field: record.get(field) for field in PROGRESS_FIELDS}
+            previous = self.last_sent.get(download_id)
+            if previous is None:
+                delta = snapshot
+            else:
+                delta = {field: value for field, value in snapshot.items() if previous.get(field) != value}
+            if delta:
+                deltas[download_id] = delta
+                self.last_sent[download_id] = snapshot
+        self.dirty.clear()
+
+        # Forget downloads whose records are gone
+        for download_id in list(self.last_sent):
+            if self.get_record(download_id) is None:
+                del self.last_sent[download_id]
+
+        if not deltas:
+            return
+
+        self.sequence += 1
+        message = {"seq": self.sequence, "downloads": deltas}
+        try:
+            self.send(message)
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}")
+        for stream in list(self.streams):
+            stream.push(message)
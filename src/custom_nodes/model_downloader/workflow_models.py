@@ -0,0 +1,124 @@
+"""
+Workflow model references for the model downloader
+Finds the models a ComfyUI workflow needs, from the model lists the frontend
+embeds in workflows and from the file inputs of the built-in loader nodes.
+"""
+
+import logging
+import os
+import re
+
+logger = logging.getLogger('model_downloader')
+
+# File inputs of the built-in loader nodes as (input name, widget index, model folder)
+LOADER_INPUTS = {
+    'CheckpointLoaderSimple': [('ckpt_name', 0, 'checkpoints')],
+    'CheckpointLoader': [('config_name', 0, 'configs'), ('ckpt_name', 1, 'checkpoints')],
+    'unCLIPCheckpointLoader': [('ckpt_name', 0, 'checkpoints')],
+    'ImageOnlyCheckpointLoader': [('ckpt_name', 0, 'checkpoints')],
+    'VAELoader': [('vae_name', 0, 'vae')],
+    'LoraLoader': [('lora_name', 0, 'loras')],
+    'LoraLoaderModelOnly': [('lora_name', 0, 'loras')],
+    'ControlNetLoader': [('control_net_name', 0, 'controlnet')],
+    'DiffControlNetLoader': [('control_net_name', 0, 'controlnet')],
+    'UNETLoader': [('unet_name', 0, 'diffusion_models')],
+    'CLIPLoader': [('clip_name', 0, 'text_encoders')],
+    'DualCLIPLoader': [('clip_name1', 0, 'text_encoders'), ('clip_name2', 1, 'text_encoders')],
+    'TripleCLIPLoader': [('clip_name1', 0, 'text_encoders'), ('clip_name2', 1, 'text_encoders'), ('clip_name3', 2, 'text_encoders')],
+    'CLIPVisionLoader': [('clip_name', 0, 'clip_vision')],
+    'StyleModelLoader': [('style_model_name', 0, 'style_models')],
+    'GLIGENLoader': [('gligen_name', 0, 'gligen')],
+    'UpscaleModelLoader': [('model_name', 0, 'upscale_models')],
+    'HypernetworkLoader': [('hypernetwork_name', 0, 'hypernetworks')],
+    'PhotoMakerLoader': [('photomaker_model_name', 0, 'photomaker')],
+}
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def safe_model_name(name):
+    """
+    Normalize a model filename relative to its folder, subfolders are allowed.
+    Returns None for names that are empty, absolute or escape the folder.
+    """
+    if not isinstance(name, str) or not name.strip():
+        return None
+    name = os.path.normpath(name.strip().replace('\\', '/'))
+    if os.path.isabs(name) or name == '.' or name.split(os.sep)[0] == '..':
+        return None
+    return name
+
+def iter_nodes(workflow):
+    """Nodes of a frontend workflow, including the nodes of its subgraphs"""
+    for node in workflow.get('nodes') or []:
+        if isinstance(node, dict):
+            yield node
+    for subgraph in (workflow.get('definitions') or {}).get('subgraphs') or []:
+        if isinstance(subgraph, dict):
+            yield from iter_nodes(subgraph)
+
+def add_reference(references, name, folder, url=None, sha256=None, node=None):
+    """Add a model reference, merging it with an earlier one for the same file"""
+    key = (folder, name)
+    reference = references.get(key)
+    if reference is None:
+        # Loader inputs don't carry a URL, an embedded model entry with the same name may
+        if url is None:
+            for other in references.values():
+                if other['name'] == name and other['url']:
+                    reference = other
+                    break
+        if reference is None:
+            reference = references[key] = {'name': name, 'folder': folder, 'url': None, 'sha256': None, 'nodes': []}
+    if url and not reference['url']:
+        reference['url'] = url
+    if sha256 and not reference['sha256']:
+        reference['sha256'] = sha256
+    if node is not None and node not in reference['nodes']:
+        reference['nodes'].append(node)
+
+def add_model_entries(references, models, node=None):
+    """Add the {"name", "url", "directory"} model entries the frontend embeds in workflows"""
+    for model in models or []:
+        if not isinstance(model, dict):
+            continue
+        sha256 = None
+        if str(model.get('hash_type', '')).lower() == 'sha256':
+            sha256 = str(model.get('hash', '')).lower() or None
+            if sha256 and not SHA256_PATTERN.match(sha256):
+                sha256 = None
+        add_reference(references, model.get('name'), model.get('directory'), model.get('url'), sha256, node)
+
+def find_workflow_models(workflow):
+    """
+    Return the models referenced by a workflow as a list of
+    {"name", "folder", "url", "sha256", "nodes"}, one per file.
+
+    Accepts the frontend workflow format, with its top level and per node
+    "models" lists and the widget values of loader nodes, as well as the API
+    prompt format ({node_id: {"class_type", "inputs"}}). Only the embedded
+    model lists carry URLs.
+    """
+    references = {}
+
+    if isinstance(workflow.get('nodes'), list):
+        add_model_entries(references, workflow.get('models'))
+        for node in iter_nodes(workflow):
+            node_id = node.get('id')
+            add_model_entries(references, (node.get('properties') or {}).get('models'), node_id)
+            widgets = node.get('widgets_values')
+            if not isinstance(widgets, list):
+                continue
+            for _, index, folder in LOADER_INPUTS.get(node.get('type'), []):
+                if index < len(widgets) and isinstance(widgets[index], str):
+                    add_reference(references, widgets[index], folder, node=node_id)
+    else:
+        # API prompt format
+        for node_id, node in workflow.items():
+            if not isinstance(node, dict):
+                continue
+            inputs = node.get('inputs') or {}
+            for input_name, _, folder in LOADER_INPUTS.get(node.get('class_type'), []):
+                if isinstance(inputs.get(input_name), str):
+                    add_reference(references, inputs[input_name], folder, node=node_id)
+
+    return list(references.values())
@@ -4,6 +4,6 @@ Persistence package for ComfyUI
 This package handles persistence of models, outputs, and other user data
 """
 
-from .persistence import setup_persistence, patch_folder_paths
+from .persistence import setup_persistence, patch_folder_paths, ModelIndex
 
-__all__ = ['setup_persistence', 'patch_folder_paths']
+__all__ = ['setup_persistence', 'patch_folder_paths', 'ModelIndex']
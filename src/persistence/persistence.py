@@ -7,12 +7,30 @@ This script ensures models and other user data persist across runs
 
 import os
 import sys
+import errno
+import time
 import logging
 import shutil
 import json
+import hashlib
 import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import OrderedDict
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ComfyUI's web server library, only needed for the HTTP API
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('persistence')
@@ -38,6 +56,1520 @@ def create_symlink(source, target):
     os.symlink(source, target, target_is_directory=Path(source).is_dir())
     logger.info(f"Created symlink: {source} -> {target}")
 
+# Migration of existing directories into the persistent directory
+# Parallel workers copying files when they can't be moved, cloned or linked
+MIGRATION_WORKERS = max(1, int(os.environ.get('COMFY_MIGRATION_WORKERS', '4')))
+
+# Seconds between progress reports of a migration that copies
+MIGRATION_PROGRESS_INTERVAL = 5.0
+
+# Records the directories being migrated, so an interrupted migration resumes
+MIGRATION_MANIFEST = '.migration.json'
+
+# Files are copied to <file>.migrating and renamed once complete
+MIGRATING_SUFFIX = '.migrating'
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# ioctl cloning a file on btrfs, XFS and other filesystems with reflinks (fcntl.FICLONE from Python 3.12)
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409) if fcntl is not None and sys.platform.startswith('linux') else None
+
+# Errors meaning a way of moving a file is not possible here, so it isn't tried again
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EMLINK}
+
+class MigrationManifest:
+    """
+    Directories whose contents are being migrated and the items of each that
+    are copied file by file. An item listed here may be partly present in the
+    persistent directory, and is completed instead of being taken for an item
+    that was there before.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.migrations = {}
+        try:
+            with open(path, 'r') as f:
+                self.migrations = json.load(f).get('migrations', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not read migration manifest {path}: {e}")
+
+    def prune(self):
+        """Forget migrations whose source directory is gone, they finished before the manifest was updated"""
+        for source in list(self.migrations):
+            if os.path.islink(source) or not os.path.isdir(source):
+                del self.migrations[source]
+        self.save()
+
+    def copying(self, source):
+        return set(self.migrations.get(source, {}).get('copying', []))
+
+    def start(self, source, destination, copying):
+        self.migrations[source] = {'destination': destination, 'copying': sorted(copying), 'started': time.time()}
+        self.save()
+
+    def finish(self, source):
+        if self.migrations.pop(source, None) is not None:
+            self.save()
+
+    def save(self):
+        if not self.migrations:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'migrations': self.migrations}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+class MigrationProgress:
+    """Bytes transferred by the copying workers of a migration"""
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.methods = {'renamed': 0, 'cloned': 0, 'linked': 0, 'copied': 0, 'kept': 0}
+
+    def add(self, nbytes):
+        with self.lock:
+            self.done += nbytes
+
+    def count(self, method):
+        with self.lock:
+            self.methods[method] += 1
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed / (1024 * 1024) if elapsed > 0 else 0
+        percent = self.done * 100 / self.total if self.total else 100
+        logger.info(f"Migrating {self.label}: {self.done / (1024 * 1024):.2f} MB of {self.total / (1024 * 1024):.2f} MB ({percent:.0f}%, {rate:.1f} MB/s)")
+
+class DirectoryMigration:
+    """
+    Moves the contents of a directory into the persistent directory without
+    copying where it can. Items are renamed, which is instant on the same
+    filesystem. Files of items that can't be renamed are cloned (reflink),
+    hardlinked, or as a last resort copied by parallel workers.
+    """
+    def __init__(self, source, destination, manifest):
+        self.source = source
+        self.destination = destination
+        self.manifest = manifest
+        self.can_clone = FICLONE is not None
+        self.can_link = True
+        self.progress = None
+
+    def run(self):
+        """Migrate everything, then remove the source directory"""
+        resumed = self.manifest.copying(self.source)
+        if resumed:
+            logger.info(f"Resuming the migration of {self.source}")
+
+        copying = []
+        for name in sorted(os.listdir(self.source)):
+            src = os.path.join(self.source, name)
+            dst = os.path.join(self.destination, name)
+            if name not in resumed and (os.path.exists(dst) or os.path.islink(dst)):
+                # Already in the persistent directory, that copy is kept
+                logger.info(f"Keeping persistent {dst} over {src}")
+                continue
+            if name not in resumed:
+                try:
+                    os.rename(src, dst)
+                    logger.info(f"Moved {src} -> {dst}")
+                    continue
+                except OSError as e:
+                    logger.info(f"Can't move {src} ({e.strerror}), transferring its files")
+            copying.append(name)
+
+        if copying:
+            # Record the items before anything of them is written
+            self.manifest.start(self.source, self.destination, copying)
+            self.transfer_items(copying)
+
+        shutil.rmtree(self.source)
+        self.manifest.finish(self.source)
+
+    def plan(self, names):
+        """Directories, symlinks and files (with sizes) of the items to transfer"""
+        dirs, links, files = [], [], []
+        for name in names:
+            src = os.path.join(self.source, name)
+            if os.path.islink(src) or not os.path.isdir(src):
+                (links if os.path.islink(src) else files).append((name, os.lstat(src).st_size))
+                continue
+            dirs.append(name)
+            for root, subdirs, filenames in os.walk(src):
+                relative_root = os.path.relpath(root, self.source)
+                for subdir in list(subdirs):
+                    relative = os.path.join(relative_root, subdir)
+                    if os.path.islink(os.path.join(root, subdir)):
+                        links.append((relative, 0))
+                        subdirs.remove(subdir)
+                    else:
+                        dirs.append(relative)
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    entry = (os.path.join(relative_root, filename), os.lstat(path).st_size)
+                    (links if os.path.islink(path) else files).append(entry)
+        return dirs, links, files
+
+    def transfer_items(self, names):
+        dirs, links, files = self.plan(names)
+        self.progress = MigrationProgress(self.source, sum(size for _, size in files))
+        for relative in dirs:
+            os.makedirs(os.path.join(self.destination, relative), exist_ok=True)
+        for relative, _ in links:
+            dst = os.path.join(self.destination, relative)
+            if not os.path.islink(dst):
+                os.symlink(os.readlink(os.path.join(self.source, relative)), dst)
+
+        # Largest files first, so one big file doesn't start last and hold up the end
+        files.sort(key=lambda entry: entry[1], reverse=True)
+        with ThreadPoolExecutor(max_workers=MIGRATION_WORKERS, thread_name_prefix='persistence_migration') as executor:
+            pending = {executor.submit(self.transfer_file, relative, size) for relative, size in files}
+            while pending:
+                done, pending = wait(pending, timeout=MIGRATION_PROGRESS_INTERVAL)
+                failed = next((future for future in done if future.exception() is not None), None)
+                if failed is not None:
+                    # Stop at the first failure, the next start continues with the files still missing
+                    for future in pending:
+                        future.cancel()
+                    failed.result()
+                if pending:
+                    self.progress.report()
+
+        for relative in reversed(dirs):
+            shutil.copystat(os.path.join(self.source, relative), os.path.join(self.destination, relative))
+        methods = ', '.join(f"{count} {method}" for method, count in self.progress.methods.items() if count)
+        logger.info(f"Migrated {len(files)} file(s) of {self.source} ({methods})")
+
+    def transfer_file(self, relative, size):
+        src = os.path.join(self.source, relative)
+        dst = os.path.join(self.destination, relative)
+        if os.path.exists(dst) and os.path.getsize(dst) == size:
+            # Transferred before the migration was interrupted
+            self.progress.add(size)
+            self.progress.count('kept')
+            return
+
+        temp_path = dst + MIGRATING_SUFFIX
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if self.can_clone and self.clone_file(src, temp_path):
+            method = 'cloned'
+        elif self.can_link and self.link_file(src, temp_path):
+            method = 'linked'
+        else:
+            self.copy_file(src, temp_path)
+            method = 'copied'
+        if method != 'copied':
+            self.progress.add(size)
+        os.replace(temp_path, dst)
+        self.progress.count(method)
+
+    def clone_file(self, src, dst):
+        """Reflink src to dst, sharing its blocks. False if the filesystem can't"""
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return True
+        except OSError as e:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            self.can_clone = False
+            return False
+
+    def link_file(self, src, dst):
+        """Hardlink src to dst, the source is removed afterwards. False if that isn't possible"""
+        try:
+            os.link(src, dst)
+            return True
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            self.can_link = False
+            return False
+
+    def copy_file(self, src, dst):
+        """Copy src to dst, in the kernel where copy_file_range is available"""
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            copied = 0
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    while True:
+                        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE)
+                        if not sent:
+                            break
+                        copied += sent
+                        self.progress.add(sent)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    # Continue in user space from where the kernel copy stopped
+                    fsrc.seek(copied)
+                    fdst.seek(copied)
+            buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+            while True:
+                read = fsrc.readinto(buffer)
+                if not read:
+                    break
+                fdst.write(buffer[:read])
+                self.progress.add(read)
+        shutil.copystat(src, dst)
+
+def migrate_directory(source, destination, manifest):
+    """
+    Move the contents of source into the persistent directory destination and
+    remove source. Items already in destination are kept. If the migration is
+    interrupted, the next start continues it from the manifest.
+    """
+    DirectoryMigration(source, destination, manifest).run()
+
+# Incremental index of the persistent model folders
+# SQLite database of the index, next to the other persistent data by default
+MODEL_INDEX_FILENAME = 'model_index.db'
+
+# Files that are not models yet, downloads and migrations in progress
+INDEX_SKIP_SUFFIXES = ('.part', '.part.json', '.dedup', '.promoting', MIGRATING_SUFFIX)
+
+# Directories skipped like ComfyUI's own listing does
+INDEX_EXCLUDED_DIRS = ('.git',)
+
+# Largest safetensors header that is read into the index
+MAX_SAFETENSORS_HEADER = 100 * 1024 * 1024
+
+MODEL_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    root TEXT,
+    path TEXT,
+    folder TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    device INTEGER,
+    sha256 TEXT,
+    tensors INTEGER,
+    metadata TEXT,
+    indexed_time REAL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS models_folder ON models (folder, path);
+CREATE INDEX IF NOT EXISTS models_sha256 ON models (sha256);
+CREATE TABLE IF NOT EXISTS directories (
+    root TEXT,
+    path TEXT,
+    mtime_ns INTEGER,
+    PRIMARY KEY (root, path)
+);
+"""
+
+def mtime_from_ns(mtime_ns):
+    """The float st_mtime that os.stat reports for st_mtime_ns, as os.path.getmtime returns it"""
+    return mtime_ns // 1000000000 + (mtime_ns % 1000000000) * 1e-9
+
+def read_safetensors_header(path):
+    """Tensor count and __metadata__ of a safetensors file, (None, None) if it has no readable header"""
+    try:
+        with open(path, 'rb') as f:
+            length = int.from_bytes(f.read(8), 'little')
+            if length <= 0 or length > MAX_SAFETENSORS_HEADER:
+                return None, None
+            header = json.loads(f.read(length))
+    except (OSError, ValueError):
+        return None, None
+    if not isinstance(header, dict):
+        return None, None
+    metadata = header.pop('__metadata__', None)
+    return len(header), metadata if isinstance(metadata, dict) else None
+
+class ModelIndex:
+    """
+    Size, mtime, inode, hash and safetensors metadata of every file in the
+    persistent model folders, kept in SQLite.
+
+    refresh() brings the index of a folder up to date. A directory whose mtime
+    is unchanged has the same entries as before, so only directories where
+    files were added, removed or renamed are listed again. Files overwritten in
+    place don't change their directory, so the files of unchanged directories
+    are stat'ed and compared by size, mtime and inode. Only new and changed
+    files are read: the first scan of a library reads everything once, later
+    scans cost a stat per file and directory.
+    Used from ComfyUI's threads, a lock serializes all access.
+    """
+    def __init__(self, path, models_dir):
+        self.path = path
+        self.models_dir = os.path.realpath(models_dir)
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(MODEL_INDEX_SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def covers(self, directory):
+        """Whether directory is one of the persistent model folders, which are indexed as a whole"""
+        return os.path.dirname(os.path.realpath(directory)) == self.models_dir
+
+    def folder_of(self, root):
+        """Model folder name of an indexed root, e.g. checkpoints"""
+        return os.path.basename(root)
+
+    def refresh(self, directory):
+        """Update the index of directory, returns the number of files added, changed or removed"""
+        root = os.path.realpath(directory)
+        with self.lock:
+            connection = self._connect()
+            try:
+                changes = self._scan(connection, root)
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+        if changes:
+            logger.info(f"Model index: {changes} change(s) in {root}")
+        return changes
+
+    def _scan(self, connection, root):
+        known_dirs = dict(connection.execute('SELECT path, mtime_ns FROM directories WHERE root = ?', (root,)))
+        children = {}
+        for path in known_dirs:
+            if path:
+                children.setdefault(os.path.dirname(path), []).append(path)
+        stored = {}
+        for path, size, mtime_ns, inode in connection.execute(
+                'SELECT path, size, mtime_ns, inode FROM models WHERE root = ?', (root,)):
+            stored.setdefault(os.path.dirname(path), {})[path] = (size, mtime_ns, inode)
+        folder = self.folder_of(root)
+        changes = 0
+        seen = set()
+        visited = set()
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            directory = os.path.join(root, relative) if relative else root
+            try:
+                stat = os.stat(directory)
+            except OSError:
+                continue
+            # Symlinked directories are followed, but each directory is scanned once
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            seen.add(relative)
+            if known_dirs.get(relative) == stat.st_mtime_ns:
+                changes += self._check_files(connection, root, folder, stored.get(relative, {}))
+                pending.extend(children.get(relative, []))
+                continue
+            changes += self._scan_directory(connection, root, folder, relative, directory, stored.get(relative, {}), pending)
+            connection.execute('INSERT OR REPLACE INTO directories (root, path, mtime_ns) VALUES (?, ?, ?)',
+                               (root, relative, stat.st_mtime_ns))
+
+        # Directories that are gone, with the files that were in them
+        for relative in set(known_dirs) - seen:
+            connection.execute('DELETE FROM directories WHERE root = ? AND path = ?', (root, relative))
+            prefix = escape_like(os.path.join(relative, '')) if relative else ''
+            changes += connection.execute("DELETE FROM models WHERE root = ? AND path LIKE ? ESCAPE '\\'",
+                                          (root, prefix + '%')).rowcount
+        return changes
+
+    def _index_file(self, connection, root, folder, path, stat):
+        """Write the row of a new or changed file"""
+        tensors, metadata = None, None
+        if path.endswith('.safetensors'):
+            tensors, metadata = read_safetensors_header(os.path.join(root, path))
+        # A changed file has a new hash, it is computed again when needed
+        connection.execute(
+            'INSERT OR REPLACE INTO models (root, path, folder, size, mtime_ns, inode, device, sha256, tensors, metadata, indexed_time) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?)',
+            (root, path, folder, stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev, tensors,
+             json.dumps(metadata) if metadata is not None else None, time.time()))
+
+    def _check_files(self, connection, root, folder, stored):
+        """Stat the indexed files of an unchanged directory, catching files overwritten in place"""
+        changes = 0
+        for path, known in stored.items():
+            try:
+                stat = os.stat(os.path.join(root, path))
+            except OSError:
+                connection.execute('DELETE FROM models WHERE root = ? AND path = ?', (root, path))
+                changes += 1
+                continue
+            if known != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                self._index_file(connection, root, folder, path, stat)
+                changes += 1
+        return changes
+
+    def _scan_directory(self, connection, root, folder, relative, directory, stored, pending):
+        """Index the files directly in one changed directory and queue its subdirectories"""
+        prefix = os.path.join(relative, '') if relative else ''
+        changes = 0
+        present = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                path = prefix + entry.name
+                try:
+                    if entry.is_dir():
+                        if entry.name not in INDEX_EXCLUDED_DIRS:
+                            pending.append(path)
+                        continue
+                    if not entry.is_file() or entry.name.endswith(INDEX_SKIP_SUFFIXES):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                present.add(path)
+                if stored.get(path) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                    continue
+                self._index_file(connection, root, folder, path, stat)
+                changes += 1
+
+        for path in set(stored) - present:
+            connection.execute('DELETE FROM models WHERE root = ? AND path = ?', (root, path))
+            changes += 1
+        return changes
+
+    def list_directory(self, directory):
+        """
+        Refresh directory and list it like folder_paths.recursive_search: the
+        files relative to directory and the mtime of every directory below it
+        """
+        self.refresh(directory)
+        root = os.path.realpath(directory)
+        with self.lock:
+            connection = self._connect()
+            files = [row[0] for row in connection.execute('SELECT path FROM models WHERE root = ?', (root,))]
+            dirs = {(os.path.join(directory, path) if path else directory): mtime_from_ns(mtime_ns)
+                    for path, mtime_ns in connection.execute('SELECT path, mtime_ns FROM directories WHERE root = ?', (root,))}
+        return files, dirs
+
+    def refresh_all(self):
+        """Refresh every persistent model folder"""
+        changes = 0
+        for entry in os.scandir(self.models_dir):
+            if entry.is_dir():
+                changes += self.refresh(entry.path)
+        with self.lock:
+            # Folders that were removed altogether
+            connection = self._connect()
+            for (root,) in connection.execute('SELECT DISTINCT root FROM directories').fetchall():
+                if not os.path.isdir(root):
+                    changes += connection.execute('DELETE FROM models WHERE root = ?', (root,)).rowcount
+                    connection.execute('DELETE FROM directories WHERE root = ?', (root,))
+            connection.commit()
+        return changes
+
+    def locate(self, path):
+        """Indexed root and relative path of a file in a persistent model folder, None if it isn't in one"""
+        relative = os.path.relpath(os.path.realpath(path), self.models_dir).split(os.sep)
+        if len(relative) < 2 or relative[0] == os.pardir:
+            return None
+        return os.path.join(self.models_dir, relative[0]), os.path.join(*relative[1:])
+
+    def indexed_hash(self, path):
+        """SHA-256 the index has for path as of its last refresh, None if unknown"""
+        location = self.locate(path)
+        if location is None:
+            return None
+        with self.lock:
+            row = self._connect().execute('SELECT sha256 FROM models WHERE root = ? AND path = ?', location).fetchone()
+        return row[0] if row else None
+
+    def record_hash(self, path, sha256):
+        """
+        Store the SHA-256 of a file in a persistent model folder, e.g. one that
+        was just downloaded. Returns False if the file isn't in the index.
+        """
+        location = self.locate(path)
+        if location is None:
+            return False
+        root, relative = location
+        self.refresh(root)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        with self.lock:
+            connection = self._connect()
+            updated = connection.execute(
+                'UPDATE models SET sha256 = ? WHERE root = ? AND path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (sha256.lower(), root, relative, stat.st_size, stat.st_mtime_ns, stat.st_ino)).rowcount
+            connection.commit()
+        return updated > 0
+
+    def files(self, min_size=0):
+        """Every indexed file of at least min_size bytes"""
+        with self.lock:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT root, path, size, mtime_ns, inode, device, sha256 FROM models WHERE size >= ?', (min_size,)).fetchall()
+        return [{
+            'root': root,
+            'path': path,
+            'full_path': os.path.join(root, path),
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'inode': inode,
+            'device': device,
+            'sha256': sha256
+        } for root, path, size, mtime_ns, inode, device, sha256 in rows]
+
+    def set_hash(self, entry, sha256):
+        """Store the SHA-256 computed for an entry of files(), unless the file changed in the meantime"""
+        with self.lock:
+            connection = self._connect()
+            connection.execute(
+                'UPDATE models SET sha256 = ? WHERE root = ? AND path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (sha256, entry['root'], entry['path'], entry['size'], entry['mtime_ns'], entry['inode']))
+            connection.commit()
+
+    def query(self, folder=None, search=None, sha256=None, limit=100, offset=0):
+        """Indexed models by folder and path, filtered by folder, part of the path or hash"""
+        conditions, params = [], []
+        if folder:
+            conditions.append('folder = ?')
+            params.append(folder)
+        if search:
+            conditions.append("path LIKE ? ESCAPE '\\'")
+            params.append('%' + escape_like(search) + '%')
+        if sha256:
+            conditions.append('sha256 = ?')
+            params.append(sha256.lower())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self.lock:
+            connection = self._connect()
+            total = connection.execute(f'SELECT COUNT(*) FROM models {where}', params).fetchone()[0]
+            rows = connection.execute(
+                f'SELECT folder, path, root, size, mtime_ns, sha256, tensors, metadata FROM models {where} '
+                'ORDER BY folder, path LIMIT ? OFFSET ?', params + [limit, offset]).fetchall()
+        models = [{
+            'folder': folder,
+            'path': path,
+            'full_path': os.path.join(root, path),
+            'size': size,
+            'modified': mtime_ns / 1e9,
+            'sha256': sha256,
+            'tensors': tensors,
+            'metadata': json.loads(metadata) if metadata else None
+        } for folder, path, root, size, mtime_ns, sha256, tensors, metadata in rows]
+        return total, models
+
+def escape_like(text):
+    """Escape text for a LIKE pattern with ESCAPE '\\'"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Content-addressed store that duplicate models are linked to
+MODEL_STORE_DIRNAME = '.model_store'
+
+# Smaller files are not worth deduplicating
+DEDUP_MIN_SIZE = 1024 * 1024
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Duplicates are replaced through <file>.dedup, renamed over the file
+DEDUP_SUFFIX = '.dedup'
+
+def hash_file(path):
+    """SHA-256 of a file"""
+    hasher = hashlib.sha256()
+    buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(buffer[:read])
+    return hasher.hexdigest()
+
+class ModelStore:
+    """
+    Content-addressed store for the persistent model folders.
+
+    Files are stored as <store>/<first two hex digits>/<sha256>, hardlinked
+    to the model files with that content. Duplicate models, for example the
+    same checkpoint in two folders or a second download of a model, become
+    hardlinks of one stored file, or reflinks where hardlinks aren't possible.
+    Hashes come from the model index. Only files whose size matches another
+    file are hashed, and the hashes are stored in the index so they are
+    computed once. Stored files no model links to anymore are pruned when
+    ComfyUI starts and after deduplication, and a download prunes the stored
+    copy of the file it replaced.
+    """
+    def __init__(self, path, model_index):
+        self.path = path
+        self.index = model_index
+        self.lock = threading.Lock()
+
+    def store_path(self, sha256):
+        return os.path.join(self.path, sha256[:2], sha256)
+
+    def find_duplicates(self):
+        """
+        Groups of indexed files with the same content and more than one inode,
+        as (sha256, size, [index entry]), and the number and bytes of the
+        files that had to be hashed to find them
+        """
+        self.index.refresh_all()
+        by_size = {}
+        for entry in self.index.files(min_size=DEDUP_MIN_SIZE):
+            by_size.setdefault(entry['size'], []).append(entry)
+
+        hashed, hashed_bytes = 0, 0
+        by_hash = {}
+        inode_hashes = {}
+        for size, entries in by_size.items():
+            # A file with a size no other file has can't have a duplicate
+            if len({(entry['device'], entry['inode']) for entry in entries}) < 2:
+                continue
+            for entry in entries:
+                inode = (entry['device'], entry['inode'])
+                if entry['sha256'] is None and inode in inode_hashes:
+                    entry['sha256'] = inode_hashes[inode]
+                    self.index.set_hash(entry, entry['sha256'])
+                elif entry['sha256'] is None:
+                    try:
+                        entry['sha256'] = hash_file(entry['full_path'])
+                    except OSError as e:
+                        logger.warning(f"Could not hash {entry['full_path']}: {e}")
+                        continue
+                    self.index.set_hash(entry, entry['sha256'])
+                    hashed += 1
+                    hashed_bytes += size
+                inode_hashes[inode] = entry['sha256']
+                by_hash.setdefault(entry['sha256'], []).append(entry)
+
+        groups = []
+        for sha256, entries in by_hash.items():
+            if len({(entry['device'], entry['inode']) for entry in entries}) > 1:
+                entries.sort(key=lambda entry: entry['full_path'])
+                groups.append((sha256, entries[0]['size'], entries))
+        return groups, hashed, hashed_bytes
+
+    def deduplicate(self, dry_run=True):
+        """
+        Link duplicate models to the store. With dry_run only report what
+        would be linked and the bytes that would be reclaimed.
+        """
+        with self.lock:
+            started = time.monotonic()
+            groups, hashed, hashed_bytes = self.find_duplicates()
+            report = {
+                'dry_run': dry_run,
+                'hashed_files': hashed,
+                'hashed_bytes': hashed_bytes,
+                'duplicate_files': 0,
+                'reclaimable_bytes': 0,
+                'linked_files': 0,
+                'reclaimed_bytes': 0,
+                'removed_store_files': 0,
+                'errors': [],
+                'groups': []
+            }
+            for sha256, size, entries in groups:
+                inodes = {(entry['device'], entry['inode']) for entry in entries}
+                report['duplicate_files'] += len(inodes) - 1
+                report['reclaimable_bytes'] += size * (len(inodes) - 1)
+                report['groups'].append({'sha256': sha256, 'size': size, 'files': [entry['full_path'] for entry in entries]})
+                if not dry_run:
+                    self.link_group(sha256, size, entries, report)
+            if not dry_run:
+                report['removed_store_files'] = self.prune()
+            report['seconds'] = round(time.monotonic() - started, 3)
+
+        action = 'would reclaim' if dry_run else 'reclaimed'
+        reclaimed = report['reclaimable_bytes'] if dry_run else report['reclaimed_bytes']
+        logger.info(f"Model dedup: {report['duplicate_files']} duplicate file(s) in {len(groups)} group(s), "
+                    f"{action} {reclaimed / (1024 * 1024):.2f} MB, hashed {hashed} file(s)")
+        return report
+
+    def verify(self, entry, sha256):
+        """
+        Whether the file of an index entry still has the content sha256. A
+        file whose size, mtime or inode differ from the entry changed after it
+        was indexed and is hashed again.
+        """
+        stat = os.stat(entry['full_path'])
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) == (entry['size'], entry['mtime_ns'], entry['inode']):
+            return True
+        logger.info(f"Model dedup: {entry['full_path']} changed since it was indexed, hashing it again")
+        return hash_file(entry['full_path']) == sha256
+
+    def link_group(self, sha256, size, entries, report):
+        """Make every file of a group a link of the stored copy"""
+        canonical = None
+        for entry in entries:
+            try:
+                canonical = self.adopt(entry['full_path'], sha256, entry)
+            except OSError as e:
+                report['errors'].append(f"{entry['full_path']}: {e}")
+                continue
+            if canonical is not None:
+                break
+        if canonical is None:
+            return
+        canonical_stat = os.stat(canonical)
+        for entry in entries:
+            path = entry['full_path']
+            if (entry['device'], entry['inode']) == (canonical_stat.st_dev, canonical_stat.st_ino):
+                continue
+            try:
+                # The index could be out of date, only a file that still has the content is replaced
+                if not self.verify(entry, sha256):
+                    logger.info(f"Model dedup: {path} no longer matches {sha256}, skipped")
+                    continue
+                method = self.replace_with_link(path, canonical)
+            except OSError as e:
+                report['errors'].append(f"{path}: {e}")
+                continue
+            if method is None:
+                continue
+            self.index.record_hash(path, sha256)
+            report['linked_files'] += 1
+            if method == 'linked':
+                report['reclaimed_bytes'] += size
+            logger.info(f"Model dedup: {method} {path} to {canonical}")
+
+    def adopt(self, path, sha256, entry=None):
+        """
+        Stored copy of a content, linking path into the store if it isn't
+        stored yet. Falls back to path itself if the store is on another filesystem.
+        With the index entry the hash came from, path is only stored if it still
+        has that content, otherwise None is returned.
+        """
+        stored = self.store_path(sha256)
+        if os.path.exists(stored):
+            return stored
+        if entry is not None and not self.verify(entry, sha256):
+            return None
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        try:
+            os.link(path, stored)
+            return stored
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            return path
+
+    def replace_with_link(self, path, canonical):
+        """Replace path by a hardlink, or a reflink, of canonical. Returns how, or None if neither is possible"""
+        temp_path = path + DEDUP_SUFFIX
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(canonical, temp_path)
+            method = 'linked'
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS or FICLONE is None:
+                return None
+            try:
+                with open(canonical, 'rb') as fsrc, open(temp_path, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                method = 'cloned'
+            except OSError:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return None
+        os.replace(temp_path, path)
+        return method
+
+    def link_download(self, path, sha256):
+        """
+        Link a finished download into the store, replacing it by the stored
+        copy if the same content is stored already
+        """
+        # The download may have replaced a file that was linked to the store, its
+        # stored copy is the only one that can have lost its last model
+        replaced = self.index.indexed_hash(path)
+        if replaced is not None and replaced != sha256:
+            with self.lock:
+                self.prune([replaced])
+        if os.path.getsize(path) < DEDUP_MIN_SIZE:
+            return None
+        with self.lock:
+            stored = self.store_path(sha256)
+            if not os.path.exists(stored):
+                self.adopt(path, sha256)
+                return 'stored'
+            if os.path.samefile(stored, path) or os.path.getsize(stored) != os.path.getsize(path):
+                return None
+            method = self.replace_with_link(path, stored)
+        if method is not None:
+            logger.info(f"Model dedup: {method} download {path} to {stored}")
+        return method
+
+    def prune(self, hashes=None):
+        """Remove stored files no model links to anymore, all of them or those of the given hashes"""
+        if hashes is not None:
+            paths = [self.store_path(sha256) for sha256 in hashes]
+        elif os.path.isdir(self.path):
+            paths = [entry.path for prefix in os.scandir(self.path) if prefix.is_dir() for entry in os.scandir(prefix.path)]
+        else:
+            paths = []
+        removed = 0
+        for path in paths:
+            try:
+                if os.path.isfile(path) and os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Could not remove {path} from the model store: {e}")
+        return removed
+
+# Fast cache tier in front of the persistent model folders
+# Copies being promoted are written to <file>.promoting and renamed once complete
+PROMOTING_SUFFIX = '.promoting'
+
+class ModelCacheTier:
+    """
+    Size-capped copy of the most recently used models on a fast disk, in front
+    of the persistent model folders on a large, slow volume.
+
+    resolve() maps a model path to its copy in the cache tier when there is an
+    up to date one (same size and mtime). Otherwise it returns the path
+    unchanged and queues the model to be copied to the cache tier by a
+    background thread, which first evicts the least recently used copies
+    until the model fits. The slow volume always keeps every model, so
+    evicting only removes the copy. The cache's directory layout mirrors
+    models/. The access time of a copy records its last use, so the LRU order
+    survives restarts.
+    """
+    def __init__(self, path, models_dir, capacity):
+        self.path = path
+        self.models_dir = os.path.realpath(models_dir)
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # Cached models by path relative to models/, least recently used first, with the (size, mtime) they were copied at
+        self.entries = OrderedDict()
+        self.used = 0
+        self.promoting = set()
+        self.stats = {'hits': 0, 'misses': 0, 'promoted_files': 0, 'promoted_bytes': 0, 'evictions': 0, 'evicted_bytes': 0}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence_model_cache')
+        os.makedirs(path, exist_ok=True)
+        self.load()
+
+    def load(self):
+        """Take stock of the copies already in the cache, dropping stale and unfinished ones"""
+        found = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                cached = os.path.join(root, name)
+                relative = os.path.relpath(cached, self.path)
+                try:
+                    stat = os.stat(cached)
+                    if name.endswith(PROMOTING_SUFFIX):
+                        os.remove(cached)
+                        continue
+                    cold = os.stat(os.path.join(self.models_dir, relative))
+                    if (cold.st_size, cold.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                        os.remove(cached)
+                        continue
+                except FileNotFoundError:
+                    try:
+                        os.remove(cached)
+                    except OSError:
+                        pass
+                    continue
+                except OSError as e:
+                    logger.warning(f"Could not check cached model {cached}: {e}")
+                    continue
+                found.append((stat.st_atime_ns, relative, stat.st_size, stat.st_mtime_ns))
+        for _, relative, size, mtime_ns in sorted(found):
+            self.entries[relative] = (size, mtime_ns)
+            self.used += size
+        logger.info(f"Model cache tier {self.path}: {len(self.entries)} model(s), "
+                    f"{self.used / (1024 ** 3):.2f} GB of {self.capacity / (1024 ** 3):.2f} GB")
+
+    def resolve(self, path):
+        """Path to load a model from: its copy in the cache tier, or path itself on a miss"""
+        real = os.path.realpath(path)
+        relative = os.path.relpath(real, self.models_dir)
+        if relative.startswith(os.pardir + os.sep) or relative == os.pardir:
+            return path
+        try:
+            cold = os.stat(real)
+        except OSError:
+            return path
+
+        cached = os.path.join(self.path, relative)
+        with self.lock:
+            hit = self.entries.get(relative) == (cold.st_size, cold.st_mtime_ns)
+            if hit:
+                self.entries.move_to_end(relative)
+        if hit:
+            try:
+                # Record the use in the access time, keeping the mtime the copy is checked against
+                os.utime(cached, ns=(time.time_ns(), cold.st_mtime_ns))
+                with self.lock:
+                    self.stats['hits'] += 1
+                return cached
+            except FileNotFoundError:
+                # Removed behind our back
+                with self.lock:
+                    self.forget(relative)
+
+        with self.lock:
+            self.stats['misses'] += 1
+            if relative in self.promoting or cold.st_size > self.capacity:
+                return path
+            self.promoting.add(relative)
+        self.executor.submit(self.promote, relative, real, cold)
+        return path
+
+    def forget(self, relative):
+        """Drop an entry, called with the lock held"""
+        entry = self.entries.pop(relative, None)
+        if entry is not None:
+            self.used -= entry[0]
+
+    def evict(self, relative):
+        """Remove the copy of a model, called with the lock held"""
+        size = self.entries[relative][0]
+        self.forget(relative)
+        try:
+            os.remove(os.path.join(self.path, relative))
+        except FileNotFoundError:
+            pass
+        self.stats['evictions'] += 1
+        self.stats['evicted_bytes'] += size
+        logger.info(f"Model cache tier: evicted {relative} ({size / (1024 * 1024):.2f} MB)")
+
+    def promote(self, relative, real, cold):
+        """Copy a model to the cache tier, in the background thread"""
+        cached = os.path.join(self.path, relative)
+        temp_path = cached + PROMOTING_SUFFIX
+        try:
+            with self.lock:
+                if relative in self.entries:
+                    # A stale copy of an older version of the model
+                    self.evict(relative)
+                while self.entries and self.used + cold.st_size > self.capacity:
+                    self.evict(next(iter(self.entries)))
+            if shutil.disk_usage(self.path).free < cold.st_size:
+                logger.warning(f"Model cache tier: not enough free space for {relative}")
+                return
+
+            started = time.monotonic()
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            shutil.copyfile(real, temp_path)
+            os.utime(temp_path, ns=(time.time_ns(), cold.st_mtime_ns))
+            # The model could have been replaced while it was copied
+            current = os.stat(real)
+            if (current.st_size, current.st_mtime_ns) != (cold.st_size, cold.st_mtime_ns):
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, cached)
+            with self.lock:
+                self.entries[relative] = (cold.st_size, cold.st_mtime_ns)
+                self.used += cold.st_size
+                self.stats['promoted_files'] += 1
+                self.stats['promoted_bytes'] += cold.st_size
+            logger.info(f"Model cache tier: promoted {relative} ({cold.st_size / (1024 * 1024):.2f} MB) "
+                        f"in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.warning(f"Model cache tier: could not promote {relative}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.promoting.discard(relative)
+
+    def snapshot(self):
+        """Usage and hit rate of the cache tier"""
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                path=self.path,
+                capacity_bytes=self.capacity,
+                used_bytes=self.used,
+                cached_files=len(self.entries),
+                promoting=sorted(self.promoting),
+                hit_rate=round(self.stats['hits'] / lookups, 4) if lookups else None
+            )
+
+# Index of generated outputs, so they can be listed without walking the output directory
+OUTPUT_INDEX_FILENAME = 'output_index.db'
+
+OUTPUT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT,
+    prompt_id TEXT,
+    node TEXT,
+    size INTEGER,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS outputs_prompt ON outputs (prompt_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS outputs_path ON outputs (path);
+"""
+
+def output_shard(filename_prefix):
+    """
+    Subdirectory of the output directory a save with this prefix goes to:
+    today's date, then a bucket from the hash of the prefix. Every file of a
+    prefix on a day lands in one directory, so ComfyUI's file counter, which
+    lists that directory, keeps working and stays fast.
+    """
+    bucket = hashlib.sha1(filename_prefix.encode()).hexdigest()[:2]
+    return os.path.join(time.strftime('%Y-%m-%d'), bucket)
+
+class OutputIndex:
+    """
+    Append-only SQLite log of the files written to the output directory, with
+    the prompt that produced them. Rows are only ever inserted, one per path:
+    a file reported again, e.g. by a cached node of a later prompt, keeps its
+    first row. Pages are read by id, so listing stays fast however many
+    outputs there are.
+    Used from ComfyUI's execution thread and the server, a lock serializes access.
+    """
+    def __init__(self, path, output_dir):
+        self.path = path
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(OUTPUT_INDEX_SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def record_prompt(self, prompt_id, outputs):
+        """
+        Record the output files of a finished prompt, from the outputs of its
+        history entry ({node: {"images": [{"filename", "subfolder", "type"}], ...}}).
+        Returns the number of files that weren't recorded before.
+        """
+        rows = []
+        for node, ui in (outputs or {}).items():
+            if not isinstance(ui, dict):
+                continue
+            for items in ui.values():
+                if not isinstance(items, list):
+                    continue
+                for item in items:
+                    if not isinstance(item, dict) or item.get('type') != 'output' or not item.get('filename'):
+                        continue
+                    path = os.path.normpath(os.path.join(item.get('subfolder') or '', item['filename']))
+                    try:
+                        stat = os.stat(os.path.join(self.output_dir, path))
+                    except OSError:
+                        continue
+                    rows.append((path, prompt_id, str(node), stat.st_size, stat.st_mtime))
+        if not rows:
+            return 0
+        with self.lock:
+            connection = self._connect()
+            before = connection.total_changes
+            connection.executemany('INSERT OR IGNORE INTO outputs (path, prompt_id, node, size, created) VALUES (?, ?, ?, ?, ?)', rows)
+            connection.commit()
+            return connection.total_changes - before
+
+    def query(self, prompt_id=None, before=None, limit=100):
+        """
+        Outputs newest first, limit at a time. before is the id to continue
+        below, the next page starts at the returned cursor (None on the last page).
+        """
+        conditions, params = [], []
+        if prompt_id:
+            conditions.append('prompt_id = ?')
+            params.append(prompt_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        page_conditions, page_params = list(conditions), list(params)
+        if before is not None:
+            page_conditions.append('id < ?')
+            page_params.append(before)
+        page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+        with self.lock:
+            connection = self._connect()
+            total = connection.execute(f'SELECT COUNT(*) FROM outputs {where}', params).fetchone()[0]
+            rows = connection.execute(
+                f'SELECT id, path, prompt_id, node, size, created FROM outputs {page_where} ORDER BY id DESC LIMIT ?',
+                page_params + [limit]).fetchall()
+        outputs = [{
+            'id': id,
+            'path': path,
+            'subfolder': os.path.dirname(path),
+            'filename': os.path.basename(path),
+            'prompt_id': prompt_id,
+            'node': node,
+            'size': size,
+            'created': created
+        } for id, path, prompt_id, node, size, created in rows]
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return total, outputs, next_cursor
+
+# Memory backed temp directory
+# Seconds between sweeps of the memory temp directory
+TEMP_SWEEP_INTERVAL = 5.0
+
+# Files younger than this are not evicted, a preview still being shown keeps its file
+TEMP_MIN_AGE = 30.0
+
+# Eviction frees space down to this share of the budget, so it doesn't run on every sweep
+TEMP_LOW_WATERMARK = 0.9
+
+def memory_filesystem_dir():
+    """A writable memory backed directory (tmpfs), None if there is none"""
+    candidate = os.environ.get('COMFY_TEMP_MEMORY_DIR') or '/dev/shm'
+    if os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+        return candidate
+    return None
+
+# Subfolder of the memory temp directory that links to the disk fallback
+TEMP_OVERFLOW_DIRNAME = 'overflow'
+
+class MemoryTempStorage:
+    """
+    ComfyUI's temp directory (previews, intermediate files) on tmpfs, with a
+    byte budget. A background thread evicts the oldest files when the budget
+    is exceeded, never files younger than TEMP_MIN_AGE. If the recent files
+    alone are over the budget, new previews go to disk_dir until memory usage
+    is back under the budget.
+
+    The temp directory itself never changes, so earlier previews stay
+    reachable: disk_dir is linked into it as the overflow subfolder, and saves
+    are sent there through the subfolder of their filename prefix. The files
+    in disk_dir are swept against the same budget.
+    """
+    def __init__(self, memory_dir, disk_dir, budget):
+        self.memory_dir = memory_dir
+        self.disk_dir = disk_dir
+        self.overflow_dir = os.path.join(memory_dir, TEMP_OVERFLOW_DIRNAME)
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.on_disk = False
+        self.stats = {'used_bytes': 0, 'files': 0, 'disk_used_bytes': 0, 'disk_files': 0,
+                      'evictions': 0, 'evicted_bytes': 0, 'fallbacks': 0}
+        # Files left on disk by an earlier run can't be reached anymore, like ComfyUI's own temp files
+        shutil.rmtree(disk_dir, ignore_errors=True)
+        self.ensure_directories()
+        # Never plan for more than the memory filesystem can hold
+        total = shutil.disk_usage(memory_dir).total
+        if budget > total:
+            logger.warning(f"Temp budget of {budget / (1024 * 1024):.0f} MB is larger than {memory_dir}, using {total / (1024 * 1024):.0f} MB")
+            self.budget = total
+
+    def ensure_directories(self):
+        """Create both directories and the overflow link, ComfyUI removes the temp directory at startup and shutdown"""
+        os.makedirs(self.memory_dir, exist_ok=True)
+        os.makedirs(self.disk_dir, exist_ok=True)
+        if not os.path.lexists(self.overflow_dir):
+            os.symlink(self.disk_dir, self.overflow_dir)
+
+    def save_prefix(self, filename_prefix):
+        """Filename prefix for a save to the temp directory, in the overflow subfolder while over the budget"""
+        if self.on_disk:
+            return os.path.join(TEMP_OVERFLOW_DIRNAME, filename_prefix)
+        return filename_prefix
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='persistence_temp_sweeper', daemon=True)
+        thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(TEMP_SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Could not sweep the temp directory {self.memory_dir}: {e}")
+
+    def evict(self, directory):
+        """
+        Evict the oldest files of directory, except recent ones, until its usage
+        is back to the low watermark. Returns the bytes and files left and the
+        files and bytes evicted.
+        """
+        files = []
+        # The overflow link isn't followed, the disk files are swept on their own
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.lstat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in files)
+
+        evicted, evicted_bytes = 0, 0
+        if used > self.budget:
+            target = self.budget * TEMP_LOW_WATERMARK
+            cutoff = time.time() - TEMP_MIN_AGE
+            for mtime, size, path in sorted(files):
+                if used <= target or mtime > cutoff:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                used -= size
+                evicted += 1
+                evicted_bytes += size
+            if evicted:
+                logger.info(f"Temp storage: evicted {evicted} file(s), {evicted_bytes / (1024 * 1024):.2f} MB from {directory}")
+        return used, len(files) - evicted, evicted, evicted_bytes
+
+    def sweep(self):
+        """Evict the oldest files over the budget in memory and on disk, and switch new files between them if needed"""
+        self.ensure_directories()
+        used, files, evicted, evicted_bytes = self.evict(self.memory_dir)
+        disk_used, disk_files, disk_evicted, disk_evicted_bytes = self.evict(self.disk_dir)
+
+        with self.lock:
+            self.stats['used_bytes'] = used
+            self.stats['files'] = files
+            self.stats['disk_used_bytes'] = disk_used
+            self.stats['disk_files'] = disk_files
+            self.stats['evictions'] += evicted + disk_evicted
+            self.stats['evicted_bytes'] += evicted_bytes + disk_evicted_bytes
+            if not self.on_disk and used > self.budget:
+                self.on_disk = True
+                self.stats['fallbacks'] += 1
+                logger.warning(f"Temp storage over its budget with recent files only, writing new temp files to {self.disk_dir}")
+            elif self.on_disk and used <= self.budget * TEMP_LOW_WATERMARK:
+                self.on_disk = False
+                logger.info(f"Temp storage back under its budget, writing new temp files to {self.memory_dir}")
+
+    def snapshot(self):
+        """Usage of the temp storage"""
+        with self.lock:
+            return dict(
+                self.stats,
+                memory_dir=self.memory_dir,
+                disk_dir=self.disk_dir,
+                budget_bytes=self.budget,
+                on_disk=self.on_disk
+            )
+
+# HTTP API of the persistence features, registered on ComfyUI's server
+# Page sizes of /api/models/index
+MODEL_INDEX_PAGE_SIZE = 100
+MODEL_INDEX_MAX_PAGE_SIZE = 1000
+
+# Page sizes of /api/outputs
+OUTPUTS_PAGE_SIZE = 100
+OUTPUTS_MAX_PAGE_SIZE = 1000
+
+# Content type of the Prometheus text format
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+async def query_model_index(request):
+    """
+    Query the model index: size, modification time, SHA-256 (when known) and
+    safetensors metadata of every file in the persistent model folders. The
+    index is brought up to date first (refresh=0 skips it).
+    Query parameters: folder, q (part of the path), sha256, limit and offset.
+    """
+    try:
+        import folder_paths
+        model_index = getattr(folder_paths, 'model_index', None)
+        if model_index is None:
+            return web.json_response({"success": False, "error": "The model index is not available"})
+        query = request.query
+        try:
+            limit = min(max(int(query.get('limit', MODEL_INDEX_PAGE_SIZE)), 1), MODEL_INDEX_MAX_PAGE_SIZE)
+            offset = max(int(query.get('offset', 0)), 0)
+        except ValueError as e:
+            return web.json_response({"success": False, "error": f"Invalid query parameter: {e}"})
+        
+        loop = asyncio.get_running_loop()
+        changes = 0
+        if query.get('refresh', '1') != '0':
+            changes = await loop.run_in_executor(None, model_index.refresh_all)
+        total, models = await loop.run_in_executor(
+            None, lambda: model_index.query(folder=query.get('folder'), search=query.get('q'), sha256=query.get('sha256'), limit=limit, offset=offset))
+        return web.json_response({
+            "success": True,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "changes": changes,
+            "models": models
+        })
+    except Exception as e:
+        return web.json_response({"success": False, "error": str(e)})
+
+async def deduplicate_models(request):
+    """
+    Find duplicate files in the persistent model folders and report the bytes
+    linking them to the model store would reclaim. GET only reports, POST with
+    {"dry_run": false} replaces the duplicates by links.
+    """
+    try:
+        import folder_paths
+        model_store = getattr(folder_paths, 'model_store', None)
+        if model_store is None:
+            return web.json_response({"success": False, "error": "The model store is not available"})
+        dry_run = True
+        if request.method == 'POST':
+            data = await request.json() if request.can_read_body else {}
+            dry_run = data.get('dry_run', True) is not False
+        
+        report = await asyncio.get_running_loop().run_in_executor(None, model_store.deduplicate, dry_run)
+        return web.json_response({"success": True, "report": report})
+    except Exception as e:
+        return web.json_response({"success": False, "error": str(e)})
+
+async def get_model_cache(request):
+    """Usage of the fast model cache tier: hit rate, promoted bytes, evictions and the space used"""
+    import folder_paths
+    model_cache = getattr(folder_paths, 'model_cache', None)
+    if model_cache is None:
+        return web.json_response({"success": False, "error": "The model cache tier is not enabled"})
+    return web.json_response({"success": True, "cache": model_cache.snapshot()})
+
+async def get_temp_storage(request):
+    """
+    Usage of the memory backed temp directory: bytes and files used in memory
+    and in the disk overflow against the budget, evictions and whether new
+    temp files currently go to disk
+    """
+    import folder_paths
+    temp_storage = getattr(folder_paths, 'temp_storage', None)
+    if temp_storage is None:
+        return web.json_response({"success": False, "error": "The memory temp directory is not enabled"})
+    return web.json_response({"success": True, "temp": temp_storage.snapshot()})
+
+async def list_outputs(request):
+    """
+    List generated outputs from the output index, newest first, without
+    walking the output directory. Query parameters: prompt_id, limit, and
+    before, the cursor of the next page returned by the previous one.
+    """
+    try:
+        import folder_paths
+        output_index = getattr(folder_paths, 'output_index', None)
+        if output_index is None:
+            return web.json_response({"success": False, "error": "The output index is not available"})
+        query = request.query
+        try:
+            limit = min(max(int(query.get('limit', OUTPUTS_PAGE_SIZE)), 1), OUTPUTS_MAX_PAGE_SIZE)
+            before = int(query['before']) if query.get('before') else None
+        except ValueError as e:
+            return web.json_response({"success": False, "error": f"Invalid query parameter: {e}"})
+        
+        total, outputs, next_cursor = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: output_index.query(prompt_id=query.get('prompt_id'), before=before, limit=limit))
+        return web.json_response({
+            "success": True,
+            "total": total,
+            "limit": limit,
+            "next": next_cursor,
+            "outputs": outputs
+        })
+    except Exception as e:
+        return web.json_response({"success": False, "error": str(e)})
+
+async def get_persistence_metrics(request):
+    """Metrics of the persistence patch in the Prometheus text format"""
+    import folder_paths
+    lines = []
+    get_stats = getattr(folder_paths, 'get_folder_paths_stats', None)
+    if get_stats is not None:
+        stats = get_stats()
+        lines += [
+            '# HELP persistence_folder_path_lookups get_folder_paths calls of the persistence patch, resolved on disk or from its cache',
+            '# TYPE persistence_folder_path_lookups gauge',
+            f'persistence_folder_path_lookups{{result="resolved"}} {stats["resolutions"]}',
+            f'persistence_folder_path_lookups{{result="cached"}} {stats["cache_hits"]}'
+        ]
+    return web.Response(body=''.join(line + '\n' for line in lines).encode(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+# Endpoints as (method, route, handler)
+PERSISTENCE_ENDPOINTS = [
+    ('GET', '/api/models/index', query_model_index),
+    ('GET', '/api/models/dedup', deduplicate_models),
+    ('POST', '/api/models/dedup', deduplicate_models),
+    ('GET', '/api/models/cache', get_model_cache),
+    ('GET', '/api/outputs', list_outputs),
+    ('GET', '/api/temp-storage', get_temp_storage),
+    ('GET', '/api/persistence/metrics', get_persistence_metrics),
+]
+
+def install_output_recorder(prompt_queue, output_index):
+    """
+    Record the files of every finished prompt in the output index. They are
+    taken from the history entry ComfyUI stores when the prompt is done, which
+    lists the outputs of all its nodes, whether or not a client was connected
+    to receive them.
+    """
+    if getattr(prompt_queue.task_done, 'records_outputs', False):
+        return
+    original_task_done = prompt_queue.task_done
+    
+    def task_done(item_id, history_result, *args, **kwargs):
+        item = prompt_queue.currently_running.get(item_id)
+        result = original_task_done(item_id, history_result, *args, **kwargs)
+        if item is not None and isinstance(history_result, dict):
+            try:
+                output_index.record_prompt(item[1], history_result.get('outputs'))
+            except Exception as e:
+                logger.warning(f"Could not record outputs in the output index: {e}")
+        return result
+    
+    task_done.records_outputs = True
+    prompt_queue.task_done = task_done
+
+# Whether the HTTP API and the output recorder are installed
+server_extensions_installed = False
+
+def install_server_extensions():
+    """
+    Register the HTTP API on ComfyUI's server and start recording outputs, once
+    the server and its prompt queue exist. ComfyUI creates them before it looks
+    up its custom_nodes folders, and its router accepts routes until it starts.
+    Returns whether they are installed.
+    """
+    global server_extensions_installed
+    if server_extensions_installed or web is None:
+        return server_extensions_installed
+    server = getattr(getattr(sys.modules.get('server'), 'PromptServer', None), 'instance', None)
+    if server is None or getattr(server, 'prompt_queue', None) is None or not hasattr(server, 'app'):
+        return False
+    server_extensions_installed = True
+    
+    import folder_paths
+    output_index = getattr(folder_paths, 'output_index', None)
+    if output_index is not None:
+        install_output_recorder(server.prompt_queue, output_index)
+    
+    existing_routes = {(route.method, route.resource.canonical) for route in server.app.router.routes() if route.resource is not None}
+    for method, path, handler in PERSISTENCE_ENDPOINTS:
+        if (method, path) in existing_routes:
+            logger.info(f"Found existing route for {method} {path}")
+            continue
+        server.app.router.add_route(method, path, handler)
+    logger.info("Persistence API endpoints registered")
+    return True
+
+# Seconds between checks of whether the persistent models/ layout changed
+FOLDER_PATHS_RECHECK_INTERVAL = 2.0
+
 # Define paths
 def patch_model_downloader():
     """Minimal patch for model_downloader to ensure it works with our folder paths"""
@@ -70,6 +1602,12 @@ def patch_model_downloader():
     except Exception as e:
         logger.error(f"Error preparing model downloader: {e}")
 
+def model_store_path(base_dir):
+    return os.environ.get('COMFY_MODEL_STORE') or os.path.join(base_dir, MODEL_STORE_DIRNAME)
+
+def model_index_path(base_dir):
+    return os.environ.get('COMFY_MODEL_INDEX') or os.path.join(base_dir, MODEL_INDEX_FILENAME)
+
 def patch_folder_paths(base_dir):
     """Patch the folder_paths module to use our persistent directories"""
     try:
@@ -78,15 +1616,62 @@ def patch_folder_paths(base_dir):
         # Store the original get_folder_paths function
         original_get_folder_paths = folder_paths.get_folder_paths
         
+        # get_folder_paths is called for every node definition refresh, file list and model load,
+        # so where a folder resolves to is remembered until the layout of models/ changes.
+        # Adding or removing a folder (or its symlink) changes the mtime of models/, which is
+        # checked at most every FOLDER_PATHS_RECHECK_INTERVAL seconds
+        models_dir = os.path.join(base_dir, "models")
+        resolved = {}
+        layout = {'mtime': None, 'checked': 0.0}
+        stats = {'resolutions': 0, 'cache_hits': 0, 'invalidations': 0}
+        lock = threading.Lock()
+        
+        def models_layout_changed():
+            now = time.monotonic()
+            if now - layout['checked'] < FOLDER_PATHS_RECHECK_INTERVAL:
+                return False
+            layout['checked'] = now
+            try:
+                mtime = os.stat(models_dir).st_mtime_ns
+            except OSError:
+                mtime = None
+            changed = mtime != layout['mtime']
+            layout['mtime'] = mtime
+            return changed
+        
+        def resolve_persistent_path(folder_name):
+            """The persistent directory of a folder, None if there is none"""
+            with lock:
+                if models_layout_changed() and resolved:
+                    resolved.clear()
+                    stats['invalidations'] += 1
+                if folder_name in resolved:
+                    stats['cache_hits'] += 1
+                    return resolved[folder_name]
+                stats['resolutions'] += 1
+                persistent_path = os.path.join(models_dir, folder_name)
+                if not os.path.exists(persistent_path):
+                    persistent_path = None
+                resolved[folder_name] = persistent_path
+            if persistent_path is not None:
+                logger.info(f"Using persistent path for {folder_name}: {persistent_path}")
+            return persistent_path
+        
         # Override folder paths with our persistent paths
         def patched_get_folder_paths(folder_name):
+            # ComfyUI lists its custom nodes once its server and prompt queue exist
+            if folder_name == 'custom_nodes' and not server_extensions_installed:
+                try:
+                    install_server_extensions()
+                except Exception as e:
+                    logger.error(f"Error installing the persistence API: {e}")
+            
             # Get original paths
             original_paths = original_get_folder_paths(folder_name)
             
             # If we have a persistent directory for this folder, use it instead
-            persistent_path = os.path.join(base_dir, "models", folder_name)
-            if os.path.exists(persistent_path):
-                logger.info(f"Using persistent path for {folder_name}: {persistent_path}")
+            persistent_path = resolve_persistent_path(folder_name)
+            if persistent_path is not None:
                 # Handle case where original_paths might not have a second element
                 if len(original_paths) > 1:
                     return ([persistent_path], original_paths[1])
@@ -95,6 +1680,13 @@ def patch_folder_paths(base_dir):
             
             return original_paths
         
+        def get_folder_paths_stats():
+            """How often folder paths were resolved against the disk and answered from the cache"""
+            with lock:
+                return dict(stats, cached_folders=len(resolved))
+        
+        folder_paths.get_folder_paths_stats = get_folder_paths_stats
+        
         # Also store the original get_folder_paths function with a different name
         # so nodes can access it directly if needed
         folder_paths.get_folder_paths_original = original_get_folder_paths
@@ -110,6 +1702,60 @@ def patch_folder_paths(base_dir):
         # Add this helper function to the folder_paths module
         folder_paths.get_first_folder_path = get_first_folder_path
         
+        # List the persistent model folders from the model index instead of walking them
+        model_index = ModelIndex(model_index_path(base_dir), models_dir)
+        folder_paths.model_index = model_index
+        
+        # Duplicate models can be linked to a content-addressed store, and new downloads are linked into it
+        if os.environ.get('COMFY_MODEL_DEDUP', '1') != '0':
+            model_store = ModelStore(model_store_path(base_dir), model_index)
+            # Models deleted while ComfyUI was stopped leave their stored copy behind
+            removed = model_store.prune()
+            if removed:
+                logger.info(f"Model dedup: removed {removed} stored file(s) no model uses anymore")
+            folder_paths.model_store = model_store
+        original_get_filename_list_ = getattr(folder_paths, 'get_filename_list_', None)
+        
+        def indexed_get_filename_list_(folder_name):
+            if hasattr(folder_paths, 'map_legacy'):
+                folder_name = folder_paths.map_legacy(folder_name)
+            folders = folder_paths.folder_names_and_paths[folder_name]
+            output_list = set()
+            output_folders = {}
+            for x in folders[0]:
+                files, folders_all = None, None
+                if model_index.covers(x) and os.path.isdir(x):
+                    try:
+                        files, folders_all = model_index.list_directory(x)
+                    except Exception as e:
+                        logger.warning(f"Model index unavailable for {x}, listing it directly: {e}")
+                if files is None:
+                    files, folders_all = folder_paths.recursive_search(x, excluded_dir_names=[".git"])
+                output_list.update(folder_paths.filter_files_extensions(files, folders[1]))
+                output_folders = {**output_folders, **folders_all}
+            return sorted(list(output_list)), output_folders, time.perf_counter()
+        
+        if original_get_filename_list_ is not None and hasattr(folder_paths, 'recursive_search'):
+            folder_paths.get_filename_list_ = indexed_get_filename_list_
+        
+        # With a fast cache tier, models are loaded from their copy on the fast disk once promoted
+        cache_dir = os.environ.get('COMFY_MODEL_CACHE_DIR')
+        if cache_dir:
+            capacity = int(float(os.environ.get('COMFY_MODEL_CACHE_SIZE', '50')) * 1024 ** 3)
+            model_cache = ModelCacheTier(cache_dir, models_dir, capacity)
+            folder_paths.model_cache = model_cache
+            original_get_full_path = folder_paths.get_full_path
+            
+            def tiered_get_full_path(folder_name, filename):
+                path = original_get_full_path(folder_name, filename)
+                if path is None:
+                    return None
+                return model_cache.resolve(path)
+            
+            folder_paths.get_full_path = tiered_get_full_path
+            # For lookups that aren't loads, e.g. the downloader checking which models are present
+            folder_paths.get_untiered_full_path = original_get_full_path
+        
         # Replace the function
         folder_paths.get_folder_paths = patched_get_folder_paths
         
@@ -128,6 +1774,31 @@ def patch_folder_paths(base_dir):
         temp_dir = os.path.join(base_dir, "temp")
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir, exist_ok=True)
+        
+        # Optionally keep temp files in memory, with the persistent temp directory as overflow
+        if os.environ.get('COMFY_TEMP_MEMORY', '0') == '1':
+            memory_root = memory_filesystem_dir()
+            if memory_root is None:
+                logger.warning("No memory filesystem for the temp directory, keeping it on disk")
+            else:
+                budget = int(float(os.environ.get('COMFY_TEMP_MEMORY_SIZE', '1024')) * 1024 * 1024)
+                memory_dir = os.path.join(memory_root, f"comfy-ui-temp-{os.getuid()}" if hasattr(os, 'getuid') else "comfy-ui-temp")
+                temp_storage = MemoryTempStorage(memory_dir, temp_dir, budget)
+                temp_storage.start()
+                folder_paths.temp_storage = temp_storage
+                temp_dir = memory_dir
+                logger.info(f"Keeping temp files in memory at {temp_dir} ({temp_storage.budget / (1024 * 1024):.0f} MB)")
+                
+                if hasattr(folder_paths, 'get_save_image_path'):
+                    original_temp_get_save_image_path = folder_paths.get_save_image_path
+                    
+                    def overflow_get_save_image_path(filename_prefix, output_dir, image_width=0, image_height=0):
+                        # Previews go to the overflow subfolder while memory is over the budget
+                        if os.path.normpath(output_dir) == os.path.normpath(temp_storage.memory_dir):
+                            filename_prefix = temp_storage.save_prefix(filename_prefix)
+                        return original_temp_get_save_image_path(filename_prefix, output_dir, image_width, image_height)
+                    
+                    folder_paths.get_save_image_path = overflow_get_save_image_path
         folder_paths.set_temp_directory(temp_dir)
         
         # Set user directory
@@ -142,6 +1813,23 @@ def patch_folder_paths(base_dir):
         folder_paths.temp_directory = temp_dir
         folder_paths.user_directory = user_dir
         
+        # Outputs are recorded in an index, so they can be listed without walking the output directory
+        output_index_path = os.environ.get('COMFY_OUTPUT_INDEX') or os.path.join(base_dir, OUTPUT_INDEX_FILENAME)
+        folder_paths.output_index = OutputIndex(output_index_path, output_dir)
+        
+        # Optionally spread saved outputs over date and hash subdirectories
+        if os.environ.get('COMFY_OUTPUT_SHARDING', '0') == '1' and hasattr(folder_paths, 'get_save_image_path'):
+            original_get_save_image_path = folder_paths.get_save_image_path
+            
+            def sharded_get_save_image_path(filename_prefix, output_dir, image_width=0, image_height=0):
+                # Only saves to the output directory, previews in temp stay where they are
+                if os.path.normpath(output_dir) == os.path.normpath(folder_paths.get_output_directory()):
+                    filename_prefix = os.path.join(output_shard(filename_prefix), filename_prefix)
+                return original_get_save_image_path(filename_prefix, output_dir, image_width, image_height)
+            
+            folder_paths.get_save_image_path = sharded_get_save_image_path
+            logger.info("Sharding outputs by date and prefix")
+        
         logger.info("Path patching complete")
     except ImportError:
         logger.warning("Could not import folder_paths module, skipping patching")
@@ -203,6 +1891,10 @@ def setup_persistence():
     os.makedirs(base_dir, exist_ok=True)
     os.makedirs(os.path.join(base_dir, "models"), exist_ok=True)
     
+    # Directories found where a symlink belongs are migrated, resuming an interrupted migration
+    manifest = MigrationManifest(os.path.join(base_dir, MIGRATION_MANIFEST))
+    manifest.prune()
+    
     # Create model subdirectories and symlink them
     for model_dir in model_dirs:
         persistent_path = os.path.join(base_dir, "models", model_dir)
@@ -219,19 +1911,8 @@ def setup_persistence():
                     os.unlink(app_path)
                 else:
                     # If it's a directory, we need to move its contents first
-                    # to avoid losing any existing models
-                    if os.path.isdir(app_path) and os.listdir(app_path):
-                        # Copy any files that don't exist in the persistent directory
-                        for item in os.listdir(app_path):
-                            src = os.path.join(app_path, item)
-                            dst = os.path.join(persistent_path, item)
-                            if not os.path.exists(dst):
-                                if os.path.isdir(src):
-                                    shutil.copytree(src, dst)
-                                else:
-                                    shutil.copy2(src, dst)
-                    # Now remove the directory
-                    shutil.rmtree(app_path)
+                    # to avoid losing any existing models, then remove it
+                    migrate_directory(app_path, persistent_path, manifest)
             
             # Create the symlink
             os.symlink(persistent_path, app_path)
@@ -255,19 +1936,8 @@ def setup_persistence():
                     os.unlink(app_path)
                 else:
                     # If it's a directory, we need to move its contents first
-                    # to avoid losing any existing files
-                    if os.path.isdir(app_path) and os.listdir(app_path):
-                        # Copy any files that don't exist in the persistent directory
-                        for item in os.listdir(app_path):
-                            src = os.path.join(app_path, item)
-                            dst = os.path.join(persistent_path, item)
-                            if not os.path.exists(dst):
-                                if os.path.isdir(src):
-                                    shutil.copytree(src, dst)
-                                else:
-                                    shutil.copy2(src, dst)
-                    # Now remove the directory
-                    shutil.rmtree(app_path)
+                    # to avoid losing any existing files, then remove it
+                    migrate_directory(app_path, persistent_path, manifest)
             
             # Create the symlink
             os.symlink(persistent_path, app_path)
@@ -299,4 +1969,15 @@ base_dir = setup_persistence()
 
 # This allows direct execution
 if __name__ == "__main__":
-    print("Persistence setup complete")
+    import argparse
+    parser = argparse.ArgumentParser(description='Set up ComfyUI persistence and maintain the persistent model folders')
+    parser.add_argument('--dedup', action='store_true', help='report duplicate models and the bytes linking them would reclaim')
+    parser.add_argument('--apply', action='store_true', help='with --dedup, link the duplicates to the model store')
+    # setup_persistence() adds ComfyUI's own arguments
+    args, _ = parser.parse_known_args()
+    if args.dedup:
+        model_index = ModelIndex(model_index_path(base_dir), os.path.join(base_dir, "models"))
+        report = ModelStore(model_store_path(base_dir), model_index).deduplicate(dry_run=not args.apply)
+        print(json.dumps(report, indent=2))
+    else:
+        print("Persistence setup complete")
@@ -0,0 +1,44 @@
+"""
+Shared setup for the tests
+The downloader modules import each other by name and the persistence patch
+runs its setup on import, so both directories go on sys.path and the
+persistence patch is set up in a throwaway directory before any test runs.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'src')
+DOWNLOADER_DIR = os.path.join(SRC_DIR, 'custom_nodes', 'model_downloader')
+PERSISTENCE_DIR = os.path.join(SRC_DIR, 'persistence')
+BENCHMARK_DIR = os.path.join(SRC_DIR, 'benchmarks')
+
+for path in (DOWNLOADER_DIR, PERSISTENCE_DIR, BENCHMARK_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Persistent and app directories of the session, importing persistence links them together
+SESSION_DIR = tempfile.mkdtemp(prefix='comfy-tests-')
+os.environ['COMFY_USER_DIR'] = os.path.join(SESSION_DIR, 'user')
+os.environ['COMFY_APP_DIR'] = os.path.join(SESSION_DIR, 'app')
+os.environ['COMFY_DOWNLOAD_HISTORY'] = os.path.join(SESSION_DIR, 'download_history.db')
+os.makedirs(os.environ['COMFY_APP_DIR'], exist_ok=True)
+
+# Imported before ComfyUI's stand-ins exist, so the patch doesn't modify them
+import persistence as persistence_module
+
+@pytest.fixture(scope='session')
+def persistence():
+    return persistence_module
+
+@pytest.fixture(scope='session')
+def downloader():
+    """The model downloader, on the stand-ins for ComfyUI's server and folder_paths"""
+    import download_benchmark
+    download_benchmark.install_comfy_stand_ins(os.path.join(SESSION_DIR, 'models'))
+    import model_downloader_patch
+    return model_downloader_patch
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from archive_extract import safe_entry_path
+
+@pytest.mark.parametrize('name, expected', [
+    ('model.safetensors', 'model.safetensors'),
+    ('pack/lora.safetensors', os.path.join('pack', 'lora.safetensors')),
+    ('./pack//lora.safetensors', os.path.join('pack', 'lora.safetensors')),
+    ('pack\\lora.safetensors', os.path.join('pack', 'lora.safetensors')),
+])
+def test_safe_entry_path_keeps_relative_names(tmp_path, name, expected):
+    assert safe_entry_path(str(tmp_path), name) == os.path.join(str(tmp_path), expected)
+
+@pytest.mark.parametrize('name', [
+    '',
+    '.',
+    './',
+    '/etc/passwd',
+    '\\windows\\system32',
+    '../outside.safetensors',
+    'pack/../../outside.safetensors',
+    'pack\\..\\..\\outside.safetensors',
+    'C:/model.safetensors',
+    'C:model.safetensors',
+    'model\0.safetensors',
+])
+def test_safe_entry_path_rejects_unsafe_names(tmp_path, name):
+    assert safe_entry_path(str(tmp_path), name) is None
+
+def test_safe_entry_path_rejects_escapes_through_symlinks(tmp_path):
+    destination = tmp_path / 'loras'
+    outside = tmp_path / 'outside'
+    destination.mkdir()
+    outside.mkdir()
+    (destination / 'link').symlink_to(outside)
+    assert safe_entry_path(str(destination), 'link/model.safetensors') is None
+
+def test_safe_entry_path_allows_symlinks_inside_destination(tmp_path):
+    (tmp_path / 'real').mkdir()
+    (tmp_path / 'link').symlink_to(tmp_path / 'real')
+    assert safe_entry_path(str(tmp_path), 'link/model.safetensors') == os.path.join(str(tmp_path), 'link', 'model.safetensors')
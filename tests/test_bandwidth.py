@@ -0,0 +1,82 @@
+import asyncio
+import types
+
+import pytest
+
+import bandwidth
+from bandwidth import BandwidthLimiter, TokenBucket
+
+class FakeClock:
+    """Monotonic clock that only moves when the bucket sleeps"""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(bandwidth, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(bandwidth, 'asyncio', types.SimpleNamespace(sleep=clock.sleep))
+    return clock
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(0)
+    asyncio.run(bucket.consume(10 ** 9))
+    assert clock.sleeps == []
+
+def test_bucket_keeps_the_average_rate(clock):
+    bucket = TokenBucket(1000)
+    async def run():
+        for _ in range(10):
+            await bucket.consume(500)
+    asyncio.run(run())
+    assert clock.now == pytest.approx(5.0)
+    assert max(clock.sleeps) <= bandwidth.MAX_WAIT
+
+def test_bucket_lets_large_chunks_through(clock):
+    bucket = TokenBucket(1000)
+    asyncio.run(bucket.consume(3000))
+    assert clock.now == pytest.approx(3.0)
+
+def test_bucket_burst_is_capped(clock):
+    bucket = TokenBucket(1000)
+    clock.now += 60
+    asyncio.run(bucket.consume(1000 * bandwidth.BURST_SECONDS))
+    assert clock.sleeps == []
+    asyncio.run(bucket.consume(1000))
+    assert clock.now == pytest.approx(61.0)
+
+def test_inference_limit_applies_while_busy():
+    busy = [False]
+    limiter = BandwidthLimiter(limit=2000, inference_limit=500, is_busy=lambda: busy[0])
+    assert limiter.global_rate() == 2000
+    busy[0] = True
+    assert limiter.global_rate() == 500
+
+    limiter.set_limits(limit=0)
+    assert limiter.global_rate() == 500
+    limiter.set_limits(inference_limit=0)
+    assert limiter.global_rate() == 0
+    limiter.set_limits(limit=100, clear_inference_limit=True)
+    assert limiter.global_rate() == 100
+
+def test_download_limits(clock):
+    limiter = BandwidthLimiter()
+    limiter.set_download_limit('a', 1000)
+    asyncio.run(limiter.consume('a', 2000))
+    asyncio.run(limiter.consume('b', 2000))
+    assert clock.now == pytest.approx(2.0)
+    limiter.forget('a')
+    assert limiter.snapshot()['downloads'] == {}
+
+def test_from_mbps():
+    assert bandwidth.from_mbps('1.5') == int(1.5 * 1024 * 1024)
+    with pytest.raises(ValueError):
+        bandwidth.from_mbps(-1)
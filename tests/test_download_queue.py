@@ -0,0 +1,120 @@
+import asyncio
+
+from download_queue import DownloadScheduler
+
+class Downloads:
+    """Fake downloads that run until the test releases them"""
+    def __init__(self):
+        self.started = []
+        self.released = {}
+
+    def factory(self, download_id):
+        async def download():
+            self.started.append(download_id)
+            self.released[download_id] = asyncio.Event()
+            await self.released[download_id].wait()
+        return download
+
+    async def finish(self, download_id):
+        self.released[download_id].set()
+        await settle()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def submit(scheduler, downloads, download_id, host='example.com', priority=0):
+    scheduler.submit(download_id, f'https://{host}/{download_id}.safetensors', downloads.factory(download_id), priority)
+
+def test_limits_running_downloads():
+    async def run():
+        scheduler = DownloadScheduler(max_active=2, max_per_host=2)
+        downloads = Downloads()
+        for download_id in ('a', 'b', 'c'):
+            submit(scheduler, downloads, download_id)
+        await settle()
+        assert downloads.started == ['a', 'b']
+        assert scheduler.position('c') == 0
+
+        await downloads.finish('a')
+        assert downloads.started == ['a', 'b', 'c']
+        assert scheduler.snapshot()['running'] == ['b', 'c']
+    asyncio.run(run())
+
+def test_starts_higher_priorities_first():
+    async def run():
+        scheduler = DownloadScheduler(max_active=1)
+        downloads = Downloads()
+        submit(scheduler, downloads, 'running')
+        submit(scheduler, downloads, 'low', priority=-1)
+        submit(scheduler, downloads, 'first')
+        submit(scheduler, downloads, 'second')
+        submit(scheduler, downloads, 'urgent', priority=5)
+        assert [entry['download_id'] for entry in scheduler.snapshot()['queued']] == ['urgent', 'first', 'second', 'low']
+
+        assert scheduler.reprioritize('low', 10)
+        await settle()
+        for download_id in ('running', 'low', 'urgent', 'first'):
+            await downloads.finish(download_id)
+        assert downloads.started == ['running', 'low', 'urgent', 'first', 'second']
+    asyncio.run(run())
+
+def test_limits_downloads_per_host():
+    async def run():
+        scheduler = DownloadScheduler(max_active=3, max_per_host=1)
+        downloads = Downloads()
+        submit(scheduler, downloads, 'a1', host='a.example.com')
+        submit(scheduler, downloads, 'a2', host='a.example.com')
+        submit(scheduler, downloads, 'b1', host='b.example.com')
+        await settle()
+        # A busy host doesn't hold up downloads from other hosts
+        assert downloads.started == ['a1', 'b1']
+
+        await downloads.finish('b1')
+        assert downloads.started == ['a1', 'b1']
+        await downloads.finish('a1')
+        assert downloads.started == ['a1', 'b1', 'a2']
+    asyncio.run(run())
+
+def test_raising_limits_starts_queued_downloads():
+    async def run():
+        scheduler = DownloadScheduler(max_active=1)
+        downloads = Downloads()
+        submit(scheduler, downloads, 'a')
+        submit(scheduler, downloads, 'b')
+        await settle()
+        scheduler.set_limits(max_active=2)
+        await settle()
+        assert downloads.started == ['a', 'b']
+    asyncio.run(run())
+
+def test_pause_resume_and_cancel():
+    async def run():
+        states = []
+        scheduler = DownloadScheduler(max_active=1, on_state_change=lambda download_id, state: states.append((download_id, state)))
+        downloads = Downloads()
+        submit(scheduler, downloads, 'a')
+        submit(scheduler, downloads, 'b')
+        await settle()
+
+        assert scheduler.pause('a')
+        await settle()
+        assert scheduler.snapshot()['paused'] == ['a']
+        assert downloads.started == ['a', 'b']
+        assert not scheduler.reprioritize('b', 1)
+
+        assert scheduler.resume('a')
+        assert scheduler.position('a') == 0
+        assert scheduler.cancel('a')
+        assert not scheduler.resume('a')
+        await downloads.finish('b')
+
+        assert states == [
+            ('a', 'queued'), ('a', 'downloading'), ('b', 'queued'),
+            ('a', 'paused'), ('b', 'downloading'),
+            ('a', 'queued'), ('a', 'cancelled'),
+            ('b', 'finished')
+        ]
+        assert scheduler.snapshot()['running'] == []
+        assert scheduler.snapshot()['queued'] == []
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+SIZE = 64 * 1024 * 1024
+URL = 'https://example.com/model.safetensors'
+
+@pytest.fixture
+def part_path(tmp_path):
+    return str(tmp_path / 'model.safetensors.part')
+
+def test_state_round_trips(downloader, part_path):
+    state = downloader.new_download_state(URL, part_path[:-5], SIZE, '"abc"', None, 4)
+    state['segments'][0][2] = 1024
+    downloader.save_download_state(part_path, state)
+    assert downloader.load_download_state(part_path) == state
+    assert not os.path.exists(downloader.get_state_path(part_path) + '.tmp')
+
+def test_missing_state_is_none(downloader, part_path):
+    assert downloader.load_download_state(part_path) is None
+
+@pytest.mark.parametrize('content', [
+    'not json',
+    json.dumps({'version': 0, 'segments': [[0, None, 0]]}),
+    json.dumps({'version': 1, 'segments': []}),
+])
+def test_unusable_state_is_none(downloader, part_path, content):
+    with open(downloader.get_state_path(part_path), 'w') as f:
+        f.write(content)
+    assert downloader.load_download_state(part_path) is None
+
+def test_discard_removes_part_and_state(downloader, part_path):
+    downloader.prepare_part_file(part_path)
+    downloader.save_download_state(part_path, downloader.new_download_state(URL, part_path[:-5], SIZE, None, 'yesterday', 1))
+    downloader.discard_partial_download(part_path)
+    assert not os.path.exists(part_path)
+    assert not os.path.exists(downloader.get_state_path(part_path))
+    # Discarding twice is harmless
+    downloader.discard_partial_download(part_path)
+
+def test_segments_cover_the_file(downloader):
+    state = downloader.new_download_state(URL, 'model.safetensors', SIZE + 3, None, None, 4)
+    segments = state['segments']
+    assert len(segments) == 4
+    assert segments[0][0] == 0
+    assert segments[-1][1] == SIZE + 2
+    for previous, segment in zip(segments, segments[1:]):
+        assert segment[0] == previous[1] + 1
+    assert all(segment[2] == 0 for segment in segments)
+
+def test_segments_are_never_smaller_than_a_chunk(downloader):
+    state = downloader.new_download_state(URL, 'model.safetensors', 3 * downloader.CHUNK_SIZE, None, None, 8)
+    assert len(state['segments']) == 3
+    state = downloader.new_download_state(URL, 'model.safetensors', 1024, None, None, 8)
+    assert state['segments'] == [[0, 1023, 0]]
+
+def test_connections_are_clamped_to_the_maximum(downloader):
+    state = downloader.new_download_state(URL, 'model.safetensors', 1024 * downloader.CHUNK_SIZE, None, None, 1000)
+    assert len(state['segments']) == downloader.MAX_DOWNLOAD_CONNECTIONS
+
+def test_unknown_size_uses_one_open_segment(downloader):
+    state = downloader.new_download_state(URL, 'model.safetensors', 0, None, None, 4)
+    assert state['segments'] == [[0, None, 0]]
+
+@pytest.mark.parametrize('url, total_size, etag, last_modified, accept_ranges, expected', [
+    (URL, SIZE, '"abc"', 'yesterday', True, True),
+    (URL, SIZE, '"abc"', 'yesterday', False, False),
+    ('https://example.com/other.safetensors', SIZE, '"abc"', 'yesterday', True, False),
+    (URL, SIZE + 1, '"abc"', 'yesterday', True, False),
+    (URL, 0, '"abc"', 'yesterday', True, False),
+    (URL, SIZE, '"def"', 'yesterday', True, False),
+    (URL, SIZE, '"abc"', 'today', True, False),
+])
+def test_can_resume(downloader, url, total_size, etag, last_modified, accept_ranges, expected):
+    state = downloader.new_download_state(URL, 'model.safetensors', SIZE, '"abc"', 'yesterday', 4)
+    assert downloader.can_resume(state, url, total_size, etag, last_modified, accept_ranges) is expected
+
+def test_cannot_resume_without_a_validator(downloader):
+    state = downloader.new_download_state(URL, 'model.safetensors', SIZE, None, None, 4)
+    assert not downloader.can_resume(state, URL, SIZE, None, None, True)
+
+def test_find_interrupted_downloads(downloader):
+    import folder_paths
+    part_path = os.path.join(folder_paths.get_folder_paths('loras')[0], 'interrupted.safetensors.part')
+    state = downloader.new_download_state(URL, part_path[:-5], SIZE, '"abc"', None, 2)
+    state['segments'][0][2] = 100
+    state['segments'][1][2] = 50
+    downloader.prepare_part_file(part_path)
+    downloader.save_download_state(part_path, state)
+    # A state without its .part file isn't resumable
+    orphan_path = os.path.join(folder_paths.get_folder_paths('vae')[0], 'orphan.safetensors.part')
+    downloader.save_download_state(orphan_path, downloader.new_download_state(URL, orphan_path[:-5], SIZE, '"abc"', None, 2))
+    try:
+        interrupted = downloader.find_interrupted_downloads()
+        assert [(state['part_path'], state['folder'], state['downloaded']) for state in interrupted] == [(part_path, 'loras', 150)]
+    finally:
+        downloader.discard_partial_download(part_path)
+        downloader.remove_download_state(orphan_path)
@@ -0,0 +1,136 @@
+import os
+import time
+
+import pytest
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def age(path, seconds):
+    """Move the mtime of path into the past"""
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+def bump_mtime(directory):
+    """Advance the mtime of a changed directory, filesystems with coarse timestamps may not have"""
+    stat = os.stat(directory)
+    os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+def test_output_shard_is_stable_per_prefix_and_day(persistence):
+    shard = persistence.output_shard('ComfyUI')
+    day, bucket = os.path.split(shard)
+    assert day == time.strftime('%Y-%m-%d')
+    assert len(bucket) == 2
+    assert persistence.output_shard('ComfyUI') == shard
+
+@pytest.fixture
+def model_index(persistence, tmp_path):
+    models_dir = tmp_path / 'models'
+    (models_dir / 'loras').mkdir(parents=True)
+    return persistence.ModelIndex(str(tmp_path / 'model_index.db'), str(models_dir))
+
+def test_model_index_lists_new_files(model_index):
+    loras = os.path.join(model_index.models_dir, 'loras')
+    write(os.path.join(loras, 'a.safetensors'), b'a')
+    write(os.path.join(loras, 'style', 'b.safetensors'), b'b')
+    write(os.path.join(loras, 'style', 'b.safetensors.part'), b'partial')
+
+    files, dirs = model_index.list_directory(loras)
+    assert sorted(files) == ['a.safetensors', os.path.join('style', 'b.safetensors')]
+    assert set(dirs) == {loras, os.path.join(loras, 'style')}
+    assert model_index.refresh(loras) == 0
+
+def test_model_index_refreshes_incrementally(model_index):
+    loras = os.path.join(model_index.models_dir, 'loras')
+    write(os.path.join(loras, 'style', 'old.safetensors'), b'old')
+    write(os.path.join(loras, 'kept.safetensors'), b'kept')
+    assert model_index.refresh(loras) == 2
+
+    os.remove(os.path.join(loras, 'style', 'old.safetensors'))
+    write(os.path.join(loras, 'style', 'new.safetensors'), b'new')
+    bump_mtime(os.path.join(loras, 'style'))
+    assert model_index.refresh(loras) == 2
+    files, _ = model_index.list_directory(loras)
+    assert sorted(files) == ['kept.safetensors', os.path.join('style', 'new.safetensors')]
+
+def test_model_index_catches_files_overwritten_in_place(model_index):
+    loras = os.path.join(model_index.models_dir, 'loras')
+    path = os.path.join(loras, 'model.safetensors')
+    write(path, b'first')
+    model_index.refresh(loras)
+    assert model_index.record_hash(path, 'ABC')
+    assert model_index.indexed_hash(path) == 'abc'
+
+    mtime_ns = os.stat(loras).st_mtime_ns
+    write(path, b'second version')
+    os.utime(loras, ns=(os.stat(loras).st_atime_ns, mtime_ns))
+    assert model_index.refresh(loras) == 1
+    # The old hash doesn't describe the new content
+    assert model_index.indexed_hash(path) is None
+    total, models = model_index.query(folder='loras')
+    assert total == 1
+    assert models[0]['size'] == len(b'second version')
+
+def test_model_index_drops_removed_directories(model_index):
+    loras = os.path.join(model_index.models_dir, 'loras')
+    write(os.path.join(loras, 'style', 'a.safetensors'), b'a')
+    model_index.refresh(loras)
+
+    os.remove(os.path.join(loras, 'style', 'a.safetensors'))
+    os.rmdir(os.path.join(loras, 'style'))
+    bump_mtime(loras)
+    assert model_index.refresh(loras) == 1
+    assert model_index.list_directory(loras) == ([], {loras: pytest.approx(os.path.getmtime(loras))})
+
+def test_model_index_locate(model_index):
+    path = os.path.join(model_index.models_dir, 'loras', 'style', 'a.safetensors')
+    assert model_index.locate(path) == (os.path.join(model_index.models_dir, 'loras'), os.path.join('style', 'a.safetensors'))
+    assert model_index.locate(os.path.join(model_index.models_dir, 'a.safetensors')) is None
+    assert model_index.locate(os.path.join(os.path.dirname(model_index.models_dir), 'a.safetensors')) is None
+
+@pytest.fixture
+def temp_storage(persistence, tmp_path):
+    return persistence.MemoryTempStorage(str(tmp_path / 'memory'), str(tmp_path / 'disk'), 1000)
+
+def test_temp_storage_evicts_oldest_files(temp_storage):
+    for i in range(5):
+        path = os.path.join(temp_storage.memory_dir, f'preview_{i}.png')
+        write(path, b'x' * 300)
+        age(path, 100 - i)
+    temp_storage.sweep()
+
+    assert sorted(os.listdir(temp_storage.memory_dir)) == ['overflow', 'preview_2.png', 'preview_3.png', 'preview_4.png']
+    snapshot = temp_storage.snapshot()
+    assert snapshot['used_bytes'] == 900
+    assert snapshot['evictions'] == 2
+    assert not snapshot['on_disk']
+
+def test_temp_storage_falls_back_to_disk_without_evicting_recent_files(temp_storage):
+    for i in range(4):
+        write(os.path.join(temp_storage.memory_dir, f'preview_{i}.png'), b'x' * 300)
+    temp_storage.sweep()
+
+    assert len(os.listdir(temp_storage.memory_dir)) == 5
+    assert temp_storage.snapshot()['on_disk']
+    prefix = temp_storage.save_prefix('ComfyUI_temp')
+    assert prefix == os.path.join('overflow', 'ComfyUI_temp')
+    # Saves through the overflow subfolder land on disk, not in memory
+    write(os.path.join(temp_storage.memory_dir, prefix + '.png'), b'x' * 10)
+    assert os.listdir(temp_storage.disk_dir) == ['ComfyUI_temp.png']
+
+    for name in os.listdir(temp_storage.memory_dir):
+        if name.startswith('preview_'):
+            age(os.path.join(temp_storage.memory_dir, name), 100)
+    temp_storage.sweep()
+    assert not temp_storage.snapshot()['on_disk']
+    assert temp_storage.save_prefix('ComfyUI_temp') == 'ComfyUI_temp'
+
+def test_temp_storage_recreates_removed_directories(temp_storage):
+    # ComfyUI removes its temp directory at startup and shutdown
+    os.remove(temp_storage.overflow_dir)
+    os.rmdir(temp_storage.memory_dir)
+    temp_storage.sweep()
+    assert os.path.islink(temp_storage.overflow_dir)
+    assert os.path.realpath(temp_storage.overflow_dir) == os.path.realpath(temp_storage.disk_dir)